@@ -1,8 +1,9 @@
 import sys
 import os
+import argparse
 import json
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
     QTabWidget, QLabel, QLineEdit, QTextEdit, QComboBox, 
@@ -11,71 +12,4320 @@ from PyQt5.QtWidgets import (
     QTreeWidgetItem, QSplitter, QFormLayout, QSpinBox, QDoubleSpinBox,
     QDialog, QDialogButtonBox, QHeaderView, QAbstractItemView,
     QTextBrowser, QFrame, QSizePolicy, QProgressBar, QScrollBar,
-    QSizeGrip, QToolButton, QStyle, QGridLayout
+    QSizeGrip, QToolButton, QStyle, QGridLayout, QCheckBox, QShortcut
 )
-from PyQt5.QtCore import Qt, QDate, QTimer, pyqtSignal, QSize
-from PyQt5.QtGui import QFont, QPixmap, QIcon, QPalette, QColor
+from PyQt5.QtCore import (Qt, QDate, QTimer, pyqtSignal, QSize, QThread, QPointF, QRectF, QRect, QT_VERSION_STR,
+                          QEvent)
+from PyQt5.QtGui import (QFont, QPixmap, QIcon, QPalette, QColor, QTextCursor, QImage, QPainter, QKeySequence,
+                         QImageReader, QImageWriter, QImageIOHandler)
 from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
 from weasyprint import HTML, CSS
 from weasyprint.text.fonts import FontConfiguration
 import requests
 from bs4 import BeautifulSoup
 import re
+import html
+import hashlib
+import zlib
+import shutil
 import subprocess
 import tempfile
+import glob
+import csv
+import threading
+import socket
+import queue
+import time
+import asyncio
+import http.client
+import bisect
+import hmac
+import secrets
+import math
+import random
+import statistics
+import platform
+from array import array
+from pathlib import Path
+from collections import OrderedDict, deque, Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, parse_qs, urlencode
+
+# Optional: fast in-process PDF rasterizer for the live preview
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+# Optional: zstd gives smaller archived prescriptions than zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Optional: NumPy powers the columnar visit snapshot behind the MIS report
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# fontTools ships with WeasyPrint; without it bundled fonts are embedded unsubsetted
+try:
+    from fontTools import subset as font_subset
+except ImportError:
+    font_subset = None
+
+# Fonts bundled in fonts/, by family name
+FONTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts')
+BUNDLED_FONTS = {
+    'Kalpurush': 'kalpurush.ttf',
+    'Nikosh': 'Nikosh.ttf',
+    'SolaimanLipi': 'SolaimanLipi.ttf',
+    'Siyam Rupali': 'SiyamRupali.ttf',
+    'Apona Lohit': 'AponaLohit.ttf',
+    'Noto Sans': 'NotoSans.ttf'
+}
+
+# Bundled font used for Bangla text in printed prescriptions
+PRESCRIPTION_BANGLA_FONT = 'Kalpurush'
+BANGLA_UNICODE_RANGE = "U+0964-0965, U+0980-09FF, U+200C-200D"
+BANGLA_CODEPOINTS = frozenset(range(0x0980, 0x0A00)) | {0x0964, 0x0965, 0x200C, 0x200D}
+
+# Columns of an archived prescription that are stored compressed
+ARCHIVE_PAYLOAD_COLUMNS = ('cc', 'diagnosis', 'vitals', 'systemic_exam', 'investigations',
+                           'drugs', 'advice', 'follow_up', 'doctor_info')
+
+# Columns written by save_prescription, in insert order
+PRESCRIPTION_COLUMNS = ('patient_reg_no', 'date', 'cc', 'diagnosis', 'vitals', 'systemic_exam',
+                        'investigations', 'drugs', 'advice', 'follow_up', 'doctor_info')
+
+# Catalog JSON files shared through the LAN server, by API name
+CATALOG_FILES = {
+    'drugs': 'drug_database.json',
+    'investigations': 'investigation_database.json',
+    'advice': 'advice_database.json',
+    'drug_classes': 'drug_classes.json',
+    'interactions': 'drug_interactions.json',
+    'dosing_rules': 'dosing_rules.json',
+}
+
+DEFAULT_SERVER_PORT = 8765
+
+# Shared secret every request to the clinic server must carry, made on the first --server run
+SERVER_TOKEN_FILE = 'clinic_server_token.txt'
+SERVER_TOKEN_HEADER = 'X-Clinic-Token'
+
+# Tables whose rows belong to a patient; deleted with the patient and checked by the orphan scan
+PATIENT_DEPENDENT_TABLES = ('prescriptions', 'archive.archived_prescriptions', 'patient_images', 'vitals',
+                            'visit_queue', 'patient_allergies')
+
+# How uploaded images are stored: (setting, label, file extension); None keeps the file as uploaded
+IMAGE_UPLOAD_FORMATS = (
+    ('jpeg', "Compressed JPEG", '.jpg'),
+    ('webp', "Compressed WebP", '.webp'),
+    ('original', "Original file", None),
+)
+
+# Files picked up by folder and drag-and-drop uploads
+IMAGE_FILE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.webp', '.tif', '.tiff')
+
+# Threads re-encoding uploaded images
+IMAGE_IMPORT_WORKERS = min(4, os.cpu_count() or 1)
+
+# Full-resolution tiles the image viewer keeps while zoomed in (512x512 each, about 1 MB)
+IMAGE_TILE_CACHE_SIZE = 64
+
+# On-disk JPEG previews and tile pyramids of images Qt can only decode whole
+# (PNG, BMP, rotated photos), so they are decoded at full size only once
+IMAGE_VIEW_CACHE_DIR = 'image_view_cache'
+IMAGE_VIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024
+IMAGE_VIEW_PREVIEW_SIDE = 2048
+IMAGE_VIEW_CACHE_QUALITY = 90
+
+# Made-up clinic content for --benchmark
+SYNTHETIC_SYLLABLES = ('ra', 'hi', 'ma', 'sa', 'ka', 'ri', 'na', 'tu', 'la', 'mi',
+                       'jo', 'fa', 'ru', 'sha', 'ta', 'be', 'no', 'du', 'ki', 'ya')
+SYNTHETIC_GENERICS = ('Paracetamol', 'Esomeprazole', 'Omeprazole', 'Metronidazole', 'Vitamin C', 'Azithromycin',
+                      'Amlodipine', 'Allopurinol', 'Fexofenadine', 'Montelukast', 'Diclofenac', 'Hyoscine',
+                      'Pantoprazole', 'Metformin', 'Losartan', 'Atorvastatin', 'Cefixime', 'Ciprofloxacin',
+                      'Salbutamol', 'Cetirizine', 'Domperidone', 'Calcium + Vitamin D', 'Gliclazide', 'Bisoprolol')
+SYNTHETIC_FORMS = (('Tablet', 'Tab.'), ('Capsule', 'Cap.'), ('Syrup', 'Syr.'), ('Injection', 'Inj.'))
+SYNTHETIC_DIAGNOSES = ('Acute gastritis', 'Hypertension', 'Type 2 diabetes mellitus', 'Upper respiratory tract infection',
+                       'Bronchial asthma', 'Migraine', 'Urinary tract infection', 'Allergic rhinitis',
+                       'Enteric fever', 'Iron deficiency anaemia', 'Osteoarthritis of knee', 'Peptic ulcer disease')
+SYNTHETIC_COMPLAINTS = ('Fever for 3 days', 'Headache', 'Abdominal pain', 'Cough and cold', 'Burning micturition',
+                        'Chest tightness', 'Joint pain', 'Weakness', 'Vomiting', 'Sneezing')
+SYNTHETIC_INVESTIGATIONS = ('CBC', 'RBS', 'S. Creatinine', 'Urine R/E', 'Chest X-ray P/A view', 'ECG',
+                            'Lipid profile', 'USG of whole abdomen', 'HbA1c', 'SGPT')
+SYNTHETIC_ADVICE = ('Drink plenty of water', 'Take rest', 'Avoid oily food', 'Walk 30 minutes daily',
+                    'Avoid smoking', 'Take medicine on time')
+
+# Images each synthetic patient gets, and the slowdown --baseline flags, in percent
+IMAGES_PER_PATIENT = 20
+BENCHMARK_REGRESSION_PERCENT = 20
+
+# Database maintenance tasks in the order they run, with their display names
+DB_MAINTENANCE_TASKS = (
+    ('integrity_check', "Integrity check"),
+    ('analyze', "ANALYZE"),
+    ('optimize', "PRAGMA optimize"),
+    ('vacuum', "VACUUM"),
+)
+
+# One line per maintenance task run: time, task, duration, bytes reclaimed, outcome
+DB_MAINTENANCE_LOG = 'db_maintenance.log'
+
+# Nightly jobs run from their hour for this many hours; a missed night is caught up
+# once nobody has used the program for IDLE_CATCH_UP_MINUTES
+NIGHTLY_WINDOW_HOURS = 3
+IDLE_CATCH_UP_MINUTES = 15
+
+# Wait this long after a failed scheduled backup or maintenance run before trying again
+BACKUP_RETRY_MINUTES = 60
+MAINTENANCE_RETRY_MINUTES = 60
+USER_INPUT_EVENTS = frozenset((QEvent.KeyPress, QEvent.MouseButtonPress, QEvent.Wheel))
+
+# Frequent queries whose plans the DB health panel checks for index use
+DB_HEALTH_QUERIES = (
+    ("Patient history", "SELECT * FROM prescriptions WHERE patient_reg_no = 1 ORDER BY date DESC"),
+    ("Archived history", "SELECT * FROM archive.archived_prescriptions WHERE patient_reg_no = 1 ORDER BY date DESC"),
+    ("Visits by date", "SELECT COUNT(*) FROM prescriptions WHERE date >= '2000-01-01' AND date < '2000-01-02'"),
+    ("Vitals trend", "SELECT * FROM vitals WHERE patient_reg_no = 1 ORDER BY date"),
+    ("Patient images", "SELECT * FROM patient_images WHERE patient_reg_no = 1"),
+    ("Allergies", "SELECT * FROM patient_allergies WHERE patient_reg_no = 1"),
+    ("Today's queue", "SELECT * FROM visit_queue WHERE visit_date = '2000-01-01' ORDER BY token"),
+)
+
+# Change-feed entries kept for clients that fall behind; older ones force a full reload.
+# A running server trims the log every CHANGE_LOG_PRUNE_SECONDS.
+CHANGE_LOG_KEEP = 10000
+CHANGE_LOG_PRUNE_SECONDS = 600
+
+# Allowed status changes for a visit in today's queue
+QUEUE_TRANSITIONS = {
+    'waiting': ('in_consult',),
+    'in_consult': ('done', 'waiting'),
+    'done': (),
+}
+QUEUE_STATUS_LABELS = {'waiting': "Waiting", 'in_consult': "In consult", 'done': "Done"}
+
+# Columnar copy of all visits used by the MIS report, rebuilt when the data changes
+ANALYTICS_SNAPSHOT_FILE = 'analytics_snapshot.npz'
+
+# Lower bounds of the age bands in the MIS report
+MIS_AGE_BANDS = (0, 5, 15, 50)
+
+# Drug strength such as "500mg" or "120mg/5ml", read by the weight-based dose calculator
+DRUG_STRENGTH_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*mg(?:\s*/\s*(\d+(?:\.\d+)?)\s*ml)?', re.IGNORECASE)
+
+# How far below the mg/kg target a rounded-down weight-based dose may fall before none is suggested
+WEIGHT_DOSE_TOLERANCE = 0.10
+
+# Typed columns of the vitals table, in storage order
+VITALS_COLUMNS = ('systolic', 'diastolic', 'pulse', 'temperature', 'respiratory_rate', 'spo2', 'weight')
+
+# Panels of the History tab's trend chart: (title, vitals columns, line colours)
+VITALS_TREND_PANELS = (
+    ("BP (mmHg)", ('systolic', 'diastolic'), ('#E53935', '#1E88E5')),
+    ("Pulse (/min)", ('pulse',), ('#8E24AA',)),
+    ("SpO2 (%)", ('spo2',), ('#00897B',)),
+    ("Weight (kg)", ('weight',), ('#F4511E',)),
+)
+
+# Patients whose vitals series stay in memory for the trend chart
+VITALS_SERIES_CACHE_SIZE = 200
+
+# Vitals as written by save_prescription, e.g. "• BP: 120/80 mmHg"
+VITALS_PATTERNS = {
+    'bp': re.compile(r'BP:\s*(\d{2,3})\s*/\s*(\d{2,3})', re.IGNORECASE),
+    'pulse': re.compile(r'Pulse:\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+    'temperature': re.compile(r'Temp(?:erature)?:\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+    'respiratory_rate': re.compile(r'(?:Respiratory Rate|RR):\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+    'spo2': re.compile(r'SpO2:\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+    'weight': re.compile(r'Weight:\s*(\d+(?:\.\d+)?)', re.IGNORECASE),
+}
+
+# Report periods offered by the Analytics tab, in days back from today (None = all time)
+ANALYTICS_PERIODS = {
+    "This Month": 'month',
+    "Last 3 Months": 91,
+    "Last 12 Months": 365,
+    "This Year": 'year',
+    "Last 5 Years": 5 * 365,
+    "All Time": None,
+}
+
+# Bump when the prescription layout changes so cached renders are invalidated
+PRESCRIPTION_TEMPLATE_VERSION = 2
+
+# Upper bound for the on-disk cache of rendered prescription PDFs
+PDF_RENDER_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+# Static stylesheet for printed prescriptions. Kept outside the render path so
+# it is built once instead of on every create_prescription_html call.
+PRESCRIPTION_CSS = """
+    @page {
+        size: A4;
+        margin: 0.5in 0.5in 0.5in 0.5in; /* 0.5 inch margins on all sides */
+    }
+    
+    body {
+        font-family: 'Times New Roman', Times, 'Prescription Bangla', serif;
+        line-height: 1.3;
+        color: #000;
+        margin: 0;
+        padding: 0;
+        font-size: 12pt;
+    }
+    
+    .top-spacer {
+        height: 0.8in; /* ADDED: Space at the top to prevent cutting */
+        width: 100%;
+    }
+    
+    .prescription-container {
+        width: 100%;
+        height: 100%;
+        position: relative;
+    }
+    
+    .header {
+        text-align: left;
+        margin-bottom: 15px;
+        padding-bottom: 8px;
+        border-bottom: 1px solid #000;
+    }
+    
+    .doctor-name {
+        font-size: 18pt;  /* Increased from 14pt to 18pt (4pt more) */
+        font-weight: bold;
+        margin-bottom: 3px;
+    }
+    
+    .doctor-qualifications {
+        font-size: 15pt;  /* Increased from 11pt to 15pt (4pt more) */
+        margin-bottom: 2px;
+    }
+    
+    .doctor-details {
+        font-size: 14pt;  /* Increased from 10pt to 14pt (4pt more) */
+        margin-bottom: 1px;
+    }
+    
+    .prescription-title {
+        text-align: center;
+        font-size: 14pt;
+        font-weight: bold;
+        margin: 10px 0;
+        text-decoration: underline;
+    }
+    
+    .patient-info {
+        margin: 10px 0;
+        font-size: 13pt;  /* Increased from 11pt to 13pt (2pt more) */
+    }
+    
+    .content-wrapper {
+        display: flex;
+        margin-top: 10px;
+        width: 100%;
+    }
+    
+    .vertical-line {
+        border-left: 2px solid #000;
+        margin: 0 15px;
+        height: auto;
+    }
+    
+    .left-section {
+        width: 30%;
+        padding-right: 10px;
+    }
+    
+    .right-section {
+        width: 70%;
+        padding-left: 10px;
+    }
+    
+    .section {
+        margin: 8px 0;
+        page-break-inside: avoid;
+    }
+    
+    .section-title {
+        font-weight: bold;
+        margin-bottom: 3px;
+        font-size: 11pt;
+    }
+    
+    .section-content {
+        margin-left: 5px;
+        font-size: 11pt;
+        word-wrap: break-word;
+    }
+    
+    .drug-item {
+        margin: 5px 0;
+    }
+    
+    .drug-formulation {
+        font-weight: bold;
+    }
+    
+    .drug-details {
+        margin-left: 20px;
+    }
+    
+    .footer {
+        margin-top: 20px;
+        text-align: right;
+        padding-top: 10px;
+        font-size: 11pt;
+    }
+    
+    .bangla-text {
+        font-family: 'Prescription Bangla', 'Times New Roman', Times, serif;
+        font-size: 11pt;
+    }
+    
+    .date-time {
+        text-align: right;
+        margin-bottom: 5px;
+        font-size: 11pt;
+    }
+    
+    .vitals-list {
+        margin-left: 20px;
+    }
+    
+    .investigations-list {
+        margin-left: 20px;
+    }
+    
+    .advice-list {
+        margin-left: 20px;
+    }
+"""
+
+class FontSubsetCache:
+    """On-disk cache of font subsets keyed by font file and used-codepoint set.
+
+    Prescriptions that use the same Bangla characters re-use the same small
+    subset file instead of embedding a full font every time. Least recently
+    used subsets are pruned once the cache holds more than max_files.
+    """
+    def __init__(self, cache_dir='font_cache', max_files=256):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.paths = {}
+    
+    def subset_path(self, font_file, codepoints):
+        """Return the path of a subset of font_file covering codepoints"""
+        if font_subset is None or not codepoints:
+            return font_file
+        
+        key = (font_file, frozenset(codepoints))
+        path = self.paths.get(key)
+        if path and os.path.exists(path):
+            return path
+        
+        digest = hashlib.sha1()
+        digest.update(f"{os.path.abspath(font_file)}:{os.path.getmtime(font_file)}:".encode('utf-8'))
+        digest.update(",".join(f"{cp:x}" for cp in sorted(codepoints)).encode('ascii'))
+        path = os.path.join(self.cache_dir, f"{digest.hexdigest()}.ttf")
+        
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            options = font_subset.Options()
+            # Keep every OpenType layout feature so conjuncts and vowel signs still shape
+            options.layout_features = ['*']
+            options.name_IDs = ['*']
+            options.notdef_outline = True
+            font = font_subset.load_font(font_file, options)
+            subsetter = font_subset.Subsetter(options)
+            subsetter.populate(unicodes=codepoints)
+            subsetter.subset(font)
+            tmp_path = path + '.tmp'
+            font_subset.save_font(font, tmp_path, options)
+            font.close()
+            os.replace(tmp_path, path)
+            self.prune()
+        
+        self.paths[key] = path
+        return path
+    
+    def prune(self):
+        """Remove the least recently used subsets beyond max_files"""
+        try:
+            files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.endswith('.ttf')]
+            if len(files) <= self.max_files:
+                return
+            files.sort(key=os.path.getmtime)
+            for path in files[:len(files) - self.max_files]:
+                os.unlink(path)
+            self.paths = {key: value for key, value in self.paths.items() if os.path.exists(value)}
+        except Exception as e:
+            print(f"Error pruning font cache: {e}")
+
+class PdfRenderCache:
+    """Size-bounded on-disk LRU cache of rendered prescription PDFs.
+
+    Entries are keyed by a content hash; the least recently used files are
+    evicted once the cache grows past max_bytes. Hit and miss counts are kept
+    for the status bar.
+    """
+    def __init__(self, cache_dir='render_cache', max_bytes=PDF_RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self.total_bytes = 0
+        
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.endswith('.pdf')]
+            for path in sorted(paths, key=os.path.getmtime):
+                size = os.path.getsize(path)
+                self.entries[os.path.basename(path)[:-4]] = size
+                self.total_bytes += size
+        except Exception as e:
+            print(f"Error reading render cache: {e}")
+    
+    def path_for(self, key):
+        """Return the file path of a cache entry"""
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+    
+    def get(self, key):
+        """Return cached PDF bytes for key, or None on a miss"""
+        with self.lock:
+            if key in self.entries:
+                path = self.path_for(key)
+                try:
+                    with open(path, 'rb') as f:
+                        pdf_bytes = f.read()
+                    os.utime(path)
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return pdf_bytes
+                except OSError:
+                    self.total_bytes -= self.entries.pop(key)
+            self.misses += 1
+            return None
+    
+    def put(self, key, pdf_bytes):
+        """Store PDF bytes under key and evict old entries beyond max_bytes"""
+        with self.lock:
+            if len(pdf_bytes) > self.max_bytes:
+                return
+            try:
+                path = self.path_for(key)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(pdf_bytes)
+                os.replace(tmp_path, path)
+                self.total_bytes += len(pdf_bytes) - self.entries.get(key, 0)
+                self.entries[key] = len(pdf_bytes)
+                self.entries.move_to_end(key)
+                self.evict()
+            except Exception as e:
+                print(f"Error writing render cache: {e}")
+    
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            try:
+                os.unlink(self.path_for(key))
+            except OSError:
+                pass
+            self.total_bytes -= size
+    
+    def stats(self):
+        """Return hit/miss counters and current size"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+class ImageDropBox(QGroupBox):
+    """Group box that accepts image files and folders dragged onto it"""
+    files_dropped = pyqtSignal(list)
+    
+    def __init__(self, title, parent=None):
+        super().__init__(title, parent)
+        self.setAcceptDrops(True)
+    
+    def dragEnterEvent(self, event):
+        if any(url.isLocalFile() for url in event.mimeData().urls()):
+            event.acceptProposedAction()
+    
+    def dropEvent(self, event):
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        if paths:
+            event.acceptProposedAction()
+            self.files_dropped.emit(paths)
+
+def read_scaled_image(image_path, max_width, max_height):
+    """Decode an image upright at no more than max_width x max_height, never at full size first when avoidable"""
+    reader = QImageReader(image_path)
+    reader.setAutoTransform(True)
+    size = reader.size()
+    if size.isValid():
+        if reader.transformation() & QImageIOHandler.TransformationRotate90:
+            size.transpose()
+        if size.width() > max_width or size.height() > max_height:
+            size = size.scaled(max_width, max_height, Qt.KeepAspectRatio)
+            if reader.transformation() & QImageIOHandler.TransformationRotate90:
+                size.transpose()
+            reader.setScaledSize(size)
+    return reader.read()
+
+def read_image_preview(image_path, max_width, max_height):
+    """(preview QImage, full upright size, whether tiles can be decoded on their own, full image) for ImageTileView.
+    
+    The full image is only returned when it had to be decoded whole to make
+    the preview and no cached preview exists yet, so the caller can save its
+    pyramid with save_image_pyramid; otherwise it is None.
+    """
+    reader = QImageReader(image_path)
+    size = reader.size()
+    # Clip rects address the stored pixels, so rotated (EXIF) photos are cut from a whole decode instead
+    clip_reads = (reader.supportsOption(QImageIOHandler.ClipRect)
+                  and reader.transformation() == QImageIOHandler.TransformationNone)
+    if size.isValid() and reader.transformation() & QImageIOHandler.TransformationRotate90:
+        size.transpose()
+    if clip_reads or not size.isValid():
+        return read_scaled_image(image_path, max_width, max_height), size, clip_reads, None
+    
+    cache_dir = image_view_cache_dir(image_path)
+    preview_path = os.path.join(cache_dir, 'preview.jpg')
+    if os.path.exists(preview_path):
+        try:
+            os.utime(cache_dir)  # most recently used for prune_image_view_cache
+        except OSError:
+            pass
+        return read_scaled_image(preview_path, max_width, max_height), size, clip_reads, None
+    full = read_scaled_image(image_path, size.width(), size.height())
+    preview = full
+    if not full.isNull() and (full.width() > max_width or full.height() > max_height):
+        preview = full.scaled(max_width, max_height, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return preview, size, clip_reads, full
+
+def read_image_region(image_path, rect, scaled_size):
+    """Decode only rect of an image (stored orientation) at scaled_size"""
+    reader = QImageReader(image_path)
+    reader.setAutoTransform(False)
+    reader.setClipRect(rect)
+    reader.setScaledSize(scaled_size)
+    return reader.read()
+
+def flatten_alpha(image):
+    """Return the image drawn on white when it has transparency, as JPEG has none"""
+    if not image.hasAlphaChannel():
+        return image
+    flattened = QImage(image.size(), QImage.Format_RGB32)
+    flattened.fill(QColor('white'))
+    painter = QPainter(flattened)
+    painter.drawImage(0, 0, image)
+    painter.end()
+    return flattened
+
+def image_view_cache_dir(image_path):
+    """Cache folder for one version of an image file; editing or replacing the file gives a new folder"""
+    stat = os.stat(image_path)
+    key = f"{os.path.abspath(image_path)}|{stat.st_mtime_ns}|{stat.st_size}"
+    return os.path.join(IMAGE_VIEW_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+_image_view_cache_locks = {}
+_image_view_cache_locks_guard = threading.Lock()
+
+def image_view_cache_lock(cache_dir):
+    """Lock held while a cache folder is filled, so one image is never decoded whole twice at once"""
+    with _image_view_cache_locks_guard:
+        return _image_view_cache_locks.setdefault(cache_dir, threading.Lock())
+
+def image_tile_file(cache_dir, level, column, row):
+    """Path of a cached tile; tile (column, row) covers TILE_SIZE pixels of the image scaled to level"""
+    return os.path.join(cache_dir, f"{level:g}_{column}_{row}.jpg")
+
+def image_level_cached(cache_dir, level):
+    """Whether every tile of a level has been written"""
+    return os.path.exists(os.path.join(cache_dir, f"{level:g}.done"))
+
+def save_tile_level(image, cache_dir, level, tile_size):
+    """Cut an image already scaled to level into JPEG tiles, then mark the level complete"""
+    image = flatten_alpha(image)
+    for row in range(math.ceil(image.height() / tile_size)):
+        for column in range(math.ceil(image.width() / tile_size)):
+            tile = image.copy(QRect(column * tile_size, row * tile_size, tile_size, tile_size) & image.rect())
+            if not tile.save(image_tile_file(cache_dir, level, column, row), 'JPEG', IMAGE_VIEW_CACHE_QUALITY):
+                raise OSError(f"Could not write tile {column},{row} to {cache_dir}")
+    open(os.path.join(cache_dir, f"{level:g}.done"), 'w').close()
+
+def save_image_pyramid(image, cache_dir, tile_size):
+    """Save a fully decoded image as a JPEG preview plus tiles at full, half, quarter... scale.
+    
+    Levels stop once the image fits in IMAGE_VIEW_PREVIEW_SIDE, below which
+    the viewer paints the preview; the oldest cached images are then pruned.
+    """
+    with image_view_cache_lock(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+        image = flatten_alpha(image)
+        preview = image
+        if max(image.width(), image.height()) > IMAGE_VIEW_PREVIEW_SIDE:
+            preview = image.scaled(IMAGE_VIEW_PREVIEW_SIDE, IMAGE_VIEW_PREVIEW_SIDE,
+                                   Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        preview_path = os.path.join(cache_dir, 'preview.jpg')
+        if not preview.save(preview_path + '.tmp', 'JPEG', IMAGE_VIEW_CACHE_QUALITY):
+            raise OSError(f"Could not write {preview_path}")
+        os.replace(preview_path + '.tmp', preview_path)
+        
+        level = 1.0
+        scaled = image
+        while True:
+            if not image_level_cached(cache_dir, level):
+                save_tile_level(scaled, cache_dir, level, tile_size)
+            if max(scaled.width(), scaled.height()) <= IMAGE_VIEW_PREVIEW_SIDE:
+                break
+            level /= 2
+            # Scale from the previous level: cheaper and smoother than from full size each time
+            scaled = scaled.scaled(max(1, round(image.width() * level)), max(1, round(image.height() * level)),
+                                   Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+    prune_image_view_cache()
+
+def prune_image_view_cache(max_bytes=IMAGE_VIEW_CACHE_MAX_BYTES):
+    """Remove the least recently opened images' folders until the cache fits in max_bytes"""
+    folders = []
+    for entry in os.scandir(IMAGE_VIEW_CACHE_DIR):
+        if entry.is_dir():
+            size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+            folders.append((entry.stat().st_mtime, size, entry.path))
+    total = sum(size for _, size, _ in folders)
+    for _, size, path in sorted(folders):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+class ImageTileView(QWidget):
+    """Pan-and-zoom view of one image that never holds the whole image at full resolution.
+    
+    The full view is painted from a preview decoded at about screen size. Past
+    the preview's resolution the visible area is covered with TILE_SIZE tiles,
+    decoded on the shared executor with QImageReader clip rects (JPEG) at the
+    power-of-two scale nearest above the zoom; the last IMAGE_TILE_CACHE_SIZE
+    tiles are kept. Images without clip rect support are read from their
+    JPEG tile pyramid in IMAGE_VIEW_CACHE_DIR once it has been saved.
+    """
+    tile_loaded = pyqtSignal(object, QImage)
+    TILE_SIZE = 512
+    TILE_BATCH_RADIUS = 3  # tiles cut around a missing one from a whole decode: 7x7 fits in the cache
+    MAX_ZOOM = 4.0
+    
+    def __init__(self, executor, parent=None):
+        super().__init__(parent)
+        self.executor = executor
+        self.path = None
+        self.preview = None
+        self.image_size = QSize()
+        self.clip_reads = False
+        self.message = ""
+        self.scale = 1.0
+        self.fitted = True
+        self.center = QPointF()
+        self.tiles = OrderedDict()  # (path, level, column, row) -> QImage, least recently drawn first
+        self.pending = set()
+        self.drag_start = None
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.setMinimumSize(200, 200)
+        self.tile_loaded.connect(self.on_tile_loaded)
+    
+    def set_image(self, path, preview, image_size, clip_reads):
+        """Show a new image fitted to the view"""
+        self.path = path
+        self.preview = preview
+        self.image_size = QSize(image_size)
+        self.clip_reads = clip_reads
+        self.cache_dir = None
+        if not clip_reads:
+            try:
+                self.cache_dir = image_view_cache_dir(path)
+            except OSError:
+                pass
+        self.message = ""
+        self.tiles.clear()
+        self.pending.clear()
+        self.fit_to_view()
+    
+    def set_message(self, message):
+        """Show text instead of an image"""
+        self.path = None
+        self.preview = None
+        self.message = message
+        self.tiles.clear()
+        self.update()
+    
+    def fit_scale(self):
+        return min(self.width() / self.image_size.width(), self.height() / self.image_size.height())
+    
+    def fit_to_view(self):
+        """Show the whole image"""
+        if self.preview is None or self.image_size.isEmpty():
+            self.update()
+            return
+        self.fitted = True
+        self.scale = self.fit_scale()
+        self.center = QPointF(self.image_size.width() / 2, self.image_size.height() / 2)
+        self.update()
+    
+    def zoom(self, factor, anchor=None):
+        """Zoom by factor keeping the image point under anchor (widget coordinates) in place"""
+        if self.preview is None or self.image_size.isEmpty():
+            return
+        if anchor is None:
+            anchor = QPointF(self.width() / 2, self.height() / 2)
+        point = self.to_image(anchor)
+        fit = self.fit_scale()
+        self.scale = max(fit, min(self.scale * factor, max(fit, self.MAX_ZOOM)))
+        self.fitted = self.scale <= fit
+        self.center = point - (anchor - QPointF(self.width() / 2, self.height() / 2)) / self.scale
+        self.clamp_center()
+        self.update()
+    
+    def to_image(self, point):
+        """Image coordinates of a widget point"""
+        return self.center + (point - QPointF(self.width() / 2, self.height() / 2)) / self.scale
+    
+    def clamp_center(self):
+        """Keep the image on screen; centre it along axes where it fits"""
+        half_width = self.width() / 2 / self.scale
+        half_height = self.height() / 2 / self.scale
+        width, height = self.image_size.width(), self.image_size.height()
+        x = width / 2 if half_width * 2 >= width else min(max(self.center.x(), half_width), width - half_width)
+        y = height / 2 if half_height * 2 >= height else min(max(self.center.y(), half_height), height - half_height)
+        self.center = QPointF(x, y)
+    
+    def resizeEvent(self, event):
+        if self.fitted:
+            self.fit_to_view()
+        super().resizeEvent(event)
+    
+    def wheelEvent(self, event):
+        self.zoom(1.25 if event.angleDelta().y() > 0 else 0.8, QPointF(event.pos()))
+    
+    def mousePressEvent(self, event):
+        self.drag_start = (QPointF(event.pos()), self.center)
+    
+    def mouseMoveEvent(self, event):
+        if self.drag_start is not None and not self.fitted:
+            start, center = self.drag_start
+            self.center = center - (QPointF(event.pos()) - start) / self.scale
+            self.clamp_center()
+            self.update()
+    
+    def mouseReleaseEvent(self, event):
+        self.drag_start = None
+    
+    def mouseDoubleClickEvent(self, event):
+        """Toggle between the whole image and 100%"""
+        if self.fitted:
+            self.zoom(1.0 / self.scale, QPointF(event.pos()))
+        else:
+            self.fit_to_view()
+    
+    def paintEvent(self, event):
+        """Draw the visible part of the preview, then any sharper tiles over it"""
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('black'))
+        if self.preview is None or self.image_size.isEmpty():
+            painter.setPen(QColor('white'))
+            painter.drawText(self.rect(), Qt.AlignCenter, self.message)
+            painter.end()
+            return
+        
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        origin = QPointF(self.width() / 2, self.height() / 2) - self.center * self.scale
+        bounds = QRectF(0, 0, self.image_size.width(), self.image_size.height())
+        visible = QRectF(self.to_image(QPointF(0, 0)), self.to_image(QPointF(self.width(), self.height()))) & bounds
+        if visible.isEmpty():
+            painter.end()
+            return
+        
+        def on_screen(rect):
+            return QRectF(origin + rect.topLeft() * self.scale, rect.size() * self.scale)
+        
+        preview_scale = self.preview.width() / self.image_size.width()
+        source = QRectF(visible.topLeft() * preview_scale, visible.size() * preview_scale)
+        painter.drawImage(on_screen(visible), self.preview, source)
+        
+        if self.scale > preview_scale * 1.1:
+            level = min(1.0, 2 ** math.ceil(math.log2(self.scale)))
+            span = self.TILE_SIZE / level  # image pixels per tile
+            for row in range(int(visible.top() // span), math.ceil(visible.bottom() / span)):
+                for column in range(int(visible.left() // span), math.ceil(visible.right() / span)):
+                    key = (self.path, level, column, row)
+                    tile = self.tiles.get(key)
+                    if tile is None:
+                        self.request_tiles(level, column, row)
+                        continue
+                    self.tiles.move_to_end(key)
+                    painter.drawImage(on_screen(self.tile_rect(level, column, row)), tile)
+        painter.end()
+    
+    def tile_rect(self, level, column, row):
+        """Part of the image (image pixels) covered by a tile"""
+        span = self.TILE_SIZE / level
+        return QRectF(column * span, row * span, span, span) & QRectF(0, 0, self.image_size.width(), self.image_size.height())
+    
+    def request_tiles(self, level, column, row):
+        """Decode a tile in the background unless it is already on its way.
+        
+        Formats that cannot decode a clip rect (PNG, BMP, rotated photos) are
+        read from their cached tile pyramid. Until a level is cached the image
+        is decoded whole, so the tiles around the missing one are cut from that
+        same decode instead of decoding the file again for each of them.
+        """
+        if (self.path, level, column, row) in self.pending:
+            return
+        if self.clip_reads or (self.cache_dir and image_level_cached(self.cache_dir, level)):
+            cells = [(column, row)]
+        else:
+            radius = self.TILE_BATCH_RADIUS
+            cells = [(c, r) for r in range(max(row - radius, 0), row + radius + 1)
+                     for c in range(max(column - radius, 0), column + radius + 1)
+                     if (self.path, level, c, r) not in self.tiles and not self.tile_rect(level, c, r).isEmpty()]
+        jobs = [((self.path, level, c, r), self.tile_rect(level, c, r).toAlignedRect()) for c, r in cells]
+        self.pending.update(key for key, region in jobs)
+        self.executor.submit(self.load_tiles, self.path, level, self.image_size, jobs, self.clip_reads, self.cache_dir)
+    
+    def load_tiles(self, path, level, image_size, jobs, clip_reads, cache_dir):
+        """Worker side of request_tiles"""
+        def scaled(rect):
+            return QRect(round(rect.x() * level), round(rect.y() * level),
+                         max(1, round(rect.width() * level)), max(1, round(rect.height() * level)))
+        
+        if clip_reads:
+            tiles = [(key, read_image_region(path, region, scaled(region).size())) for key, region in jobs]
+        else:
+            with image_view_cache_lock(cache_dir) if cache_dir else nullcontext():
+                if cache_dir and image_level_cached(cache_dir, level):
+                    tiles = [(key, QImage(image_tile_file(cache_dir, level, key[2], key[3]))) for key, region in jobs]
+                else:
+                    whole = scaled(QRect(0, 0, image_size.width(), image_size.height()))
+                    image = read_scaled_image(path, whole.width(), whole.height())
+                    tiles = [(key, image.copy(scaled(region))) for key, region in jobs]
+                    if cache_dir and not image.isNull():
+                        # Keep the whole level so panning and later opens never decode it again
+                        try:
+                            os.makedirs(cache_dir, exist_ok=True)
+                            save_tile_level(image, cache_dir, level, self.TILE_SIZE)
+                        except OSError as e:
+                            print(f"Error caching image tiles: {e}")
+        try:
+            for key, tile in tiles:
+                self.tile_loaded.emit(key, tile)
+        except RuntimeError:
+            pass  # the viewer was closed meanwhile
+    
+    def on_tile_loaded(self, key, image):
+        """Keep a decoded tile and repaint"""
+        self.pending.discard(key)
+        if key[0] != self.path or image.isNull():
+            return
+        self.tiles[key] = image
+        while len(self.tiles) > IMAGE_TILE_CACHE_SIZE:
+            self.tiles.popitem(last=False)
+        self.update()
 
 class FullScreenImageDialog(QDialog):
-    """Dialog for displaying images in full screen"""
-    def __init__(self, image_path, parent=None):
+    """Full-screen viewer for a patient's images with zoom, pan and previous/next.
+    
+    Images open from a screen-size preview; the previous and next image's
+    previews are decoded in the background so stepping through is instant.
+    """
+    preview_loaded = pyqtSignal(str, QImage, QSize, bool)
+    
+    def __init__(self, image_path, parent=None, image_paths=None):
         super().__init__(parent)
         self.setWindowTitle("Image Viewer")
         self.setWindowState(Qt.WindowFullScreen)
         self.setModal(True)
         
-        layout = QVBoxLayout(self)
+        self.image_paths = list(image_paths or [image_path])
+        if image_path not in self.image_paths:
+            self.image_paths.insert(0, image_path)
+        self.index = self.image_paths.index(image_path)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.previews = OrderedDict()  # path -> (preview, full size, clip_reads) for the current image and its neighbours
+        self.loading = set()
+        screen_geometry = QApplication.primaryScreen().geometry()
+        self.preview_box = (screen_geometry.width(), screen_geometry.height())
+        
+        layout = QVBoxLayout(self)
+        
+        # Image view
+        self.image_view = ImageTileView(self.executor)
+        layout.addWidget(self.image_view, 1)
+        
+        # Navigation
+        controls_layout = QHBoxLayout()
+        self.previous_btn = QPushButton("◀ Previous")
+        self.previous_btn.clicked.connect(lambda: self.show_neighbour(-1))
+        self.next_btn = QPushButton("Next ▶")
+        self.next_btn.clicked.connect(lambda: self.show_neighbour(1))
+        fit_btn = QPushButton("Fit (0)")
+        fit_btn.clicked.connect(self.image_view.fit_to_view)
+        self.image_info_label = QLabel()
+        controls_layout.addWidget(self.previous_btn)
+        controls_layout.addWidget(self.next_btn)
+        controls_layout.addWidget(fit_btn)
+        controls_layout.addWidget(self.image_info_label, 1)
+        
+        # Close button
+        close_btn = QPushButton("Close (ESC)")
+        close_btn.clicked.connect(self.close)
+        close_btn.setStyleSheet("QPushButton { background-color: #f44336; color: white; font-weight: bold; padding: 10px; }")
+        controls_layout.addWidget(close_btn)
+        layout.addLayout(controls_layout)
+        
+        self.preview_loaded.connect(self.on_preview_loaded)
+        self.load_image(image_path)
+    
+    def load_image(self, image_path):
+        """Show an image from its preview, decoding the preview in the background if needed"""
+        self.image_info_label.setText(f"{os.path.basename(image_path)}  ({self.index + 1} of {len(self.image_paths)})"
+                                      f"  -  scroll to zoom, drag to move, double-click for 100%")
+        self.previous_btn.setEnabled(self.index > 0)
+        self.next_btn.setEnabled(self.index < len(self.image_paths) - 1)
+        
+        if not os.path.exists(image_path):
+            self.image_view.set_message("Image file not found")
+        elif image_path in self.previews:
+            preview, size, clip_reads = self.previews[image_path]
+            if preview.isNull():
+                self.image_view.set_message("Invalid image file")
+            else:
+                self.image_view.set_image(image_path, preview, size, clip_reads)
+        else:
+            self.image_view.set_message("Loading...")
+            self.request_preview(image_path)
+        self.prefetch_neighbours()
+    
+    def request_preview(self, image_path):
+        """Decode an image's preview on the executor"""
+        if image_path in self.loading or not os.path.exists(image_path):
+            return
+        self.loading.add(image_path)
+        self.executor.submit(self.decode_preview, image_path)
+    
+    def decode_preview(self, image_path):
+        """Worker side of request_preview"""
+        preview, size, clip_reads, full = read_image_preview(image_path, *self.preview_box)
+        try:
+            self.preview_loaded.emit(image_path, preview, size, clip_reads)
+        except RuntimeError:
+            pass  # the viewer was closed meanwhile
+        if full is not None and not full.isNull():
+            # Decoded whole once: save it so later opens and zoom steps read small JPEGs instead
+            try:
+                save_image_pyramid(full, image_view_cache_dir(image_path), ImageTileView.TILE_SIZE)
+            except OSError as e:
+                print(f"Error caching image pyramid: {e}")
+    
+    def on_preview_loaded(self, image_path, preview, size, clip_reads):
+        """Keep a decoded preview and show it if it is the current image"""
+        self.loading.discard(image_path)
+        self.previews[image_path] = (preview, size, clip_reads)
+        self.prefetch_neighbours()
+        if image_path == self.image_paths[self.index]:
+            self.load_image(image_path)
+    
+    def prefetch_neighbours(self):
+        """Decode the previous and next previews and forget the rest"""
+        wanted = self.image_paths[max(self.index - 1, 0):self.index + 2]
+        for path in list(self.previews):
+            if path not in wanted:
+                del self.previews[path]
+        for path in wanted:
+            if path not in self.previews:
+                self.request_preview(path)
+    
+    def show_neighbour(self, offset):
+        """Step to the previous (-1) or next (1) image"""
+        index = self.index + offset
+        if 0 <= index < len(self.image_paths):
+            self.index = index
+            self.load_image(self.image_paths[index])
+    
+    def keyPressEvent(self, event):
+        """Handle key press events"""
+        key = event.key()
+        if key == Qt.Key_Escape:
+            self.close()
+        elif key in (Qt.Key_Right, Qt.Key_PageDown, Qt.Key_Space):
+            self.show_neighbour(1)
+        elif key in (Qt.Key_Left, Qt.Key_PageUp, Qt.Key_Backspace):
+            self.show_neighbour(-1)
+        elif key in (Qt.Key_Plus, Qt.Key_Equal):
+            self.image_view.zoom(1.25)
+        elif key == Qt.Key_Minus:
+            self.image_view.zoom(0.8)
+        elif key == Qt.Key_0:
+            self.image_view.fit_to_view()
+        super().keyPressEvent(event)
+    
+    def done(self, result):
+        """Drop queued decodes when the viewer closes"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().done(result)
+
+class BarChartWidget(QWidget):
+    """Minimal bar chart painted with QPainter for the Analytics tab"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.labels = []
+        self.values = []
+        self.setMinimumHeight(220)
+    
+    def set_data(self, labels, values):
+        """Replace the bars and repaint"""
+        self.labels = list(labels)
+        self.values = list(values)
+        self.update()
+    
+    def paintEvent(self, event):
+        """Draw the bars, the peak value and as many labels as fit"""
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor('white'))
+        painter.setPen(QColor('#555555'))
+        if not self.values:
+            painter.drawText(self.rect(), Qt.AlignCenter, "No data for this period")
+            painter.end()
+            return
+        
+        left, top, bottom = 50, 10, 25
+        width = self.width() - left - 10
+        height = self.height() - top - bottom
+        peak = max(self.values) or 1
+        slot = width / len(self.values)
+        label_every = max(1, int(60 / slot) + 1) if slot < 60 else 1
+        
+        painter.drawText(0, top, left - 6, 20, Qt.AlignRight, str(peak))
+        painter.drawLine(left, top + height, left + width, top + height)
+        for i, (label, value) in enumerate(zip(self.labels, self.values)):
+            x = left + int(i * slot)
+            bar_height = int(height * value / peak)
+            painter.fillRect(x + 1, top + height - bar_height, max(1, int(slot) - 2), bar_height, QColor('#2196F3'))
+            if i % label_every == 0:
+                painter.drawText(x, top + height + 4, int(slot * label_every), 20, Qt.AlignLeft, str(label))
+        painter.end()
+
+class VitalsSeries:
+    """One patient's vitals over time as compact float arrays.
+    
+    days holds fractional day numbers (date.toordinal() plus time of day) in
+    ascending order; each vital has a parallel array with NaN where it was not
+    taken, so a new visit is a single append.
+    """
+    def __init__(self, rows=()):
+        self.days = array('d')
+        self.values = {col: array('d') for col in VITALS_COLUMNS}
+        for row in rows:
+            self.append(row[0], dict(zip(VITALS_COLUMNS, row[1:])))
+    
+    def __len__(self):
+        return len(self.days)
+    
+    def append(self, date, vitals):
+        """Add one visit's vitals (a VITALS_COLUMNS mapping); visits with none are ignored"""
+        if not date or all(vitals.get(col) is None for col in VITALS_COLUMNS):
+            return
+        try:
+            moment = datetime.fromisoformat(date)
+        except ValueError:
+            return
+        day = moment.toordinal() + (moment.hour * 3600 + moment.minute * 60 + moment.second) / 86400
+        index = bisect.bisect_right(self.days, day)
+        self.days.insert(index, day)
+        for col in VITALS_COLUMNS:
+            value = vitals.get(col)
+            self.values[col].insert(index, float('nan') if value is None else float(value))
+
+class VitalsTrendWidget(QWidget):
+    """BP, pulse, SpO2 and weight over time for one patient, painted with QPainter"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.series = None
+        self.setMinimumHeight(260)
+    
+    def set_series(self, series):
+        """Show a VitalsSeries (None clears the chart) and repaint"""
+        self.series = series
+        self.update()
+    
+    def paintEvent(self, event):
+        """Draw one panel per VITALS_TREND_PANELS entry in a 2 x 2 grid"""
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), QColor('white'))
+        painter.setPen(QColor('#555555'))
+        if not self.series:
+            painter.drawText(self.rect(), Qt.AlignCenter, "No vitals recorded for this patient")
+            painter.end()
+            return
+        
+        days = self.series.days
+        first_day, last_day = days[0], days[-1]
+        day_span = (last_day - first_day) or 1
+        panel_width = self.width() // 2
+        panel_height = self.height() // 2
+        for index, (title, columns, colors) in enumerate(VITALS_TREND_PANELS):
+            x0 = (index % 2) * panel_width
+            y0 = (index // 2) * panel_height
+            left, top = x0 + 45, y0 + 22
+            width = panel_width - 60
+            height = panel_height - 44
+            
+            painter.setPen(QColor('#333333'))
+            painter.drawText(x0 + 5, y0 + 2, panel_width - 10, 18, Qt.AlignLeft, title)
+            points = {col: [(day, value) for day, value in zip(days, self.series.values[col]) if value == value]
+                      for col in columns}
+            values = [value for col in columns for _, value in points[col]]
+            if not values:
+                painter.setPen(QColor('#999999'))
+                painter.drawText(left, top, width, height, Qt.AlignCenter, "Not recorded")
+                continue
+            
+            low, high = min(values), max(values)
+            if high - low < 1:
+                low, high = low - 1, high + 1
+            painter.setPen(QColor('#cccccc'))
+            painter.drawLine(left, top + height, left + width, top + height)
+            painter.drawLine(left, top, left, top + height)
+            painter.setPen(QColor('#555555'))
+            painter.drawText(x0, top - 6, 40, 14, Qt.AlignRight, f"{high:g}")
+            painter.drawText(x0, top + height - 8, 40, 14, Qt.AlignRight, f"{low:g}")
+            painter.drawText(left, top + height + 2, width, 14, Qt.AlignLeft,
+                             datetime.fromordinal(int(first_day)).strftime("%d/%m/%Y"))
+            painter.drawText(left, top + height + 2, width, 14, Qt.AlignRight,
+                             datetime.fromordinal(int(last_day)).strftime("%d/%m/%Y"))
+            
+            for col, color in zip(columns, colors):
+                polyline = [QPointF(left + width * (day - first_day) / day_span,
+                                    top + height * (high - value) / (high - low))
+                            for day, value in points[col]]
+                painter.setPen(QColor(color))
+                painter.setBrush(QColor(color))
+                if len(polyline) > 1:
+                    painter.drawPolyline(*polyline)
+                if len(polyline) <= 60:
+                    for point in polyline:
+                        painter.drawEllipse(point, 2, 2)
+        painter.end()
+
+def rasterize_pdf_pages(pdf_bytes, dpi=60):
+    """Rasterize PDF bytes into a list of QImages (one per page)"""
+    images = []
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            for index in range(len(pdf)):
+                bitmap = pdf[index].render(scale=dpi / 72, rev_byteorder=True)
+                image = QImage(bytes(bitmap.buffer), bitmap.width, bitmap.height,
+                               bitmap.stride, QImage.Format_RGB888)
+                images.append(image.copy())
+        finally:
+            pdf.close()
+        return images
+    
+    # Fall back to poppler's pdftoppm when it is on the PATH
+    if shutil.which("pdftoppm"):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "preview.pdf")
+            with open(pdf_path, 'wb') as f:
+                f.write(pdf_bytes)
+            subprocess.run(["pdftoppm", "-png", "-r", str(dpi), pdf_path, os.path.join(tmp_dir, "page")],
+                           check=True, capture_output=True)
+            # page-2.png must come before page-10.png, so order by the page number, not the name
+            pages = []
+            for name in os.listdir(tmp_dir):
+                match = re.fullmatch(r'page-(\d+)\.png', name)
+                if match:
+                    pages.append((int(match.group(1)), name))
+            for _, name in sorted(pages):
+                images.append(QImage(os.path.join(tmp_dir, name)))
+        return images
+    
+    raise RuntimeError("Live preview needs pypdfium2 (pip install pypdfium2) or poppler's pdftoppm")
+
+def pdf_page_count(pdf_bytes):
+    """Number of pages in PDF bytes, also when the page objects sit in compressed object streams"""
+    if pdfium is not None:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    
+    chunks = [pdf_bytes]
+    for match in re.finditer(rb'stream\r?\n', pdf_bytes):
+        try:
+            chunks.append(zlib.decompressobj().decompress(pdf_bytes[match.end():]))
+        except zlib.error:
+            pass  # not a Flate stream, such as a JPEG image
+    return sum(len(re.findall(rb'/Type\s*/Page(?![s\w])', chunk)) for chunk in chunks)
+
+class PartialPrintError(Exception):
+    """Raised when a print job fails after pages already reached the printer, so retrying would duplicate them"""
+
+class PrescriptionPreviewWorker(QThread):
+    """Background thread that renders prescription HTML to page images"""
+    rendered = pyqtSignal(str, bytes, list)
+    failed = pyqtSignal(str, str)
+    
+    def __init__(self, content_hash, html_content, parent=None):
+        super().__init__(parent)
+        self.content_hash = content_hash
+        self.html_content = html_content
+    
+    def run(self):
+        """Render the PDF and rasterize its pages off the GUI thread"""
+        try:
+            pdf_bytes = HTML(string=self.html_content).write_pdf(font_config=FontConfiguration())
+            images = rasterize_pdf_pages(pdf_bytes)
+            self.rendered.emit(self.content_hash, pdf_bytes, images)
+        except Exception as e:
+            self.failed.emit(self.content_hash, str(e))
+
+class PrescriptionPrintQueue(QThread):
+    """Background print queue that sends rendered prescriptions straight to a printer.
+
+    Pages are rasterized in memory and painted onto the QPrinter chosen in the
+    print dialog, so its printer, copies, duplex and page range all apply.
+    Without pypdfium2 the PDF bytes are streamed to CUPS through lp's stdin.
+    Jobs that failed before anything reached the printer are retried with a
+    growing delay; the rest are reported straight away. PDFs rendered from
+    HTML are stored in render_cache under the job's cache_key, if given.
+    """
+    job_done = pyqtSignal(str)
+    job_failed = pyqtSignal(str)
+    
+    def __init__(self, parent=None, max_attempts=3, retry_delay=2.0, render_cache=None):
+        super().__init__(parent)
+        self.render_cache = render_cache
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.jobs = queue.Queue()
+        self.stopped = threading.Event()
+        self.temp_files = []
+    
+    def submit(self, title, printer, html_content=None, pdf_bytes=None, cache_key=None):
+        """Queue a print job from either HTML or already rendered PDF bytes"""
+        self.jobs.put({
+            'title': title,
+            'printer': printer,
+            'html': html_content,
+            'pdf_bytes': pdf_bytes,
+            'cache_key': cache_key,
+            'attempts': 0
+        })
+        if not self.isRunning():
+            self.start()
+    
+    def stop(self):
+        """Stop the queue and remove any spool files left behind"""
+        self.stopped.set()
+        self.wait(5000)
+        for path in self.temp_files:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    def run(self):
+        """Process jobs until stopped, retrying failures"""
+        while not self.stopped.is_set():
+            try:
+                job = self.jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            
+            job['attempts'] += 1
+            start = time.perf_counter()
+            try:
+                if job['pdf_bytes'] is None:
+                    job['pdf_bytes'] = HTML(string=job['html']).write_pdf(font_config=FontConfiguration())
+                    if job['cache_key'] and self.render_cache is not None:
+                        self.render_cache.put(job['cache_key'], job['pdf_bytes'])
+                pages = self.print_pdf_bytes(job['pdf_bytes'], job['printer'])
+                elapsed = time.perf_counter() - start
+                self.job_done.emit(f"{job['title']}: {pages} page(s) sent to printer in {elapsed:.1f}s")
+            except PartialPrintError as e:
+                self.job_failed.emit(f"{job['title']}: {e}")
+            except Exception as e:
+                if job['attempts'] < self.max_attempts and not self.stopped.is_set():
+                    self.stopped.wait(self.retry_delay * job['attempts'])
+                    self.jobs.put(job)
+                else:
+                    self.job_failed.emit(f"{job['title']}: {e}")
+    
+    def print_pdf_bytes(self, pdf_bytes, printer):
+        """Send PDF bytes to the printer and return the number of pages printed"""
+        if pdfium is not None:
+            return self.paint_pdf_to_printer(pdf_bytes, printer)
+        
+        if shutil.which("lp"):
+            command = ["lp", "-n", str(max(1, printer.copyCount()))]
+            if printer.printerName():
+                command += ["-d", printer.printerName()]
+            if printer.duplex() == QPrinter.DuplexLongSide:
+                command += ["-o", "sides=two-sided-long-edge"]
+            elif printer.duplex() == QPrinter.DuplexShortSide:
+                command += ["-o", "sides=two-sided-short-edge"]
+            page_count = pdf_page_count(pdf_bytes)
+            first_page, last_page = 1, page_count
+            if printer.printRange() == QPrinter.PageRange and printer.fromPage():
+                first_page = printer.fromPage()
+                last_page = min(printer.toPage() or page_count, page_count)
+                command += ["-o", f"page-ranges={first_page}-{last_page}"]
+            try:
+                subprocess.run(command, input=pdf_bytes, check=True, capture_output=True, timeout=60)
+            except subprocess.TimeoutExpired as e:
+                # lp may have queued the job before hanging, so sending it again could print it twice
+                raise PartialPrintError(f"lp did not answer; check the printer queue before printing again ({e})")
+            return max(last_page - first_page + 1, 0) * max(1, printer.copyCount())
+        
+        if sys.platform == "win32":
+            # Last resort: hand a spool file to the default PDF handler
+            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
+                tmp_file.write(pdf_bytes)
+            self.temp_files.append(tmp_file.name)
+            os.startfile(tmp_file.name, "print")
+            return 1
+        
+        raise RuntimeError("Direct printing needs pypdfium2 (pip install pypdfium2) or CUPS lp")
+    
+    def paint_pdf_to_printer(self, pdf_bytes, printer):
+        """Rasterize each PDF page at printer resolution and paint it onto the printer"""
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        painter = QPainter()
+        try:
+            page_count = len(pdf)
+            first_page = max(printer.fromPage(), 1) - 1
+            last_page = min(printer.toPage() or page_count, page_count) - 1
+            # Qt repeats the job itself when the driver supports multiple copies
+            copies = 1 if printer.supportsMultipleCopies() else max(1, printer.copyCount())
+            dpi = min(printer.resolution(), 300)
+            
+            if not painter.begin(printer):
+                raise RuntimeError(f"Could not open printer {printer.printerName()}")
+            
+            printed = 0
+            try:
+                for copy in range(copies):
+                    for index in range(first_page, last_page + 1):
+                        if printed:
+                            printer.newPage()
+                        bitmap = pdf[index].render(scale=dpi / 72, rev_byteorder=True)
+                        image = QImage(bytes(bitmap.buffer), bitmap.width, bitmap.height,
+                                       bitmap.stride, QImage.Format_RGB888)
+                        target = printer.pageRect()
+                        scaled_size = image.size().scaled(target.size(), Qt.KeepAspectRatio)
+                        target.setSize(scaled_size)
+                        painter.drawImage(target, image)
+                        printed += 1
+            except Exception as e:
+                if printed:
+                    raise PartialPrintError(f"printing stopped after {printed} page(s): {e}") from e
+                raise
+            return printed
+        finally:
+            if painter.isActive():
+                painter.end()
+            pdf.close()
+
+class BackupInterrupted(Exception):
+    """Raised when concurrent writes keep restarting a batched database backup"""
+
+class BackupWorker(QThread):
+    """Background hot backup of the database, catalogs and patient images.
+
+    Each run creates backups/<timestamp>/ holding consistent copies of the
+    databases made with sqlite3's online backup API, the JSON catalogs and an
+    images.json manifest mapping image paths to SHA-256 digests. Image bytes
+    live once in backups/image_store/ and only new or changed files are
+    hashed and copied, so nightly runs over a large image folder stay short.
+    """
+    progress = pyqtSignal(int, str)
+    completed = pyqtSignal(str, str)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, db_paths, backup_dir, catalog_files, images_dir, keep=14, parent=None):
+        super().__init__(parent)
+        self.db_paths = db_paths
+        self.backup_dir = backup_dir
+        self.catalog_files = catalog_files
+        self.images_dir = images_dir
+        self.keep = keep
+        self.store_dir = os.path.join(backup_dir, 'image_store')
+        self.index_path = os.path.join(backup_dir, 'image_index.json')
+    
+    def run(self):
+        """Create one snapshot and prune old ones"""
+        partial_dir = None
+        try:
+            start = time.perf_counter()
+            snapshot_dir = os.path.join(self.backup_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
+            partial_dir = snapshot_dir + '.partial'
+            os.makedirs(partial_dir)
+            
+            for db_path in self.db_paths:
+                if os.path.exists(db_path):
+                    self.backup_database(db_path, os.path.join(partial_dir, os.path.basename(db_path)))
+            
+            catalogs = 0
+            for catalog_file in self.catalog_files:
+                if os.path.exists(catalog_file):
+                    shutil.copy2(catalog_file, partial_dir)
+                    catalogs += 1
+            
+            new_files, new_bytes, total_files = self.snapshot_images(partial_dir)
+            
+            # Only complete snapshots get a timestamp directory name
+            os.replace(partial_dir, snapshot_dir)
+            self.prune_snapshots()
+            
+            elapsed = time.perf_counter() - start
+            summary = (f"Backup finished in {elapsed:.1f}s: databases, {catalogs} catalogs and "
+                       f"{total_files} images ({new_files} new, {new_bytes / (1024 * 1024):.1f} MB copied)")
+            self.progress.emit(100, summary)
+            self.completed.emit(snapshot_dir, summary)
+        except Exception as e:
+            if partial_dir:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            self.failed.emit(str(e))
+    
+    def backup_database(self, db_path, dest_path, pages=4096, max_restarts=5):
+        """Copy a live database in page batches, reporting progress"""
+        source = sqlite3.connect(db_path)
+        dest = sqlite3.connect(dest_path)
+        state = {'remaining': None, 'restarts': 0}
+        
+        def report(status, remaining, total):
+            # SQLite restarts the copy when another connection writes to the source
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] > max_restarts:
+                    raise BackupInterrupted()
+            state['remaining'] = remaining
+            percent = int((total - remaining) * 80 / total) if total else 80
+            self.progress.emit(percent, f"Copying {os.path.basename(db_path)}: {total - remaining}/{total} pages")
+        
+        try:
+            try:
+                source.backup(dest, pages=pages, progress=report, sleep=0.01)
+            except BackupInterrupted:
+                # Too busy for batches; take the snapshot in a single step instead
+                self.progress.emit(0, "Database busy, copying in one step...")
+                source.backup(dest, pages=-1)
+        finally:
+            dest.close()
+            source.close()
+    
+    def file_digest(self, path):
+        """Return the SHA-256 hex digest of a file"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def snapshot_images(self, snapshot_dir):
+        """Store new or changed images in the shared store and write this snapshot's manifest"""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            index = {}
+        
+        paths = []
+        if os.path.isdir(self.images_dir):
+            for root, _, files in os.walk(self.images_dir):
+                for name in files:
+                    paths.append(os.path.join(root, name))
+        
+        manifest = {}
+        new_index = {}
+        new_files = 0
+        new_bytes = 0
+        for count, path in enumerate(paths, 1):
+            rel_path = os.path.relpath(path, self.images_dir)
+            stat = os.stat(path)
+            cached = index.get(rel_path)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                digest = cached[2]
+            else:
+                digest = self.file_digest(path)
+            new_index[rel_path] = [stat.st_size, stat.st_mtime_ns, digest]
+            manifest[rel_path] = digest
+            
+            blob_path = os.path.join(self.store_dir, digest[:2], digest)
+            if not os.path.exists(blob_path):
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                shutil.copy2(path, blob_path + '.tmp')
+                os.replace(blob_path + '.tmp', blob_path)
+                new_files += 1
+                new_bytes += stat.st_size
+            
+            if count % 50 == 0 or count == len(paths):
+                self.progress.emit(80 + int(count * 19 / len(paths)), f"Images: {count}/{len(paths)}")
+        
+        with open(os.path.join(snapshot_dir, 'images.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(new_index, f, ensure_ascii=False)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        
+        return new_files, new_bytes, len(paths)
+    
+    def prune_snapshots(self):
+        """Keep the newest snapshots and drop unfinished ones and images no remaining snapshot refers to"""
+        for name in os.listdir(self.backup_dir):
+            # Left behind by a run that was killed before it could clean up
+            if re.fullmatch(r'\d{8}_\d{6}\.partial', name):
+                shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+        
+        snapshots = sorted(name for name in os.listdir(self.backup_dir)
+                           if re.fullmatch(r'\d{8}_\d{6}', name))
+        for name in snapshots[:-self.keep]:
+            shutil.rmtree(os.path.join(self.backup_dir, name), ignore_errors=True)
+        
+        referenced = set()
+        for name in snapshots[-self.keep:]:
+            try:
+                with open(os.path.join(self.backup_dir, name, 'images.json'), 'r', encoding='utf-8') as f:
+                    referenced.update(json.load(f).values())
+            except (FileNotFoundError, ValueError):
+                continue
+        
+        if os.path.isdir(self.store_dir):
+            for root, _, files in os.walk(self.store_dir):
+                for name in files:
+                    if name not in referenced:
+                        os.unlink(os.path.join(root, name))
+
+def compress_payload(data):
+    """Compress bytes with zstd when available, otherwise zlib; returns (codec, blob)"""
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=9).compress(data)
+    return 'zlib', zlib.compress(data, 9)
+
+def decompress_payload(codec, blob):
+    """Reverse compress_payload"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This archive was written with zstd; install it with: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+def unpack_archived_prescription(row):
+    """Turn an archive row (id, patient_reg_no, date, codec, payload) into a prescriptions-table tuple"""
+    prescription_id, patient_reg_no, date, codec, payload = row[:5]
+    values = json.loads(decompress_payload(codec, payload).decode('utf-8'))
+    return (prescription_id, patient_reg_no, date) + tuple(values.get(col, '') for col in ARCHIVE_PAYLOAD_COLUMNS)
+
+class ArchiveWorker(QThread):
+    """Background move of old prescriptions into the compressed archive database.
+
+    Rows older than the cutoff are moved in small batches, each in its own
+    transaction spanning both databases, so the hot database stays usable.
+    """
+    progress = pyqtSignal(int, str)
+    completed = pyqtSignal(str)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, db_path, archive_path, cutoff_date, batch_size=500, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.cutoff_date = cutoff_date
+        self.batch_size = batch_size
+    
+    def run(self):
+        """Move prescriptions dated before the cutoff into the archive"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            start = time.perf_counter()
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path,))
+            total = conn.execute("SELECT COUNT(*) FROM prescriptions WHERE date < ?",
+                                 (self.cutoff_date,)).fetchone()[0]
+            
+            moved = 0
+            raw_bytes = 0
+            stored_bytes = 0
+            columns = ", ".join(ARCHIVE_PAYLOAD_COLUMNS)
+            while True:
+                rows = conn.execute(f'''
+                    SELECT id, patient_reg_no, date, {columns}
+                    FROM prescriptions WHERE date < ? ORDER BY date LIMIT ?
+                ''', (self.cutoff_date, self.batch_size)).fetchall()
+                if not rows:
+                    break
+                
+                archived = []
+                for row in rows:
+                    payload = json.dumps(dict(zip(ARCHIVE_PAYLOAD_COLUMNS, row[3:])), ensure_ascii=False).encode('utf-8')
+                    codec, blob = compress_payload(payload)
+                    raw_bytes += len(payload)
+                    stored_bytes += len(blob)
+                    archived.append((row[0], row[1], row[2], codec, blob))
+                
+                with conn:
+                    conn.executemany('''
+                        INSERT OR REPLACE INTO archive.archived_prescriptions
+                        (id, patient_reg_no, date, codec, payload)
+                        VALUES (?, ?, ?, ?, ?)
+                    ''', archived)
+                    conn.executemany("DELETE FROM prescriptions WHERE id = ?", [(row[0],) for row in rows])
+                
+                moved += len(rows)
+                self.progress.emit(int(moved * 100 / total) if total else 100,
+                                   f"Archived {moved}/{total} prescriptions")
+            
+            elapsed = time.perf_counter() - start
+            ratio = f", {raw_bytes / stored_bytes:.1f}x smaller" if stored_bytes else ""
+            self.completed.emit(f"Archived {moved} prescriptions dated before {self.cutoff_date} "
+                                f"in {elapsed:.1f}s{ratio}")
+        except Exception as e:
+            self.failed.emit(str(e))
+        finally:
+            conn.close()
+
+def nightly_job_due(last_run, now, hour):
+    """(due, inside the nightly window) for a job scheduled daily at hour and last run at last_run ("" if never)"""
+    start = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if start > now:
+        start -= timedelta(days=1)
+    return (last_run or '') < start.strftime("%Y-%m-%d %H:%M:%S"), now - start < timedelta(hours=NIGHTLY_WINDOW_HOURS)
+
+class DatabaseIntegrityError(Exception):
+    """Raised when PRAGMA integrity_check reports problems"""
+
+def database_size(paths=('medical_prescription.db', 'medical_prescription_archive.db')):
+    """Combined size in bytes of the database files that exist"""
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+def run_maintenance_task(conn, task):
+    """Run one DB_MAINTENANCE_TASKS task on both the main and the archive database"""
+    for schema in ('main', 'archive'):
+        if task == 'integrity_check':
+            problems = [row[0] for row in conn.execute(f"PRAGMA {schema}.integrity_check(20)")]
+            if problems != ['ok']:
+                raise DatabaseIntegrityError(f"{schema} database: {'; '.join(problems)}")
+        elif task == 'analyze':
+            conn.execute(f"ANALYZE {schema}")
+            conn.commit()
+        elif task == 'optimize':
+            conn.executescript(f"PRAGMA {schema}.optimize")
+        elif task == 'vacuum':
+            # The rewrite also moves older databases over to incremental auto-vacuum
+            conn.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+            conn.execute(f"VACUUM {schema}")
+
+def run_database_maintenance(db_path, archive_path, tasks, progress=None, log_path=DB_MAINTENANCE_LOG):
+    """Run maintenance tasks on a connection of their own; returns (task, seconds, bytes reclaimed) rows.
+    
+    Tasks run in DB_MAINTENANCE_TASKS order and each one is appended to the
+    log as it finishes. A failed integrity check stops the run, so nothing
+    rewrites a damaged file.
+    """
+    labels = dict(DB_MAINTENANCE_TASKS)
+    tasks = [task for task in labels if task in tasks]
+    paths = (db_path, archive_path)
+    results = []
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        for index, task in enumerate(tasks):
+            if progress:
+                progress(int(index * 100 / len(tasks)), f"{labels[task]}...")
+            size_before = database_size(paths)
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                run_maintenance_task(conn, task)
+            except Exception as e:
+                outcome = f"failed: {e}"
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                reclaimed = max(size_before - database_size(paths), 0)
+                results.append((task, elapsed, reclaimed))
+                try:
+                    with open(log_path, 'a', encoding='utf-8') as f:
+                        f.write(f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}  {labels[task]:<16} "
+                                f"{elapsed:8.2f}s  {reclaimed / (1024 * 1024):8.2f} MB reclaimed  {outcome}\n")
+                except OSError as e:
+                    print(f"Error writing maintenance log: {e}")
+        if progress:
+            progress(100, format_maintenance_summary(results))
+    finally:
+        conn.close()
+    return results
+
+def format_maintenance_summary(results):
+    """One line such as "Integrity check 0.4s, VACUUM 12.0s (35.2 MB reclaimed)" """
+    labels = dict(DB_MAINTENANCE_TASKS)
+    parts = []
+    for task, elapsed, reclaimed in results:
+        part = f"{labels[task]} {elapsed:.1f}s"
+        if reclaimed:
+            part += f" ({reclaimed / (1024 * 1024):.1f} MB reclaimed)"
+        parts.append(part)
+    return "Maintenance finished: " + ", ".join(parts)
+
+def database_health(conn, queries=DB_HEALTH_QUERIES):
+    """Page counts, free pages and index usage of the main and archive databases.
+    
+    Index usage combines the row counts ANALYZE leaves in sqlite_stat1 with the
+    frequent queries each index serves according to EXPLAIN QUERY PLAN; queries
+    that read a whole table are listed under 'scans'.
+    """
+    used_by = defaultdict(list)
+    scans = []
+    for label, sql in queries:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + sql):
+            detail = row[-1]
+            match = re.search(r'USING (?:COVERING )?INDEX (\w+)', detail)
+            if match:
+                used_by[match.group(1)].append(label)
+            elif detail.startswith('SCAN'):
+                scans.append(f"{label}: {detail}")
+    
+    databases = []
+    indexes = []
+    for schema in ('main', 'archive'):
+        page_size = conn.execute(f"PRAGMA {schema}.page_size").fetchone()[0]
+        page_count = conn.execute(f"PRAGMA {schema}.page_count").fetchone()[0]
+        databases.append({
+            'schema': schema,
+            'page_size': page_size,
+            'page_count': page_count,
+            'freelist_count': conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0],
+            'auto_vacuum': conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0],
+            'size': page_size * page_count,
+        })
+        
+        stats = {}
+        if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            stats = dict(conn.execute(f"SELECT idx, stat FROM {schema}.sqlite_stat1 WHERE idx IS NOT NULL"))
+        for name, table in conn.execute(f'''
+            SELECT name, tbl_name FROM {schema}.sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL ORDER BY tbl_name, name
+        '''):
+            stat = (stats.get(name) or '').split()
+            indexes.append({
+                'name': name,
+                'table': table if schema == 'main' else f"{schema}.{table}",
+                'rows': int(stat[0]) if stat else None,
+                'rows_per_key': int(stat[-1]) if len(stat) > 1 else None,
+                'used_by': used_by.get(name, []),
+            })
+    return {'databases': databases, 'indexes': indexes, 'scans': scans}
+
+class DatabaseMaintenanceWorker(QThread):
+    """Background run of run_database_maintenance with progress for the Maintenance tab"""
+    progress = pyqtSignal(int, str)
+    completed = pyqtSignal(str)
+    failed = pyqtSignal(str, bool)  # message, whether the integrity check found problems
+    
+    def __init__(self, db_path, archive_path, tasks, parent=None):
+        super().__init__(parent)
+        self.db_path = db_path
+        self.archive_path = archive_path
+        self.tasks = list(tasks)
+    
+    def run(self):
+        """Run the tasks and report a one-line summary"""
+        try:
+            results = run_database_maintenance(self.db_path, self.archive_path, self.tasks, self.progress.emit)
+            self.completed.emit(format_maintenance_summary(results))
+        except DatabaseIntegrityError as e:
+            self.failed.emit(str(e), True)
+        except Exception as e:
+            self.failed.emit(str(e), False)
+
+def prune_change_log(cursor, keep=CHANGE_LOG_KEEP):
+    """Drop change-feed entries older than the newest keep; clients behind them get a full reload"""
+    cursor.execute("DELETE FROM change_log WHERE seq <= (SELECT MAX(seq) FROM change_log) - ?", (keep,))
+
+def initialize_database_schema(conn):
+    """Create tables, indexes and the attached archive used by the GUI and the LAN server"""
+    cursor = conn.cursor()
+    
+    # New databases hand freed pages back after deletions; existing ones switch over on their next VACUUM
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("PRAGMA foreign_keys = ON")
+    
+    # Doctor information table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS doctors (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            degrees TEXT,
+            designation TEXT,
+            institution TEXT,
+            bmdc_reg_no TEXT,
+            phone TEXT,
+            email TEXT,
+            address TEXT
+        )
+    ''')
+    
+    # Patients table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patients (
+            reg_no INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            age INTEGER,
+            gender TEXT,
+            weight REAL,
+            phone TEXT,
+            address TEXT,
+            created_date TEXT
+        )
+    ''')
+    
+    # Prescriptions table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS prescriptions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_reg_no INTEGER,
+            date TEXT,
+            cc TEXT,
+            diagnosis TEXT,
+            vitals TEXT,
+            systemic_exam TEXT,
+            investigations TEXT,
+            drugs TEXT,
+            advice TEXT,
+            follow_up TEXT,
+            doctor_info TEXT,
+            FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
+        )
+    ''')
+    
+    # Patient images table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_reg_no INTEGER,
+            image_path TEXT,
+            description TEXT,
+            date TEXT,
+            FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
+        )
+    ''')
+    
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_patient_date ON prescriptions (patient_reg_no, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_prescriptions_date ON prescriptions (date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_images_patient ON patient_images (patient_reg_no)")
+    
+    # Daily visit queue; tokens restart at 1 every day
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visit_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            visit_date TEXT,
+            token INTEGER,
+            patient_reg_no INTEGER,
+            status TEXT DEFAULT 'waiting',
+            created_at TEXT,
+            called_at TEXT,
+            done_at TEXT,
+            FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
+        )
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_visit_queue_day_token ON visit_queue (visit_date, token)")
+    
+    # Numeric vitals per prescription (both tiers), parsed once from the bullet text
+    vitals_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'vitals'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vitals (
+            prescription_id INTEGER PRIMARY KEY,
+            patient_reg_no INTEGER,
+            date TEXT,
+            systolic REAL,
+            diastolic REAL,
+            pulse REAL,
+            temperature REAL,
+            respiratory_rate REAL,
+            spo2 REAL,
+            weight REAL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vitals_patient_date ON vitals (patient_reg_no, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_vitals_date ON vitals (date)")
+    
+    # Allergies by generic name or drug class, checked when a drug is prescribed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS patient_allergies (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_reg_no INTEGER,
+            allergen TEXT,
+            reaction TEXT,
+            FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_allergies_patient ON patient_allergies (patient_reg_no)")
+    
+    # Daily analytics rollups, maintained by insert_prescription
+    rollups_exist = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_visit_stats'").fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_visit_stats (
+            day TEXT PRIMARY KEY,
+            prescriptions INTEGER DEFAULT 0,
+            patients INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_diagnosis_stats (
+            day TEXT,
+            diagnosis TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (day, diagnosis)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_drug_stats (
+            day TEXT,
+            drug TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (day, drug)
+        )
+    ''')
+    # Monthly copies keep long-range reports small; days are only read at the range edges
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_diagnosis_stats (
+            month TEXT,
+            diagnosis TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (month, diagnosis)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monthly_drug_stats (
+            month TEXT,
+            drug TEXT,
+            count INTEGER DEFAULT 0,
+            PRIMARY KEY (month, drug)
+        )
+    ''')
+    
+    # Change feed for LAN clients: triggers log every patient and prescription write
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_log (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT,
+            entity_id INTEGER,
+            patient_reg_no INTEGER,
+            op TEXT
+        )
+    ''')
+    for table, entity, id_column, patient_column in (('patients', 'patient', 'reg_no', 'reg_no'),
+                                                     ('prescriptions', 'prescription', 'id', 'patient_reg_no'),
+                                                     ('visit_queue', 'queue', 'id', 'patient_reg_no')):
+        for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_{op}_log AFTER {op.upper()} ON {table}
+                BEGIN
+                    INSERT INTO change_log (entity, entity_id, patient_reg_no, op)
+                    VALUES ('{entity}', {row}.{id_column}, {row}.{patient_column}, '{op}');
+                END
+            ''')
+    prune_change_log(cursor)
+    
+    # Archive tier for old prescriptions (compressed payloads in a separate file)
+    cursor.execute("ATTACH DATABASE 'medical_prescription_archive.db' AS archive")
+    cursor.execute("PRAGMA archive.auto_vacuum = INCREMENTAL")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archive.archived_prescriptions (
+            id INTEGER PRIMARY KEY,
+            patient_reg_no INTEGER,
+            date TEXT,
+            codec TEXT,
+            payload BLOB
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_patient_date ON archived_prescriptions (patient_reg_no, date)")
+    
+    conn.commit()
+    
+    # Existing databases get their rollups and vitals built once from the stored prescriptions
+    if not rollups_exist:
+        rebuild_analytics_rollups(conn)
+    if not vitals_exist:
+        backfill_vitals(conn)
+
+def query_visit_queue(cursor, visit_date):
+    """A day's queue as (id, token, patient_reg_no, name, age, gender, status) rows, in token order"""
+    cursor.execute('''
+        SELECT q.id, q.token, q.patient_reg_no, pt.name, pt.age, pt.gender, q.status
+        FROM visit_queue q
+        JOIN patients pt ON q.patient_reg_no = pt.reg_no
+        WHERE q.visit_date = ?
+        ORDER BY q.token
+    ''', (visit_date,))
+    return cursor.fetchall()
+
+def enqueue_visit(conn, patient_reg_no, visit_date):
+    """Add a patient to a day's queue; returns (queue id, token)"""
+    existing = conn.execute('''
+        SELECT id, token FROM visit_queue
+        WHERE visit_date = ? AND patient_reg_no = ? AND status != 'done'
+    ''', (visit_date, patient_reg_no)).fetchone()
+    if existing:
+        raise ValueError(f"Patient is already in the queue with token #{existing[1]}")
+    
+    # Token assignment is a single statement so concurrent workstations cannot share a token
+    cursor = conn.execute('''
+        INSERT INTO visit_queue (visit_date, token, patient_reg_no, status, created_at)
+        SELECT ?, COALESCE(MAX(token), 0) + 1, ?, 'waiting', ? FROM visit_queue WHERE visit_date = ?
+    ''', (visit_date, patient_reg_no, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), visit_date))
+    token = conn.execute("SELECT token FROM visit_queue WHERE id = ?", (cursor.lastrowid,)).fetchone()[0]
+    return cursor.lastrowid, token
+
+def set_visit_status(conn, queue_id, status):
+    """Move a queued visit to a new status, enforcing QUEUE_TRANSITIONS"""
+    row = conn.execute("SELECT status FROM visit_queue WHERE id = ?", (queue_id,)).fetchone()
+    if not row:
+        raise LookupError("Queue entry not found")
+    if status not in QUEUE_TRANSITIONS.get(row[0], ()):
+        raise ValueError(f"Cannot change a visit from {QUEUE_STATUS_LABELS.get(row[0], row[0])} "
+                         f"to {QUEUE_STATUS_LABELS.get(status, status)}")
+    
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    timestamp_column = {'in_consult': 'called_at', 'done': 'done_at'}.get(status)
+    if timestamp_column:
+        cursor = conn.execute(f"UPDATE visit_queue SET status = ?, {timestamp_column} = ? WHERE id = ? AND status = ?",
+                              (status, now, queue_id, row[0]))
+    else:
+        cursor = conn.execute("UPDATE visit_queue SET status = ? WHERE id = ? AND status = ?",
+                              (status, queue_id, row[0]))
+    if not cursor.rowcount:
+        raise ValueError("The visit was just updated from another workstation")
+
+def prescription_rollup_keys(diagnosis, drugs_json):
+    """Normalized diagnosis labels and drug formulations counted by the analytics rollups"""
+    diagnoses = []
+    for part in re.split(r'[\n,;]+', diagnosis or ''):
+        label = ' '.join(part.strip(' •-*\t').split()).casefold()
+        if label and label not in diagnoses:
+            diagnoses.append(label)
+    
+    try:
+        drugs = json.loads(drugs_json or '[]')
+    except ValueError:
+        drugs = []
+    formulations = []
+    for drug in drugs:
+        formulation = ' '.join(str(drug.get('formulation', '')).split())
+        if formulation and formulation not in formulations:
+            formulations.append(formulation)
+    return diagnoses, formulations
+
+def add_to_analytics_rollups(conn, day, prescriptions, patients, diagnosis_counts, drug_counts):
+    """Add counts for one day to the daily and monthly rollup tables"""
+    conn.execute('''
+        INSERT INTO daily_visit_stats (day, prescriptions, patients) VALUES (?, ?, ?)
+        ON CONFLICT (day) DO UPDATE SET
+            prescriptions = prescriptions + excluded.prescriptions,
+            patients = patients + excluded.patients
+    ''', (day, prescriptions, patients))
+    conn.executemany('''
+        INSERT INTO daily_diagnosis_stats (day, diagnosis, count) VALUES (?, ?, ?)
+        ON CONFLICT (day, diagnosis) DO UPDATE SET count = count + excluded.count
+    ''', [(day, diagnosis, count) for diagnosis, count in diagnosis_counts.items()])
+    conn.executemany('''
+        INSERT INTO daily_drug_stats (day, drug, count) VALUES (?, ?, ?)
+        ON CONFLICT (day, drug) DO UPDATE SET count = count + excluded.count
+    ''', [(day, drug, count) for drug, count in drug_counts.items()])
+    conn.executemany('''
+        INSERT INTO monthly_diagnosis_stats (month, diagnosis, count) VALUES (?, ?, ?)
+        ON CONFLICT (month, diagnosis) DO UPDATE SET count = count + excluded.count
+    ''', [(day[:7], diagnosis, count) for diagnosis, count in diagnosis_counts.items()])
+    conn.executemany('''
+        INSERT INTO monthly_drug_stats (month, drug, count) VALUES (?, ?, ?)
+        ON CONFLICT (month, drug) DO UPDATE SET count = count + excluded.count
+    ''', [(day[:7], drug, count) for drug, count in drug_counts.items()])
+
+def insert_prescription(conn, prescription):
+    """Insert a PRESCRIPTION_COLUMNS mapping and fold it into the daily rollups; returns the new id"""
+    day = (prescription.get('date') or '')[:10]
+    next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    first_visit_of_day = conn.execute('''
+        SELECT 1 FROM prescriptions
+        WHERE patient_reg_no = ? AND date >= ? AND date < ? LIMIT 1
+    ''', (prescription.get('patient_reg_no'), day, next_day)).fetchone() is None
+    
+    placeholders = ", ".join("?" for _ in PRESCRIPTION_COLUMNS)
+    cursor = conn.execute(
+        f"INSERT INTO prescriptions ({', '.join(PRESCRIPTION_COLUMNS)}) VALUES ({placeholders})",
+        tuple(prescription.get(col) for col in PRESCRIPTION_COLUMNS))
+    
+    diagnoses, formulations = prescription_rollup_keys(prescription.get('diagnosis'), prescription.get('drugs'))
+    add_to_analytics_rollups(conn, day, 1, int(first_visit_of_day),
+                             Counter(diagnoses), Counter(formulations))
+    store_prescription_vitals(conn, [(cursor.lastrowid, prescription.get('patient_reg_no'),
+                                      prescription.get('date'), prescription.get('vitals'))])
+    return cursor.lastrowid
+
+def rebuild_analytics_rollups(conn):
+    """Recompute every rollup from both prescription tiers; returns the number of prescriptions read"""
+    visits = Counter()
+    patients = defaultdict(set)
+    diagnosis_counts = defaultdict(Counter)
+    drug_counts = defaultdict(Counter)
+    
+    def count(date, patient_reg_no, diagnosis, drugs):
+        day = (date or '')[:10]
+        if not day:
+            return
+        diagnoses, formulations = prescription_rollup_keys(diagnosis, drugs)
+        visits[day] += 1
+        patients[day].add(patient_reg_no)
+        diagnosis_counts[day].update(diagnoses)
+        drug_counts[day].update(formulations)
+    
+    for row in conn.execute("SELECT date, patient_reg_no, diagnosis, drugs FROM prescriptions"):
+        count(*row)
+    for row in conn.execute("SELECT id, patient_reg_no, date, codec, payload FROM archive.archived_prescriptions"):
+        prescription = dict(zip(('id', 'patient_reg_no', 'date') + ARCHIVE_PAYLOAD_COLUMNS,
+                                unpack_archived_prescription(row)))
+        count(prescription['date'], prescription['patient_reg_no'], prescription['diagnosis'], prescription['drugs'])
+    
+    with conn:
+        conn.execute("DELETE FROM daily_visit_stats")
+        conn.execute("DELETE FROM daily_diagnosis_stats")
+        conn.execute("DELETE FROM daily_drug_stats")
+        conn.execute("DELETE FROM monthly_diagnosis_stats")
+        conn.execute("DELETE FROM monthly_drug_stats")
+        for day in visits:
+            add_to_analytics_rollups(conn, day, visits[day], len(patients[day]),
+                                     diagnosis_counts[day], drug_counts[day])
+    return sum(visits.values())
+
+def subtract_from_analytics_rollups(conn, prescriptions):
+    """Take deleted (patient_reg_no, date, diagnosis, drugs) prescriptions back out of the rollups"""
+    visits = Counter()
+    patients = defaultdict(set)
+    diagnosis_counts = defaultdict(Counter)
+    drug_counts = defaultdict(Counter)
+    for patient_reg_no, date, diagnosis, drugs in prescriptions:
+        day = (date or '')[:10]
+        if not day:
+            continue
+        diagnoses, formulations = prescription_rollup_keys(diagnosis, drugs)
+        visits[day] += 1
+        patients[day].add(patient_reg_no)
+        diagnosis_counts[day].update(diagnoses)
+        drug_counts[day].update(formulations)
+    
+    for day in visits:
+        add_to_analytics_rollups(conn, day, -visits[day], -len(patients[day]),
+                                 {label: -count for label, count in diagnosis_counts[day].items()},
+                                 {label: -count for label, count in drug_counts[day].items()})
+    conn.execute("DELETE FROM daily_visit_stats WHERE prescriptions <= 0")
+    for table in ('daily_diagnosis_stats', 'daily_drug_stats', 'monthly_diagnosis_stats', 'monthly_drug_stats'):
+        conn.execute(f"DELETE FROM {table} WHERE count <= 0")
+
+def patient_prescriptions_for_rollups(conn, where, params):
+    """(patient_reg_no, date, diagnosis, drugs) of both tiers' prescriptions matching a WHERE clause"""
+    rows = conn.execute(f"SELECT patient_reg_no, date, diagnosis, drugs FROM prescriptions t WHERE {where}",
+                        params).fetchall()
+    for row in conn.execute(f'''
+        SELECT id, patient_reg_no, date, codec, payload FROM archive.archived_prescriptions t WHERE {where}
+    ''', params):
+        prescription = dict(zip(('id', 'patient_reg_no', 'date') + ARCHIVE_PAYLOAD_COLUMNS,
+                                unpack_archived_prescription(row)))
+        rows.append((prescription['patient_reg_no'], prescription['date'],
+                     prescription['diagnosis'], prescription['drugs']))
+    return rows
+
+def delete_patient_cascade(conn, reg_no):
+    """Delete a patient with all their rows in one transaction.
+    
+    Returns the patient's image file paths, for the caller to remove once the
+    transaction has committed, or None if there is no such patient.
+    """
+    with conn:
+        if conn.execute("SELECT 1 FROM patients WHERE reg_no = ?", (reg_no,)).fetchone() is None:
+            return None
+        image_paths = [row[0] for row in conn.execute(
+            "SELECT image_path FROM patient_images WHERE patient_reg_no = ?", (reg_no,))]
+        subtract_from_analytics_rollups(conn, patient_prescriptions_for_rollups(conn, "patient_reg_no = ?", (reg_no,)))
+        for table in PATIENT_DEPENDENT_TABLES:
+            conn.execute(f"DELETE FROM {table} WHERE patient_reg_no = ?", (reg_no,))
+        conn.execute("DELETE FROM patients WHERE reg_no = ?", (reg_no,))
+    return with_original_images(image_paths)
+
+def find_orphans(conn, images_dir='patient_images'):
+    """Rows per PATIENT_DEPENDENT_TABLES table whose patient is gone, and image files nothing refers to"""
+    counts = {}
+    for table in PATIENT_DEPENDENT_TABLES:
+        counts[table] = conn.execute(f'''
+            SELECT COUNT(*) FROM {table} t
+            WHERE NOT EXISTS (SELECT 1 FROM patients p WHERE p.reg_no = t.patient_reg_no)
+        ''').fetchone()[0]
+    
+    referenced = {os.path.normcase(os.path.abspath(row[0])) for row in conn.execute('''
+        SELECT image_path FROM patient_images t
+        WHERE EXISTS (SELECT 1 FROM patients p WHERE p.reg_no = t.patient_reg_no)
+    ''') if row[0]}
+    files = []
+    if os.path.isdir(images_dir):
+        for name in os.listdir(images_dir):
+            path = os.path.join(images_dir, name)
+            if os.path.isfile(path) and os.path.normcase(os.path.abspath(path)) not in referenced:
+                files.append(path)
+    
+    # Kept originals belong to the stored image with the same name stem
+    referenced_stems = {os.path.splitext(os.path.basename(path))[0] for path in referenced}
+    originals_dir = os.path.join(images_dir, 'originals')
+    if os.path.isdir(originals_dir):
+        for name in os.listdir(originals_dir):
+            if os.path.splitext(name)[0] not in referenced_stems:
+                files.append(os.path.join(originals_dir, name))
+    return counts, files
+
+def remove_orphans(conn):
+    """Delete every row whose patient is gone, in one transaction; returns rows deleted per table"""
+    orphan = "NOT EXISTS (SELECT 1 FROM patients p WHERE p.reg_no = t.patient_reg_no)"
+    counts = {}
+    with conn:
+        subtract_from_analytics_rollups(conn, patient_prescriptions_for_rollups(conn, orphan, ()))
+        for table in PATIENT_DEPENDENT_TABLES:
+            counts[table] = conn.execute(f"DELETE FROM {table} AS t WHERE {orphan}").rowcount
+    return counts
+
+def reclaim_free_pages(conn, full=False):
+    """Return free pages of both databases to the filesystem.
+    
+    Databases in incremental auto-vacuum mode only need an incremental_vacuum;
+    older ones need a full VACUUM (which also switches them over), so that only
+    runs when full is set. Returns the number of bytes reclaimed.
+    """
+    size_before = database_size()
+    for schema in ('main', 'archive'):
+        if conn.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] == 2:
+            # executescript steps the pragma to completion; execute() frees a single page
+            conn.executescript(f"PRAGMA {schema}.incremental_vacuum")
+        elif full:
+            conn.execute(f"VACUUM {schema}")
+    return max(size_before - database_size(), 0)
+
+def collect_image_files(paths):
+    """Image files among paths, with folders searched recursively, in name order and without repeats"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(IMAGE_FILE_EXTENSIONS))
+        elif os.path.isfile(path):
+            files.append(path)
+    return list(dict.fromkeys(files))
+
+def new_image_stems(images_dir, source_paths, prefix=''):
+    """Paths without extension for new uploads: <dir>/<prefix><file name>, made unique within the folder"""
+    stems = []
+    taken = set()
+    for source_path in source_paths:
+        base = os.path.join(images_dir, prefix + os.path.splitext(os.path.basename(source_path))[0])
+        stem = base
+        number = 2
+        while stem in taken or glob.glob(glob.escape(stem) + '.*'):
+            stem = f"{base}_{number}"
+            number += 1
+        taken.add(stem)
+        stems.append(stem)
+    return stems
+
+def import_image_file(source_path, dest_stem, image_format='jpeg', quality=85, max_side=3000, keep_original=False):
+    """Store an image at dest_stem plus an extension; returns (stored path, source bytes, stored bytes).
+    
+    Unless image_format is 'original' the image is decoded at no more than
+    max_side pixels on its longer side, turned upright by its EXIF orientation
+    and re-encoded without metadata. Files that would not get smaller, or that
+    Qt cannot read, are copied as they are. With keep_original the uploaded
+    file is also kept in an originals/ folder next to the stored one.
+    """
+    source_ext = os.path.splitext(source_path)[1].lower()
+    source_bytes = os.path.getsize(source_path)
+    extension = {key: ext for key, _, ext in IMAGE_UPLOAD_FORMATS}.get(image_format)
+    os.makedirs(os.path.dirname(dest_stem) or '.', exist_ok=True)
+    
+    if extension:
+        reader = QImageReader(source_path)
+        reader.setAutoTransform(True)
+        size = reader.size()
+        if max_side and size.isValid() and max(size.width(), size.height()) > max_side:
+            # Decode straight to the target size instead of holding the full image
+            reader.setScaledSize(size.scaled(max_side, max_side, Qt.KeepAspectRatio))
+        image = reader.read()
+        if not image.isNull():
+            if image_format == 'jpeg':
+                image = flatten_alpha(image)
+            
+            stored_path = dest_stem + extension
+            writer = QImageWriter(stored_path + '.tmp', image_format.encode('ascii'))
+            writer.setQuality(quality)
+            if writer.write(image) and os.path.getsize(stored_path + '.tmp') < source_bytes:
+                os.replace(stored_path + '.tmp', stored_path)
+                if keep_original:
+                    originals_dir = os.path.join(os.path.dirname(dest_stem), 'originals')
+                    os.makedirs(originals_dir, exist_ok=True)
+                    shutil.copy2(source_path, os.path.join(originals_dir, os.path.basename(dest_stem) + source_ext))
+                return stored_path, source_bytes, os.path.getsize(stored_path)
+            if os.path.exists(stored_path + '.tmp'):
+                os.remove(stored_path + '.tmp')
+    
+    stored_path = dest_stem + source_ext
+    shutil.copy2(source_path, stored_path)
+    return stored_path, source_bytes, source_bytes
+
+def original_image_paths(image_path):
+    """Originals kept by import_image_file for a stored image"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    pattern = os.path.join(os.path.dirname(image_path), 'originals', glob.escape(stem) + '.*')
+    return [path for path in glob.glob(pattern) if os.path.splitext(os.path.basename(path))[0] == stem]
+
+def with_original_images(paths):
+    """Image paths followed by any originals kept for them"""
+    return [file_path for path in paths for file_path in [path] + original_image_paths(path)]
+
+def format_image_savings(results):
+    """Summary such as "3 images: 45.2 MB -> 6.1 MB (39.1 MB saved, 86%)" for ImageImportWorker results"""
+    before = sum(result[2] for result in results)
+    after = sum(result[3] for result in results)
+    summary = (f"{len(results)} image{'s' if len(results) != 1 else ''}: "
+               f"{before / (1024 * 1024):.1f} MB -> {after / (1024 * 1024):.1f} MB")
+    if before > after:
+        summary += f" ({(before - after) / (1024 * 1024):.1f} MB saved, {(before - after) * 100 / before:.0f}%)"
+    return summary
+
+class ImageImportWorker(QThread):
+    """Runs import_image_file for a list of uploads on a thread pool.
+    
+    jobs are (source path, destination stem) pairs. completed carries
+    (source, stored path, source bytes, stored bytes) results in job order,
+    the per-file errors and a format_image_savings summary. With upload set,
+    each stored path is then passed to it in turn (client mode sends them to
+    the server) and only the files it accepted are reported as results.
+    """
+    progress = pyqtSignal(int, str)
+    completed = pyqtSignal(list, list, str)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, jobs, options, upload=None, max_workers=IMAGE_IMPORT_WORKERS, parent=None):
+        super().__init__(parent)
+        self.jobs = list(jobs)
+        self.options = dict(options)
+        self.upload = upload
+        self.max_workers = max_workers
+    
+    def run(self):
+        """Import every job and report the bytes saved"""
+        try:
+            results = {}
+            errors = []
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                futures = {pool.submit(import_image_file, source, stem, **self.options): index
+                           for index, (source, stem) in enumerate(self.jobs)}
+                for count, future in enumerate(as_completed(futures), 1):
+                    index = futures[future]
+                    source = self.jobs[index][0]
+                    try:
+                        results[index] = (source,) + future.result()
+                    except Exception as e:
+                        errors.append(f"{os.path.basename(source)}: {e}")
+                    self.progress.emit(int(count * 100 / len(futures)), f"Processed {count}/{len(futures)} images")
+            
+            results = [results[index] for index in sorted(results)]
+            if self.upload is not None:
+                sent = []
+                for count, result in enumerate(results, 1):
+                    self.progress.emit(int((count - 1) * 100 / len(results)),
+                                       f"Sending {count}/{len(results)} images to the server...")
+                    try:
+                        self.upload(result[1])
+                        sent.append(result)
+                    except Exception as e:
+                        errors.append(f"{os.path.basename(result[0])}: {e}")
+                results = sent
+            self.completed.emit(results, errors, format_image_savings(results))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+def remove_files(paths):
+    """Delete files, skipping ones already gone; returns how many were removed"""
+    removed = 0
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            print(f"Warning: Could not delete file {path}: {e}")
+    return removed
+
+def analytics_period_range(period, today=None):
+    """(start day, end day) for an ANALYTICS_PERIODS value"""
+    today = today or datetime.now()
+    end = today.strftime("%Y-%m-%d")
+    if period == 'month':
+        return today.strftime("%Y-%m-01"), end
+    if period == 'year':
+        return today.strftime("%Y-01-01"), end
+    if period is None:
+        return '0000-00-00', end
+    return (today - timedelta(days=period)).strftime("%Y-%m-%d"), end
+
+def analytics_month_span(start_day, end_day):
+    """Split a day range into whole months and edge days.
+    
+    Returns (first month, last month, first day of those months, first day after
+    them); the remaining edge days come from the daily tables. Without a whole
+    month the month range is empty and both days are ''.
+    """
+    first_month = start_day[:7] if start_day[8:] in ('00', '01') else None
+    if first_month is None:
+        start = datetime.strptime(start_day, "%Y-%m-%d")
+        first_month = (start.replace(day=28) + timedelta(days=4)).strftime("%Y-%m")
+    
+    end = datetime.strptime(end_day, "%Y-%m-%d")
+    if (end + timedelta(days=1)).day == 1:
+        last_month = end_day[:7]
+    else:
+        last_month = (end.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+    
+    if first_month > last_month:
+        return '9999-99', '0000-00', '', ''
+    after_last = (datetime.strptime(last_month + "-28", "%Y-%m-%d") + timedelta(days=4)).strftime("%Y-%m-01")
+    return first_month, last_month, f"{first_month}-01", after_last
+
+def top_rollup_counts(cursor, kind, start_day, end_day, limit=None, pattern=None):
+    """Sum diagnosis or drug counts over a day range from the monthly and daily rollups"""
+    column = {'diagnosis': 'diagnosis', 'drug': 'drug'}[kind]
+    first_month, last_month, months_start, months_end = analytics_month_span(start_day, end_day)
+    # Edge days as two half-open ranges so both can use the (day, ...) primary key
+    after_end = end_day + '~'
+    head = (start_day, months_start or after_end)
+    tail = (months_end or after_end, after_end)
+    
+    where_pattern = f"AND {column} LIKE ?" if pattern else ""
+    pattern_params = [pattern] if pattern else []
+    params = [first_month, last_month] + pattern_params + list(head) + list(tail) + pattern_params
+    query = f'''
+        SELECT {column}, SUM(count) AS total FROM (
+            SELECT {column}, count FROM monthly_{kind}_stats
+            WHERE month BETWEEN ? AND ? {where_pattern}
+            UNION ALL
+            SELECT {column}, count FROM daily_{kind}_stats
+            WHERE ((day >= ? AND day < ?) OR (day >= ? AND day < ?)) {where_pattern}
+        )
+        GROUP BY {column} ORDER BY total DESC, {column}
+    '''
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    return cursor.execute(query, params).fetchall()
+
+def analytics_report(cursor, start_day, end_day, top=20, diagnosis=None):
+    """Visit, diagnosis and drug statistics between two days (inclusive), read from the rollups"""
+    prescriptions, patient_visits = cursor.execute('''
+        SELECT COALESCE(SUM(prescriptions), 0), COALESCE(SUM(patients), 0)
+        FROM daily_visit_stats WHERE day BETWEEN ? AND ?
+    ''', (start_day, end_day)).fetchone()
+    by_month = cursor.execute('''
+        SELECT substr(day, 1, 7) AS month, SUM(prescriptions), SUM(patients)
+        FROM daily_visit_stats WHERE day BETWEEN ? AND ?
+        GROUP BY month ORDER BY month
+    ''', (start_day, end_day)).fetchall()
+    top_diagnoses = top_rollup_counts(cursor, 'diagnosis', start_day, end_day, top)
+    top_drugs = top_rollup_counts(cursor, 'drug', start_day, end_day, top)
+    
+    report = {
+        'start': start_day,
+        'end': end_day,
+        'prescriptions': prescriptions,
+        'patient_visits': patient_visits,
+        'by_month': [list(row) for row in by_month],
+        'top_diagnoses': [list(row) for row in top_diagnoses],
+        'top_drugs': [list(row) for row in top_drugs],
+    }
+    if diagnosis:
+        matches = top_rollup_counts(cursor, 'diagnosis', start_day, end_day,
+                                    pattern=f"%{diagnosis.strip().casefold()}%")
+        report['diagnosis_filter'] = diagnosis.strip()
+        report['diagnosis_matches'] = [list(row) for row in matches]
+    return report
+
+def write_analytics_csv(report, path):
+    """Write an analytics report as section,label,prescriptions,patients rows"""
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['section', 'label', 'prescriptions', 'patients'])
+        writer.writerow(['total', f"{report['start']} to {report['end']}",
+                         report['prescriptions'], report['patient_visits']])
+        for month, prescriptions, patients in report['by_month']:
+            writer.writerow(['month', month, prescriptions, patients])
+        for label, count in report['top_diagnoses']:
+            writer.writerow(['diagnosis', label, count, ''])
+        for label, count in report['top_drugs']:
+            writer.writerow(['drug', label, count, ''])
+        for label, count in report.get('diagnosis_matches', []):
+            writer.writerow(['diagnosis_match', label, count, ''])
+
+def format_analytics_report(report):
+    """Plain-text rendering of an analytics report for the command line"""
+    lines = [f"Clinic report {report['start']} to {report['end']}",
+             f"Prescriptions: {report['prescriptions']}   Patient visits: {report['patient_visits']}",
+             ""]
+    if 'diagnosis_matches' in report:
+        total = sum(count for _, count in report['diagnosis_matches'])
+        lines.append(f"Diagnosis matching '{report['diagnosis_filter']}': {total}")
+        lines += [f"  {count:>7}  {label}" for label, count in report['diagnosis_matches']]
+        lines.append("")
+    lines.append("Visits by month:")
+    lines += [f"  {month}  {prescriptions:>7} prescriptions  {patients:>7} patients"
+              for month, prescriptions, patients in report['by_month']]
+    lines += ["", "Top diagnoses:"]
+    lines += [f"  {count:>7}  {label}" for label, count in report['top_diagnoses']]
+    lines += ["", "Top drugs:"]
+    lines += [f"  {count:>7}  {label}" for label, count in report['top_drugs']]
+    return "\n".join(lines)
+
+def parse_vitals_text(text):
+    """Numeric vitals from a prescription's bullet text; missing values are None"""
+    vitals = dict.fromkeys(VITALS_COLUMNS)
+    if not text:
+        return vitals
+    match = VITALS_PATTERNS['bp'].search(text)
+    if match:
+        vitals['systolic'], vitals['diastolic'] = float(match.group(1)), float(match.group(2))
+    for name in ('pulse', 'temperature', 'respiratory_rate', 'spo2', 'weight'):
+        match = VITALS_PATTERNS[name].search(text)
+        if match:
+            vitals[name] = float(match.group(1))
+    return vitals
+
+def parse_allergies_text(text):
+    """(allergen, reaction) pairs from text like "Penicillin (rash), NSAID" """
+    allergies = []
+    # Commas inside the reaction's parentheses don't separate allergies
+    for part in re.split(r'[,;\n]+(?![^(]*\))', text or ''):
+        allergen, _, reaction = part.partition('(')
+        if allergen.strip():
+            allergies.append((' '.join(allergen.split()), reaction.strip().rstrip(')').strip()))
+    return allergies
+
+def format_allergies(allergies):
+    """Inverse of parse_allergies_text"""
+    return ", ".join(f"{allergen} ({reaction})" if reaction else allergen for allergen, reaction in allergies)
+
+def query_patient_allergies(cursor, patient_id):
+    """A patient's (allergen, reaction) rows in the order they were entered"""
+    cursor.execute('''
+        SELECT allergen, reaction FROM patient_allergies
+        WHERE patient_reg_no = ? ORDER BY id
+    ''', (patient_id,))
+    return cursor.fetchall()
+
+def replace_patient_allergies(conn, patient_id, allergies_text):
+    """Replace a patient's allergies with those written in allergies_text"""
+    conn.execute("DELETE FROM patient_allergies WHERE patient_reg_no = ?", (patient_id,))
+    conn.executemany("INSERT INTO patient_allergies (patient_reg_no, allergen, reaction) VALUES (?, ?, ?)",
+                     [(patient_id, allergen, reaction) for allergen, reaction in parse_allergies_text(allergies_text)])
+
+def query_patient_vitals(cursor, patient_id):
+    """A patient's (date, *VITALS_COLUMNS) rows from the vitals table, oldest first"""
+    cursor.execute(f'''
+        SELECT date, {', '.join(VITALS_COLUMNS)} FROM vitals
+        WHERE patient_reg_no = ? ORDER BY date
+    ''', (patient_id,))
+    return cursor.fetchall()
+
+def store_prescription_vitals(conn, rows):
+    """Parse (prescription id, patient_reg_no, date, vitals text) rows into the vitals table.
+    
+    Prescriptions without any recognizable vital are skipped. Returns the number of rows stored.
+    """
+    records = []
+    for prescription_id, patient_reg_no, date, text in rows:
+        vitals = parse_vitals_text(text)
+        if any(value is not None for value in vitals.values()):
+            records.append((prescription_id, patient_reg_no, date) + tuple(vitals[col] for col in VITALS_COLUMNS))
+    conn.executemany(f'''
+        INSERT OR REPLACE INTO vitals (prescription_id, patient_reg_no, date, {', '.join(VITALS_COLUMNS)})
+        VALUES (?, ?, ?, {', '.join('?' for _ in VITALS_COLUMNS)})
+    ''', records)
+    return len(records)
+
+def backfill_vitals(conn, batch_size=5000):
+    """Rebuild the vitals table from the text of every prescription in both tiers; returns rows stored"""
+    stored = 0
+    with conn:
+        conn.execute("DELETE FROM vitals")
+        cursor = conn.execute("SELECT id, patient_reg_no, date, vitals FROM prescriptions")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            stored += store_prescription_vitals(conn, rows)
+        
+        cursor = conn.execute("SELECT id, patient_reg_no, date, codec, payload FROM archive.archived_prescriptions")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            archived = [dict(zip(('id', 'patient_reg_no', 'date') + ARCHIVE_PAYLOAD_COLUMNS,
+                                 unpack_archived_prescription(row))) for row in rows]
+            stored += store_prescription_vitals(conn, [(p['id'], p['patient_reg_no'], p['date'], p['vitals'])
+                                                       for p in archived])
+    return stored
+
+class VisitSnapshot:
+    """Columnar copy of every visit for distribution reports (requires NumPy).
+    
+    One row per prescription with the patient's age, gender, weight and parsed
+    vitals. Diagnoses are exploded into (visit, diagnosis code) pairs, since a
+    prescription can carry several, so group-bys are a single np.bincount.
+    """
+    NUMERIC_COLUMNS = ('age', 'weight', 'systolic', 'diastolic', 'pulse', 'temperature', 'respiratory_rate', 'spo2')
+    
+    def __init__(self, columns, diagnosis_labels, gender_labels, source_state):
+        self.columns = columns
+        self.diagnosis_labels = diagnosis_labels
+        self.gender_labels = gender_labels
+        self.source_state = source_state
+    
+    @staticmethod
+    def data_state(conn):
+        """Change-log position and row counts; a snapshot is current while these match"""
+        return [
+            conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM prescriptions").fetchone()[0],
+            conn.execute("SELECT COUNT(*) FROM archive.archived_prescriptions").fetchone()[0],
+        ]
+    
+    @classmethod
+    def build(cls, conn):
+        """Read both prescription tiers joined with patients into arrays"""
+        if np is None:
+            raise RuntimeError("The MIS report needs NumPy; install it with: pip install numpy")
+        
+        state = cls.data_state(conn)
+        days, ages, genders, registered_weights, measured_vitals, diagnoses = [], [], [], [], [], []
+        vitals_select = ", ".join(f"v.{col}" for col in VITALS_COLUMNS)
+        
+        def add(date, age, gender, weight, vitals, diagnosis):
+            days.append((date or '')[:10] or 'NaT')
+            ages.append(age)
+            genders.append(gender or '')
+            registered_weights.append(weight)
+            measured_vitals.append(vitals)
+            diagnoses.append(diagnosis)
+        
+        for row in conn.execute(f'''
+            SELECT p.date, pt.age, pt.gender, pt.weight, p.diagnosis, {vitals_select}
+            FROM prescriptions p
+            LEFT JOIN patients pt ON p.patient_reg_no = pt.reg_no
+            LEFT JOIN vitals v ON v.prescription_id = p.id
+        '''):
+            add(row[0], row[1], row[2], row[3], row[5:], row[4])
+        for row in conn.execute(f'''
+            SELECT a.id, a.patient_reg_no, a.date, a.codec, a.payload, pt.age, pt.gender, pt.weight, {vitals_select}
+            FROM archive.archived_prescriptions a
+            LEFT JOIN patients pt ON a.patient_reg_no = pt.reg_no
+            LEFT JOIN vitals v ON v.prescription_id = a.id
+        '''):
+            prescription = dict(zip(('id', 'patient_reg_no', 'date') + ARCHIVE_PAYLOAD_COLUMNS,
+                                    unpack_archived_prescription(row[:5])))
+            add(prescription['date'], row[5], row[6], row[7], row[8:], prescription['diagnosis'])
+        
+        columns = {
+            'day': np.array(days, dtype='datetime64[D]'),
+            'age': np.array(ages, dtype=float),
+        }
+        gender_labels, columns['gender'] = np.unique(np.array(genders, dtype=str), return_inverse=True)
+        
+        # NULLs from the vitals table become NaN
+        measured = np.array(measured_vitals, dtype=float).reshape(len(measured_vitals), len(VITALS_COLUMNS))
+        for index, name in enumerate(VITALS_COLUMNS[:-1]):
+            columns[name] = measured[:, index]
+        # Weight measured at the visit, else the weight recorded at registration
+        measured = measured[:, -1]
+        registered = np.array(registered_weights, dtype=float)
+        registered[registered <= 0] = np.nan
+        columns['weight'] = np.where(np.isnan(measured), registered, measured)
+        
+        codes = {}
+        diagnosis_visits, diagnosis_codes = [], []
+        for visit, diagnosis in enumerate(diagnoses):
+            for label in prescription_rollup_keys(diagnosis, None)[0]:
+                diagnosis_visits.append(visit)
+                diagnosis_codes.append(codes.setdefault(label, len(codes)))
+        columns['dx_visit'] = np.array(diagnosis_visits, dtype=np.int64)
+        columns['dx_code'] = np.array(diagnosis_codes, dtype=np.int64)
+        
+        return cls(columns, np.array(list(codes), dtype=str), gender_labels, state)
+    
+    def save(self, path=ANALYTICS_SNAPSHOT_FILE):
+        """Write the snapshot as a compressed .npz"""
+        np.savez_compressed(path + '.tmp.npz', diagnosis_labels=self.diagnosis_labels,
+                            gender_labels=self.gender_labels, source_state=np.array(self.source_state),
+                            **self.columns)
+        os.replace(path + '.tmp.npz', path)
+    
+    @classmethod
+    def load(cls, path=ANALYTICS_SNAPSHOT_FILE):
+        """Read a snapshot written by save"""
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files
+                       if name not in ('diagnosis_labels', 'gender_labels', 'source_state')}
+            return cls(columns, data['diagnosis_labels'], data['gender_labels'], data['source_state'].tolist())
+    
+    @classmethod
+    def open(cls, conn, path=ANALYTICS_SNAPSHOT_FILE):
+        """Load the saved snapshot, rebuilding it first if the database has changed since"""
+        if np is None:
+            raise RuntimeError("The MIS report needs NumPy; install it with: pip install numpy")
+        if os.path.exists(path):
+            try:
+                snapshot = cls.load(path)
+                if snapshot.source_state == cls.data_state(conn):
+                    return snapshot
+            except Exception as e:
+                print(f"Error reading analytics snapshot, rebuilding: {e}")
+        snapshot = cls.build(conn)
+        snapshot.save(path)
+        return snapshot
+    
+    def visit_mask(self, start_day=None, end_day=None):
+        """Boolean mask of visits between two days (inclusive)"""
+        day = self.columns['day']
+        mask = ~np.isnat(day)
+        if start_day and not start_day.startswith('0000'):
+            mask &= day >= np.datetime64(start_day)
+        if end_day:
+            mask &= day <= np.datetime64(end_day)
+        return mask
+    
+    def diagnosis_pairs(self, mask=None):
+        """(visit index, diagnosis code) arrays, limited to visits in mask"""
+        visits, codes = self.columns['dx_visit'], self.columns['dx_code']
+        if mask is not None:
+            keep = mask[visits]
+            visits, codes = visits[keep], codes[keep]
+        return visits, codes
+    
+    def visits_by_diagnosis(self, mask=None):
+        """Visit count per diagnosis code"""
+        _, codes = self.diagnosis_pairs(mask)
+        return np.bincount(codes, minlength=len(self.diagnosis_labels))
+    
+    def crosstab_by_diagnosis(self, categories, category_count, mask=None):
+        """Diagnosis x category visit counts for a per-visit integer category array"""
+        visits, codes = self.diagnosis_pairs(mask)
+        flat = codes * category_count + categories[visits]
+        counts = np.bincount(flat, minlength=len(self.diagnosis_labels) * category_count)
+        return counts.reshape(len(self.diagnosis_labels), category_count)
+    
+    def stats_by_diagnosis(self, column, mask=None):
+        """Per-diagnosis count, mean, std, min, median and max of a numeric column (NaN ignored)"""
+        visits, codes = self.diagnosis_pairs(mask)
+        values = self.columns[column][visits]
+        valid = ~np.isnan(values)
+        values, codes = values[valid], codes[valid]
+        size = len(self.diagnosis_labels)
+        
+        count = np.bincount(codes, minlength=size)
+        total = np.bincount(codes, weights=values, minlength=size)
+        squares = np.bincount(codes, weights=values * values, minlength=size)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            std = np.sqrt(np.maximum(squares / count - mean * mean, 0))
+        
+        # Sort by (code, value) once; each diagnosis is then a contiguous run
+        order = np.lexsort((values, codes))
+        ordered = np.append(values[order], np.nan)
+        starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+        has_values = count > 0
+        last = np.where(has_values, starts + count - 1, len(ordered) - 1)
+        low_middle = np.where(has_values, starts + (count - 1) // 2, len(ordered) - 1)
+        high_middle = np.where(has_values, starts + count // 2, len(ordered) - 1)
+        return {
+            'count': count,
+            'mean': mean,
+            'std': std,
+            'min': np.where(has_values, ordered[np.minimum(starts, len(ordered) - 1)], np.nan),
+            'median': (ordered[low_middle] + ordered[high_middle]) / 2,
+            'max': ordered[last],
+        }
+
+def mis_report(snapshot, start_day=None, end_day=None):
+    """Per-diagnosis visit counts and age, gender, weight and vitals distributions"""
+    mask = snapshot.visit_mask(start_day, end_day)
+    visits = snapshot.visits_by_diagnosis(mask)
+    genders = snapshot.crosstab_by_diagnosis(snapshot.columns['gender'], len(snapshot.gender_labels), mask)
+    
+    ages = snapshot.columns['age']
+    age_bands = np.where(np.isnan(ages), len(MIS_AGE_BANDS), np.digitize(np.nan_to_num(ages), MIS_AGE_BANDS) - 1)
+    age_band_counts = snapshot.crosstab_by_diagnosis(age_bands, len(MIS_AGE_BANDS) + 1, mask)
+    stats = {column: snapshot.stats_by_diagnosis(column, mask) for column in VisitSnapshot.NUMERIC_COLUMNS}
+    
+    band_names = [f"{low}-{high - 1}" for low, high in zip(MIS_AGE_BANDS, MIS_AGE_BANDS[1:])]
+    band_names.append(f"{MIS_AGE_BANDS[-1]}+")
+    
+    def number(value):
+        return None if np.isnan(value) else round(float(value), 1)
+    
+    rows = []
+    for code in np.argsort(-visits, kind='stable'):
+        if not visits[code]:
+            break
+        row = {'diagnosis': str(snapshot.diagnosis_labels[code]), 'visits': int(visits[code])}
+        for index, gender in enumerate(snapshot.gender_labels):
+            row[f"gender_{gender or 'unknown'}"] = int(genders[code, index])
+        for index, band in enumerate(band_names):
+            row[f"age_{band}"] = int(age_band_counts[code, index])
+        row['age_median'] = number(stats['age']['median'][code])
+        for column in VisitSnapshot.NUMERIC_COLUMNS:
+            row[f"{column}_mean"] = number(stats[column]['mean'][code])
+        for column in ('weight', 'systolic', 'diastolic'):
+            row[f"{column}_sd"] = number(stats[column]['std'][code])
+        rows.append(row)
+    return rows
+
+def write_mis_csv(rows, path):
+    """Write mis_report rows as CSV"""
+    fieldnames = []
+    for row in rows:
+        fieldnames += [name for name in row if name not in fieldnames]
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames or ['diagnosis', 'visits'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+def query_patient_prescriptions(cursor, patient_id):
+    """Return a patient's prescriptions from both the hot and archive tiers, newest first.
+
+    Rows have the prescriptions-table columns followed by patient name, age and gender.
+    """
+    cursor.execute('''
+        SELECT p.*, pt.name, pt.age, pt.gender 
+        FROM prescriptions p 
+        JOIN patients pt ON p.patient_reg_no = pt.reg_no 
+        WHERE p.patient_reg_no = ? 
+        ORDER BY p.date DESC
+    ''', (patient_id,))
+    prescriptions = cursor.fetchall()
+    
+    cursor.execute('''
+        SELECT a.id, a.patient_reg_no, a.date, a.codec, a.payload, pt.name, pt.age, pt.gender
+        FROM archive.archived_prescriptions a
+        JOIN patients pt ON a.patient_reg_no = pt.reg_no
+        WHERE a.patient_reg_no = ?
+        ORDER BY a.date DESC
+    ''', (patient_id,))
+    archived = [unpack_archived_prescription(row) + tuple(row[5:]) for row in cursor.fetchall()]
+    
+    if archived:
+        # Archived rows are normally all older, but merge by date in case the cutoff moved
+        prescriptions = sorted(prescriptions + archived, key=lambda row: row[2] or '', reverse=True)
+    return prescriptions
+
+def load_server_token(path=SERVER_TOKEN_FILE):
+    """The saved clinic server token, or None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def save_server_token(token, path=SERVER_TOKEN_FILE):
+    """Store a clinic server token readable only by this user"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + "\n")
+
+def load_or_create_server_token(path=SERVER_TOKEN_FILE):
+    """The server's token, generated and saved the first time"""
+    token = load_server_token(path)
+    if token is None:
+        token = secrets.token_urlsafe(24)
+        save_server_token(token, path)
+    return token
+
+class ApiError(Exception):
+    """Error returned by the clinic server, carrying an HTTP status"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class SQLiteConnectionPool:
+    """Fixed set of SQLite connections shared by the server's worker threads.
+    
+    Connections are opened once with the archive attached and handed out one
+    request at a time; each request runs in its own transaction.
+    """
+    def __init__(self, db_path='medical_prescription.db', size=4):
+        self.connections = queue.Queue()
+        for i in range(size):
+            conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+            if i == 0:
+                initialize_database_schema(conn)
+            else:
+                conn.execute("PRAGMA foreign_keys = ON")
+                conn.execute("ATTACH DATABASE 'medical_prescription_archive.db' AS archive")
+            self.connections.put(conn)
+        self.size = size
+    
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; commits on success and rolls back on error"""
+        conn = self.connections.get()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.connections.put(conn)
+    
+    def close(self):
+        """Close every pooled connection"""
+        for _ in range(self.size):
+            self.connections.get().close()
+
+class ClinicApiServer:
+    """Local HTTP/JSON API that owns the clinic database for the workstations on the LAN.
+    
+    Runs on asyncio; database work is handed to a thread pool sized like the
+    connection pool so slow queries never block other clients.
+    """
+    def __init__(self, host='127.0.0.1', port=DEFAULT_SERVER_PORT, pool_size=4, token=None):
+        self.host = host
+        self.port = port
+        self.token = token or load_or_create_server_token()
+        self.pool = SQLiteConnectionPool(size=pool_size)
+        self.executor = ThreadPoolExecutor(max_workers=pool_size)
+        self.catalog_lock = threading.Lock()
+        self.server = None
+        self.loop = None
+        self.thread = None
+        self.change_event = None  # Replaced after every write to wake long-polling clients
+        self.prune_task = None
+        
+        self.routes = []
+        self.add_route('GET', r'/api/patients', self.list_patients)
+        self.add_route('POST', r'/api/patients', self.create_patient)
+        self.add_route('GET', r'/api/patients/(\d+)', self.get_patient)
+        self.add_route('PUT', r'/api/patients/(\d+)', self.update_patient)
+        self.add_route('DELETE', r'/api/patients/(\d+)', self.delete_patient)
+        self.add_route('GET', r'/api/patients/(\d+)/prescriptions', self.list_prescriptions)
+        self.add_route('GET', r'/api/patients/(\d+)/vitals', self.list_vitals)
+        self.add_route('GET', r'/api/patients/(\d+)/allergies', self.list_allergies)
+        self.add_route('POST', r'/api/prescriptions', self.create_prescription)
+        self.add_route('GET', r'/api/catalogs/(\w+)', self.get_catalog)
+        self.add_route('PUT', r'/api/catalogs/(\w+)', self.put_catalog)
+        self.add_route('GET', r'/api/patients/(\d+)/images', self.list_images)
+        self.add_route('POST', r'/api/patients/(\d+)/images', self.upload_image)
+        self.add_route('PUT', r'/api/images/(\d+)', self.update_image)
+        self.add_route('DELETE', r'/api/images/(\d+)', self.delete_image)
+        self.add_route('GET', r'/api/images/(\d+)/file', self.image_file)
+        self.add_route('POST', r'/api/batch', self.batch)
+        self.add_route('GET', r'/api/changes', self.changes)
+        self.add_route('GET', r'/api/queue', self.get_queue)
+        self.add_route('POST', r'/api/queue', self.add_to_queue)
+        self.add_route('PUT', r'/api/queue/(\d+)', self.update_queue_status)
+        self.add_route('GET', r'/api/analytics', self.get_analytics)
+        self.add_route('POST', r'/api/analytics/rebuild', self.rebuild_analytics)
+        self.add_route('GET', r'/api/analytics/mis', self.get_mis_report)
+    
+    def add_route(self, method, pattern, handler):
+        """Register a handler; plain functions run on the thread pool, coroutines on the event loop"""
+        self.routes.append((method, re.compile(pattern), handler))
+    
+    async def start(self):
+        """Bind the listening socket"""
+        self.change_event = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.prune_task = asyncio.ensure_future(self.prune_change_log_periodically())
+    
+    async def prune_change_log_periodically(self):
+        """Keep the change log bounded on a server that runs for weeks"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(CHANGE_LOG_PRUNE_SECONDS)
+            try:
+                await loop.run_in_executor(self.executor, self.prune_change_log)
+            except Exception as e:
+                print(f"Error pruning change log: {e}")
+    
+    def prune_change_log(self, keep=CHANGE_LOG_KEEP):
+        """Trim the change log to its newest keep entries"""
+        with self.pool.connection() as conn:
+            prune_change_log(conn, keep)
+    
+    def serve_forever(self):
+        """Run the server in the foreground until interrupted"""
+        async def run():
+            await self.start()
+            print(f"Clinic server listening on http://{self.host}:{self.port}")
+            if self.host in ('127.0.0.1', 'localhost'):
+                print("Only this computer can connect; use --host 0.0.0.0 to serve the other computers")
+            print(f"Connect with: python3 main.py --connect http://SERVER-IP:{self.port} --token {self.token}")
+            async with self.server:
+                await self.server.serve_forever()
+        try:
+            asyncio.run(run())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+    
+    def start_in_thread(self):
+        """Run the server on a background thread and return the bound port"""
+        ready = threading.Event()
+        
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            ready.set()
+            self.loop.run_forever()
+            self.server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+        
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.port
+    
+    def stop(self):
+        """Stop a server started with start_in_thread"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            self.loop = None
+        self.close()
+    
+    def close(self):
+        """Release worker threads and database connections"""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
+    
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one keep-alive connection"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode('latin-1').split()
+                
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                
+                token = headers.get(SERVER_TOKEN_HEADER.lower(), '').encode('latin-1')
+                if hmac.compare_digest(token, self.token.encode('latin-1')):
+                    status, payload, content_type, extra_headers = await self.dispatch(method, target, headers, body)
+                else:
+                    status, payload, content_type, extra_headers = (
+                        401, json.dumps({'error': "Missing or wrong clinic server token"}).encode('utf-8'),
+                        'application/json', {})
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                
+                reason = http.client.responses.get(status, '')
+                head = [f"HTTP/1.1 {status} {reason}",
+                        f"Content-Type: {content_type}",
+                        f"Content-Length: {len(payload)}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f"{name}: {value}" for name, value in extra_headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+    
+    async def dispatch(self, method, target, headers, body):
+        """Route one request; returns (status, payload bytes, content type, extra headers)"""
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        
+        try:
+            handler, params = self.match_route(method, url.path)
+            request = {'method': method, 'path': url.path, 'params': params, 'query': query, 'body': body}
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(request)
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(self.executor, handler, request)
+        except ApiError as e:
+            return e.status, json.dumps({'error': e.message}).encode('utf-8'), 'application/json', {}
+        except Exception as e:
+            print(f"Error handling {method} {url.path}: {e}")
+            return 500, json.dumps({'error': str(e)}).encode('utf-8'), 'application/json', {}
+        
+        if isinstance(result, bytes):
+            return 200, result, 'application/octet-stream', {}
+        
+        payload = json.dumps(result, ensure_ascii=False).encode('utf-8')
+        if method != 'GET':
+            self.notify_changes()
+            return 200, payload, 'application/json', {}
+        
+        # Let clients revalidate cached responses without downloading them again
+        etag = f'"{hashlib.sha1(payload).hexdigest()}"'
+        if headers.get('if-none-match') == etag:
+            return 304, b'', 'application/json', {'ETag': etag}
+        return 200, payload, 'application/json', {'ETag': etag}
+    
+    def match_route(self, method, path):
+        """Find the handler for a request, raising 404/405 when there is none"""
+        path_matched = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if match:
+                path_matched = True
+                if route_method == method:
+                    return handler, match.groups()
+        if path_matched:
+            raise ApiError(405, f"{method} not allowed on {path}")
+        raise ApiError(404, f"Not found: {path}")
+    
+    def request_json(self, request):
+        """Decode a JSON request body"""
+        try:
+            return json.loads(request['body'] or b'{}')
+        except ValueError:
+            raise ApiError(400, "Invalid JSON body")
+    
+    async def batch(self, request):
+        """Run several API requests in one round trip"""
+        responses = []
+        for item in self.request_json(request).get('requests', []):
+            body = item.get('body')
+            status, payload, content_type, extra_headers = await self.dispatch(
+                item.get('method', 'GET'), item.get('path', ''), {},
+                json.dumps(body).encode('utf-8') if body is not None else b'')
+            if content_type != 'application/json':
+                responses.append({'status': 400, 'body': {'error': "Binary responses cannot be batched"}})
+                continue
+            responses.append({'status': status, 'body': json.loads(payload) if payload else None,
+                              'etag': extra_headers.get('ETag')})
+        return {'responses': responses}
+    
+    def notify_changes(self):
+        """Wake every client waiting on /api/changes"""
+        self.change_event.set()
+        self.change_event = asyncio.Event()
+    
+    async def changes(self, request):
+        """Long-poll the change log: returns as soon as there are entries after ?since, or at ?timeout"""
+        try:
+            since = int(request['query'].get('since', -1))
+            timeout = min(float(request['query'].get('timeout', 25)), 60)
+        except ValueError:
+            raise ApiError(400, "since and timeout must be numbers")
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            event = self.change_event
+            result = await loop.run_in_executor(self.executor, self.read_changes, since)
+            remaining = deadline - loop.time()
+            if result['changes'] or result.get('reset') or since < 0 or remaining <= 0:
+                return result
+            # Re-check every few seconds too, for writes made by another process on this machine
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, 2.0))
+            except asyncio.TimeoutError:
+                pass
+    
+    def read_changes(self, since):
+        """Change-log entries after since, plus the current rows of the patients they touch"""
+        with self.pool.connection() as conn:
+            oldest, last_seq = conn.execute("SELECT MIN(seq), COALESCE(MAX(seq), 0) FROM change_log").fetchone()
+            if since < 0:
+                return {'last_seq': last_seq, 'changes': []}
+            if since > last_seq or (oldest is not None and since < oldest - 1):
+                # The client missed pruned entries or the database was replaced
+                return {'last_seq': last_seq, 'changes': [], 'reset': True}
+            
+            rows = conn.execute('''
+                SELECT seq, entity, entity_id, patient_reg_no, op FROM change_log
+                WHERE seq > ? ORDER BY seq LIMIT 1000
+            ''', (since,)).fetchall()
+            changes = [{'seq': seq, 'entity': entity, 'id': entity_id, 'patient_reg_no': patient_reg_no, 'op': op}
+                       for seq, entity, entity_id, patient_reg_no, op in rows]
+            
+            patient_ids = sorted({change['id'] for change in changes if change['entity'] == 'patient'})
+            patients = []
+            if patient_ids:
+                placeholders = ", ".join("?" for _ in patient_ids)
+                patients = conn.execute(f'''
+                    SELECT reg_no, name, age, gender, phone, address FROM patients
+                    WHERE reg_no IN ({placeholders})
+                ''', patient_ids).fetchall()
+        
+        return {'last_seq': rows[-1][0] if rows else since, 'changes': changes, 'patients': patients}
+    
+    def get_queue(self, request):
+        """Visit queue for ?date (default today)"""
+        visit_date = request['query'].get('date') or datetime.now().strftime("%Y-%m-%d")
+        with self.pool.connection() as conn:
+            return query_visit_queue(conn.cursor(), visit_date)
+    
+    def add_to_queue(self, request):
+        """Give a patient the next token in today's queue"""
+        data = self.request_json(request)
+        if not data.get('patient_reg_no'):
+            raise ApiError(400, "patient_reg_no is required")
+        try:
+            with self.pool.connection() as conn:
+                queue_id, token = enqueue_visit(conn, data['patient_reg_no'],
+                                                data.get('visit_date') or datetime.now().strftime("%Y-%m-%d"))
+        except ValueError as e:
+            raise ApiError(409, str(e))
+        return {'id': queue_id, 'token': token}
+    
+    def update_queue_status(self, request):
+        """Change the status of a queued visit"""
+        status = self.request_json(request).get('status')
+        try:
+            with self.pool.connection() as conn:
+                set_visit_status(conn, request['params'][0], status)
+        except LookupError as e:
+            raise ApiError(404, str(e))
+        except ValueError as e:
+            raise ApiError(409, str(e))
+        return {'status': status}
+    
+    def list_patients(self, request):
+        """Patient table rows, optionally filtered like the search box"""
+        search_term = request['query'].get('search', '').strip()
+        with self.pool.connection() as conn:
+            if search_term:
+                rows = conn.execute('''
+                    SELECT reg_no, name, age, gender, phone, address
+                    FROM patients
+                    WHERE name LIKE ? OR phone LIKE ? OR reg_no = ?
+                    ORDER BY reg_no DESC
+                ''', (f'%{search_term}%', f'%{search_term}%', search_term)).fetchall()
+            else:
+                rows = conn.execute("SELECT reg_no, name, age, gender, phone, address FROM patients ORDER BY reg_no DESC").fetchall()
+        return rows
+    
+    def create_patient(self, request):
+        """Register a new patient"""
+        data = self.request_json(request)
+        if not data.get('name'):
+            raise ApiError(400, "Patient name is required!")
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                INSERT INTO patients (name, age, gender, weight, phone, address, created_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                data['name'], data.get('age'), data.get('gender'), data.get('weight'),
+                data.get('phone'), data.get('address'),
+                data.get('created_date') or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            ))
+            if data.get('allergies'):
+                replace_patient_allergies(conn, cursor.lastrowid, data['allergies'])
+        return {'reg_no': cursor.lastrowid}
+    
+    def get_patient(self, request):
+        """Full patients-table row for one patient"""
+        with self.pool.connection() as conn:
+            patient = conn.execute("SELECT * FROM patients WHERE reg_no=?", request['params']).fetchone()
+        if not patient:
+            raise ApiError(404, "Patient not found")
+        return patient
+    
+    def update_patient(self, request):
+        """Update a patient's details"""
+        data = self.request_json(request)
+        if not data.get('name'):
+            raise ApiError(400, "Patient name is required!")
+        with self.pool.connection() as conn:
+            cursor = conn.execute('''
+                UPDATE patients
+                SET name=?, age=?, gender=?, weight=?, phone=?, address=?
+                WHERE reg_no=?
+            ''', (
+                data['name'], data.get('age'), data.get('gender'), data.get('weight'),
+                data.get('phone'), data.get('address'), request['params'][0]
+            ))
+            if cursor.rowcount and 'allergies' in data:
+                replace_patient_allergies(conn, request['params'][0], data['allergies'])
+        if not cursor.rowcount:
+            raise ApiError(404, "Patient not found")
+        return {'updated': cursor.rowcount}
+    
+    def delete_patient(self, request):
+        """Delete a patient with their prescriptions, images, vitals, queue entries and allergies"""
+        with self.pool.connection() as conn:
+            image_paths = delete_patient_cascade(conn, request['params'][0])
+            if image_paths is not None:
+                reclaim_free_pages(conn)
+        if image_paths is None:
+            raise ApiError(404, "Patient not found")
+        self.executor.submit(remove_files, image_paths)
+        return {'deleted': 1}
+    
+    def list_prescriptions(self, request):
+        """A patient's prescriptions from both tiers, in query_patient_prescriptions row layout"""
+        with self.pool.connection() as conn:
+            return query_patient_prescriptions(conn.cursor(), request['params'][0])
+    
+    def list_vitals(self, request):
+        """A patient's vitals rows, in query_patient_vitals row layout"""
+        with self.pool.connection() as conn:
+            return query_patient_vitals(conn.cursor(), request['params'][0])
+    
+    def list_allergies(self, request):
+        """A patient's (allergen, reaction) rows"""
+        with self.pool.connection() as conn:
+            return query_patient_allergies(conn.cursor(), request['params'][0])
+    
+    def create_prescription(self, request):
+        """Save a prescription given as a PRESCRIPTION_COLUMNS mapping"""
+        data = self.request_json(request)
+        if not data.get('patient_reg_no'):
+            raise ApiError(400, "patient_reg_no is required")
+        try:
+            with self.pool.connection() as conn:
+                prescription_id = insert_prescription(conn, data)
+        except ValueError:
+            raise ApiError(400, "date must start with YYYY-MM-DD")
+        return {'id': prescription_id}
+    
+    def get_analytics(self, request):
+        """Analytics report for ?start..?end from the rollup tables"""
+        query = request['query']
+        try:
+            top = int(query.get('top', 20))
+        except ValueError:
+            raise ApiError(400, "top must be a number")
+        with self.pool.connection() as conn:
+            return analytics_report(conn.cursor(), query.get('start', '0000-00-00'),
+                                    query.get('end', datetime.now().strftime("%Y-%m-%d")),
+                                    top, query.get('diagnosis'))
+    
+    def rebuild_analytics(self, request):
+        """Recompute the rollup tables from all prescriptions"""
+        with self.pool.connection() as conn:
+            return {'prescriptions': rebuild_analytics_rollups(conn)}
+    
+    def get_mis_report(self, request):
+        """MIS distribution report for ?start..?end from the server's visit snapshot"""
+        try:
+            with self.pool.connection() as conn:
+                snapshot = VisitSnapshot.open(conn)
+        except RuntimeError as e:
+            raise ApiError(501, str(e))
+        return mis_report(snapshot, request['query'].get('start'), request['query'].get('end'))
+    
+    def catalog_file(self, request):
+        """JSON file behind a catalog name"""
+        name = request['params'][0]
+        if name not in CATALOG_FILES:
+            raise ApiError(404, f"Unknown catalog: {name}")
+        return CATALOG_FILES[name]
+    
+    def get_catalog(self, request):
+        """Contents of a drug, investigation or advice catalog"""
+        path = self.catalog_file(request)
+        with self.catalog_lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except FileNotFoundError:
+                raise ApiError(404, "Catalog has not been created yet")
+    
+    def put_catalog(self, request):
+        """Replace a catalog"""
+        path = self.catalog_file(request)
+        try:
+            catalog = json.loads(request['body'])
+        except ValueError:
+            raise ApiError(400, "Invalid JSON body")
+        if not isinstance(catalog, list):
+            raise ApiError(400, "Catalog must be a list")
+        with self.catalog_lock:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(catalog, f, ensure_ascii=False, indent=2)
+            os.replace(path + '.tmp', path)
+        return {'items': len(catalog)}
+    
+    def list_images(self, request):
+        """patient_images rows for one patient, newest first"""
+        with self.pool.connection() as conn:
+            return conn.execute('''
+                SELECT * FROM patient_images
+                WHERE patient_reg_no = ?
+                ORDER BY date DESC
+            ''', request['params']).fetchall()
+    
+    def upload_image(self, request):
+        """Store an uploaded image; the raw file is the request body"""
+        patient_id = request['params'][0]
+        file_name = os.path.basename(request['query'].get('filename', 'image.jpg'))
+        if not request['body']:
+            raise ApiError(400, "Empty image upload")
+        
+        images_dir = "patient_images"
+        os.makedirs(images_dir, exist_ok=True)
+        new_path = os.path.join(images_dir, f"{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file_name}")
+        with open(new_path, 'wb') as f:
+            f.write(request['body'])
+        
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.execute('''
+                    INSERT INTO patient_images (patient_reg_no, image_path, description, date)
+                    VALUES (?, ?, ?, ?)
+                ''', (patient_id, new_path, request['query'].get('description', ''),
+                      datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        except Exception:
+            # Without its row nothing would ever show or delete the file
+            remove_files([new_path])
+            raise
+        return {'id': cursor.lastrowid, 'image_path': new_path}
+    
+    def update_image(self, request):
+        """Change an image's description"""
+        data = self.request_json(request)
+        with self.pool.connection() as conn:
+            cursor = conn.execute("UPDATE patient_images SET description = ? WHERE id = ?",
+                                  (data.get('description', '').strip(), request['params'][0]))
+        if not cursor.rowcount:
+            raise ApiError(404, "Image not found")
+        return {'updated': cursor.rowcount}
+    
+    def image_path(self, conn, image_id):
+        """Stored file path of an image"""
+        row = conn.execute("SELECT image_path FROM patient_images WHERE id = ?", (image_id,)).fetchone()
+        if not row:
+            raise ApiError(404, "Image not found")
+        return row[0]
+    
+    def delete_image(self, request):
+        """Delete an image row and its file"""
+        with self.pool.connection() as conn:
+            image_path = self.image_path(conn, request['params'][0])
+            conn.execute("DELETE FROM patient_images WHERE id = ?", request['params'])
+        remove_files(with_original_images([image_path]))
+        return {'deleted': 1}
+    
+    def image_file(self, request):
+        """Raw bytes of an image file"""
+        with self.pool.connection() as conn:
+            image_path = self.image_path(conn, request['params'][0])
+        try:
+            with open(image_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ApiError(404, "Image file is missing on the server")
+
+class ClinicApiClient:
+    """Thin client for ClinicApiServer used when the GUI runs with --connect.
+    
+    Keeps one keep-alive connection, caches GET responses for a few seconds and
+    revalidates them by ETag afterwards; any write clears the cache. The GUI
+    and worker threads share one client, so the cache has its own lock.
+    """
+    def __init__(self, base_url, token, cache_ttl=5.0, timeout=30):
+        self.base_url = base_url
+        self.token = token
+        url = urlsplit(base_url if '://' in base_url else f"http://{base_url}")
+        self.host = url.hostname
+        self.port = url.port or DEFAULT_SERVER_PORT
+        self.cache_ttl = cache_ttl
+        self.timeout = timeout
+        self.cache = {}  # path -> (etag, expires, body bytes)
+        self.cache_lock = threading.Lock()
+        self.cache_generation = 0  # Bumped by every write so a GET sent before it is not cached after it
+        self.lock = threading.Lock()
+        self.connection = None
+        self.closed = False
+        self.image_cache_dir = 'remote_image_cache'
+    
+    def send(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)"""
+        with self.lock:
+            for attempt in range(2):
+                if self.connection is None:
+                    self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                try:
+                    self.connection.request(method, path, body=body,
+                                            headers={**(headers or {}), SERVER_TOKEN_HEADER: self.token})
+                    response = self.connection.getresponse()
+                    return response.status, response.headers, response.read()
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # The server dropped an idle keep-alive connection; reconnect once
+                    self.connection.close()
+                    self.connection = None
+                    if attempt or self.closed:
+                        raise
+                except Exception:
+                    self.connection.close()
+                    self.connection = None
+                    raise
+    
+    def close(self):
+        """Drop the connection, interrupting a request blocked in another thread"""
+        self.closed = True
+        connection = self.connection
+        if connection is not None and connection.sock is not None:
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+    
+    def cached(self, path):
+        """(cache entry or None, cache generation) for a GET path"""
+        with self.cache_lock:
+            return self.cache.get(path), self.cache_generation
+    
+    def store(self, path, entry, generation):
+        """Cache a GET response unless a write happened since it was sent"""
+        with self.cache_lock:
+            if generation == self.cache_generation:
+                self.cache[path] = entry
+    
+    def clear_cache(self):
+        """Forget every cached response after a write"""
+        with self.cache_lock:
+            self.cache.clear()
+            self.cache_generation += 1
+    
+    def decode(self, status, data):
+        """Parse a JSON response, raising ApiError for error statuses"""
+        result = json.loads(data) if data else None
+        if status >= 400:
+            raise ApiError(status, (result or {}).get('error', f"Server returned {status}"))
+        return result
+    
+    def request(self, method, path, payload=None, query=None):
+        """Make an API call and return the decoded JSON result"""
+        if query:
+            path += '?' + urlencode(query)
+        
+        if method != 'GET':
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8') if payload is not None else None
+            status, _, data = self.send(method, path, body, {'Content-Type': 'application/json'})
+            self.clear_cache()
+            return self.decode(status, data)
+        
+        now = time.monotonic()
+        cached, generation = self.cached(path)
+        if cached and cached[1] > now:
+            return self.decode(200, cached[2])
+        
+        status, headers, data = self.send('GET', path, headers={'If-None-Match': cached[0]} if cached else {})
+        if status == 304 and cached:
+            self.store(path, (cached[0], now + self.cache_ttl, cached[2]), generation)
+            return self.decode(200, cached[2])
+        
+        result = self.decode(status, data)
+        if headers.get('ETag'):
+            self.store(path, (headers['ETag'], now + self.cache_ttl, data), generation)
+        return result
+    
+    def batch(self, calls):
+        """Run (method, path, payload) calls in one round trip; GET results are cached"""
+        if any(method != 'GET' for method, _, _ in calls):
+            self.clear_cache()
+        
+        # The POST itself clears the cache, so these results are stored under the generation after it
+        result = self.request('POST', '/api/batch', {'requests': [
+            {'method': method, 'path': path, 'body': payload} for method, path, payload in calls
+        ]})
+        generation = self.cached('')[1]
+        
+        now = time.monotonic()
+        results = []
+        for (method, path, _), response in zip(calls, result['responses']):
+            data = json.dumps(response['body'], ensure_ascii=False).encode('utf-8')
+            if method == 'GET' and response['status'] == 200 and response.get('etag'):
+                self.store(path, (response['etag'], now + self.cache_ttl, data), generation)
+            results.append(response)
+        return results
+    
+    def poll_changes(self, since, timeout=25):
+        """Wait up to timeout seconds for change-feed entries after since (never cached)"""
+        status, _, data = self.send('GET', f'/api/changes?since={since}&timeout={timeout}')
+        return self.decode(status, data)
+    
+    def visit_queue(self, visit_date):
+        return self.request('GET', '/api/queue', query={'date': visit_date})
+    
+    def enqueue_visit(self, reg_no, visit_date):
+        result = self.request('POST', '/api/queue', {'patient_reg_no': reg_no, 'visit_date': visit_date})
+        return result['id'], result['token']
+    
+    def set_visit_status(self, queue_id, status):
+        return self.request('PUT', f'/api/queue/{queue_id}', {'status': status})
+    
+    def analytics_report(self, start_day, end_day, top=20, diagnosis=None):
+        query = {'start': start_day, 'end': end_day, 'top': top}
+        if diagnosis:
+            query['diagnosis'] = diagnosis
+        return self.request('GET', '/api/analytics', query=query)
+    
+    def rebuild_analytics(self):
+        return self.request('POST', '/api/analytics/rebuild')['prescriptions']
+    
+    def mis_report(self, start_day, end_day):
+        return self.request('GET', '/api/analytics/mis', query={'start': start_day, 'end': end_day})
+    
+    def prefetch_catalogs(self):
+        """Load every catalog with a single request"""
+        self.batch([('GET', f'/api/catalogs/{name}', None) for name in CATALOG_FILES])
+    
+    def list_patients(self, search=None):
+        return self.request('GET', '/api/patients', query={'search': search} if search else None)
+    
+    def get_patient(self, reg_no):
+        try:
+            return self.request('GET', f'/api/patients/{reg_no}')
+        except ApiError as e:
+            if e.status == 404:
+                return None
+            raise
+    
+    def create_patient(self, patient_data):
+        return self.request('POST', '/api/patients', patient_data)['reg_no']
+    
+    def update_patient(self, reg_no, patient_data):
+        return self.request('PUT', f'/api/patients/{reg_no}', patient_data)
+    
+    def delete_patient(self, reg_no):
+        return self.request('DELETE', f'/api/patients/{reg_no}')
+    
+    def patient_prescriptions(self, reg_no):
+        return self.request('GET', f'/api/patients/{reg_no}/prescriptions')
+    
+    def patient_vitals(self, reg_no):
+        return self.request('GET', f'/api/patients/{reg_no}/vitals')
+    
+    def patient_allergies(self, reg_no):
+        return self.request('GET', f'/api/patients/{reg_no}/allergies')
+    
+    def create_prescription(self, prescription):
+        return self.request('POST', '/api/prescriptions', prescription)['id']
+    
+    def get_catalog(self, name):
+        """Catalog contents, or None if the server has none yet"""
+        try:
+            return self.request('GET', f'/api/catalogs/{name}')
+        except ApiError as e:
+            if e.status == 404:
+                return None
+            raise
+    
+    def put_catalog(self, name, catalog):
+        return self.request('PUT', f'/api/catalogs/{name}', catalog)
+    
+    def list_images(self, reg_no):
+        return self.request('GET', f'/api/patients/{reg_no}/images')
+    
+    def upload_image(self, reg_no, file_path, description):
+        """Send an image file to the server; returns the new image id"""
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        query = urlencode({'filename': os.path.basename(file_path), 'description': description})
+        status, _, body = self.send('POST', f'/api/patients/{reg_no}/images?{query}', data,
+                                    {'Content-Type': 'application/octet-stream'})
+        self.clear_cache()
+        return self.decode(status, body)['id']
+    
+    def update_image(self, image_id, description):
+        return self.request('PUT', f'/api/images/{image_id}', {'description': description})
+    
+    def delete_image(self, image_id):
+        return self.request('DELETE', f'/api/images/{image_id}')
+    
+    def image_file(self, image_id, image_path):
+        """Local copy of a server image, downloaded on first use"""
+        os.makedirs(self.image_cache_dir, exist_ok=True)
+        local_path = os.path.join(self.image_cache_dir, os.path.basename(image_path))
+        if not os.path.exists(local_path):
+            status, _, data = self.send('GET', f'/api/images/{image_id}/file')
+            if status != 200:
+                self.decode(status, data)
+            with open(local_path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(local_path + '.tmp', local_path)
+        return local_path
+
+class ChangeFeedWorker(QThread):
+    """Long-polls the clinic server's change feed and emits each batch of changes.
+    
+    Uses its own connection so the GUI's requests are never queued behind a poll.
+    """
+    changes = pyqtSignal(dict)
+    
+    def __init__(self, base_url, token, parent=None):
+        super().__init__(parent)
+        self.client = ClinicApiClient(base_url, token, timeout=60)
+        self.running = True
+        self.since = -1
+    
+    def run(self):
+        """Poll until stopped, backing off while the server is unreachable"""
+        while self.running:
+            try:
+                result = self.client.poll_changes(self.since)
+            except Exception as e:
+                if self.running:
+                    print(f"Change feed error: {e}")
+                    for _ in range(30):
+                        if not self.running:
+                            break
+                        self.msleep(100)
+                continue
+            
+            if self.since >= 0 and (result['changes'] or result.get('reset')):
+                self.changes.emit(result)
+            self.since = result['last_seq']
+    
+    def stop(self):
+        """Stop polling and interrupt the request in flight"""
+        self.running = False
+        self.client.close()
+
+def split_generic_name(generic_name):
+    """Casefolded ingredient names of a generic, e.g. "Paracetamol + Caffeine" -> ('paracetamol', 'caffeine')"""
+    return tuple(part for part in (' '.join(piece.split()).casefold()
+                                   for piece in re.split(r'[+/]', generic_name or '')) if part)
+
+class InteractionChecker:
+    """Duplicate-generic, duplicate-therapy and interaction checks for a drug being prescribed.
+    
+    Built once from the drug catalog, the drug class list and the interaction
+    list. Interaction rows may name a class instead of a generic; they are
+    expanded up front into a dict keyed by the sorted generic pair, so checking
+    one drug against the k already prescribed is O(k) dict lookups.
+    """
+    SEVERITY_ORDER = {'major': 0, 'moderate': 1, 'minor': 2}
+    
+    def __init__(self, drugs, drug_classes=(), interactions=()):
+        self.generics = {}  # casefolded formulation -> ingredient tuple
+        self.labels = {}  # casefolded ingredient -> name as written in the catalog
+        for drug in drugs:
+            ingredients = split_generic_name(drug.get('generic_name'))
+            self.generics[drug.get('formulation', '').strip().casefold()] = ingredients
+            for label in re.split(r'[+/]', drug.get('generic_name') or ''):
+                self.labels.setdefault(' '.join(label.split()).casefold(), ' '.join(label.split()))
+        
+        self.classes = defaultdict(set)  # ingredient -> class names
+        self.class_members = {}  # casefolded class name -> ingredients
+        for entry in drug_classes:
+            name = entry.get('class', '').strip()
+            self.class_members[name.casefold()] = {generic for item in entry.get('generics', [])
+                                                   for generic in split_generic_name(item)}
+            for generic in self.class_members[name.casefold()]:
+                self.classes[generic].add(name)
+        
+        self.pairs = {}  # (ingredient, ingredient) sorted -> (severity, effect)
+        for row in interactions:
+            left = self.expand(row.get('a'))
+            right = self.expand(row.get('b'))
+            entry = (row.get('severity', 'Moderate'), row.get('effect', ''))
+            for first in left:
+                for second in right:
+                    if first == second:
+                        continue
+                    key = (first, second) if first < second else (second, first)
+                    current = self.pairs.get(key)
+                    if current is None or self.severity_rank(entry[0]) < self.severity_rank(current[0]):
+                        self.pairs[key] = entry
+    
+    def expand(self, name):
+        """Ingredients named by a drug class or a generic name"""
+        return self.class_members.get(' '.join(str(name or '').split()).casefold()) or set(split_generic_name(name))
+    
+    def blocked_generics(self, allergies):
+        """Ingredient -> allergy description for (allergen, reaction) pairs; allergens may be classes.
         
-        # Image label
-        self.image_label = QLabel()
-        self.image_label.setAlignment(Qt.AlignCenter)
-        self.image_label.setStyleSheet("background-color: black;")
-        layout.addWidget(self.image_label)
+        The allergen's own name is included too, so a class name typed into a
+        drug name is caught as well as its members.
+        """
+        blocked = {}
+        for allergen, reaction in allergies:
+            description = f"{allergen} ({reaction})" if reaction else allergen
+            for ingredient in set(self.expand(allergen)) | set(split_generic_name(allergen)):
+                blocked.setdefault(ingredient, description)
+        return blocked
+    
+    def allergy_matches(self, formulation, blocked):
+        """(ingredient, allergy) pairs of blocked_generics found in a formulation.
         
-        # Close button
-        close_btn = QPushButton("Close (ESC)")
-        close_btn.clicked.connect(self.close)
-        close_btn.setStyleSheet("QPushButton { background-color: #f44336; color: white; font-weight: bold; padding: 10px; }")
-        layout.addWidget(close_btn)
+        Catalog drugs are matched by their generics. Drugs typed in by hand are
+        missing from the catalog or carry the typed name as their generic, so
+        any blocked generic or allergen named in that text counts as well.
+        """
+        ingredients = self.ingredients(formulation)
+        found = [ingredient for ingredient in ingredients if ingredient in blocked]
+        text = ' '.join(' '.join([formulation or '', *ingredients]).split()).casefold()
+        found += [name for name in blocked if name not in found
+                  and re.search(r'(?<!\w)' + re.escape(name) + r'(?!\w)', text)]
+        return [(name, blocked[name]) for name in found]
+    
+    def severity_rank(self, severity):
+        return self.SEVERITY_ORDER.get(str(severity).casefold(), len(self.SEVERITY_ORDER))
+    
+    def ingredients(self, formulation):
+        """Ingredients of a catalog formulation; () for drugs not in the catalog"""
+        return self.generics.get((formulation or '').strip().casefold(), ())
+    
+    def label(self, ingredient):
+        return self.labels.get(ingredient, ingredient.title())
+    
+    def check(self, formulation, prescribed):
+        """Warnings for adding formulation to the prescribed formulations, most severe first"""
+        new = self.ingredients(formulation)
+        warnings = []
+        for other in prescribed:
+            existing = self.ingredients(other)
+            shared = [ingredient for ingredient in new if ingredient in existing]
+            if shared:
+                warnings.append((-1, f"Duplicate generic: {formulation} and {other} both contain "
+                                     f"{', '.join(self.label(ingredient) for ingredient in shared)}"))
+                continue
+            for first in new:
+                for second in existing:
+                    same_class = self.classes.get(first, set()) & self.classes.get(second, set())
+                    if same_class:
+                        warnings.append((1, f"Duplicate therapy: {formulation} and {other} are both "
+                                            f"{', '.join(sorted(same_class))}"))
+                    interaction = self.pairs.get((first, second) if first < second else (second, first))
+                    if interaction:
+                        warnings.append((self.severity_rank(interaction[0]),
+                                         f"{interaction[0]} interaction: {self.label(first)} + {self.label(second)} "
+                                         f"({formulation} / {other}) - {interaction[1]}"))
+        return [message for _, message in sorted(warnings, key=lambda warning: warning[0])]
+
+def parse_drug_strength(text):
+    """(mg, ml) per unit from a strength like "500mg" or "120mg/5ml"; (None, None) if unreadable"""
+    match = DRUG_STRENGTH_PATTERN.search(text or '')
+    if not match:
+        return None, None
+    return float(match.group(1)), float(match.group(2)) if match.group(2) else None
+
+def compile_dosing_lookup(drugs, rules):
+    """Map casefolded formulations with a weight-based rule to (rule, mg per unit, ml per unit).
+    
+    Rules are keyed by generic name; combination products are left out since a
+    per-kg rule for one ingredient says nothing about the other.
+    """
+    rules_by_generic = {' '.join(str(rule.get('generic', '')).split()).casefold(): rule
+                        for rule in rules if rule.get('mg_per_kg')}
+    lookup = {}
+    for drug in drugs:
+        ingredients = split_generic_name(drug.get('generic_name'))
+        if len(ingredients) != 1 or ingredients[0] not in rules_by_generic:
+            continue
+        mg, ml = parse_drug_strength(drug.get('strength'))
+        if mg is None:
+            mg, ml = parse_drug_strength(drug.get('formulation'))
+        lookup[drug.get('formulation', '').strip().casefold()] = (rules_by_generic[ingredients[0]], mg, ml)
+    return lookup
+
+def weight_based_dose(entry, weight_kg):
+    """Dose text such as "7.5 ml (180 mg) 1+1+1+1" for a compile_dosing_lookup entry, or None.
+    
+    The dose is rounded down to what can be measured (half a ml of liquid or
+    half a tablet), so it never exceeds mg_per_kg or max_dose_mg. None means
+    the product cannot give the dose: less than half a unit, or more than
+    WEIGHT_DOSE_TOLERANCE below the target after rounding.
+    """
+    rule, mg_per_unit, ml_per_unit = entry
+    target_mg = rule['mg_per_kg'] * weight_kg
+    if rule.get('max_dose_mg'):
+        target_mg = min(target_mg, rule['max_dose_mg'])
+    
+    if mg_per_unit and ml_per_unit:
+        units = math.floor(target_mg / mg_per_unit * ml_per_unit * 2 + 1e-9) / 2
+        amount = f"{units:g} ml"
+        dose_mg = units * mg_per_unit / ml_per_unit
+    elif mg_per_unit:
+        units = math.floor(target_mg / mg_per_unit * 2 + 1e-9) / 2
+        amount = f"{units:g} tab"
+        dose_mg = units * mg_per_unit
+    else:
+        units = dose_mg = math.floor(target_mg + 1e-9)
+        amount = None
+    if units < 0.5 or dose_mg < target_mg * (1 - WEIGHT_DOSE_TOLERANCE):
+        return None
+    dose = f"{amount} ({dose_mg:g} mg)" if amount else f"{dose_mg:g} mg"
+    return f"{dose} {rule.get('frequency', '')}".strip()
+
+class PrescriptionDraftJournal:
+    """Crash-safe append-only journal of prescription form drafts.
+
+    The GUI thread only queues small diffs; a background thread appends them
+    as JSON lines, fsyncs once per batch and periodically compacts the file
+    into a single snapshot record.
+    """
+    def __init__(self, path='prescription_draft.journal', flush_interval=2.0, compact_after=200):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self.state = self.load()
+        self.records_since_snapshot = 0
+        # Start every session from a clean snapshot so a torn tail is never appended to
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"Error compacting draft journal: {e}")
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="draft-journal", daemon=True)
+        self.thread.start()
+    
+    def load(self):
+        """Replay the journal and return the last draft state"""
+        state = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write; everything before it is intact
+                        break
+                    op = record.get('op')
+                    if op == 'snapshot':
+                        state = dict(record.get('state', {}))
+                    elif op == 'diff':
+                        state.update(record.get('set', {}))
+                    elif op == 'clear':
+                        state = {}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading draft journal: {e}")
+        return state
+    
+    def record(self, diff):
+        """Queue a diff of changed form fields (called from the GUI thread)"""
+        if diff:
+            self.queue.put({'op': 'diff', 'set': diff})
+    
+    def clear(self):
+        """Discard the current draft"""
+        self.queue.put({'op': 'clear'})
+    
+    def close(self):
+        """Flush pending records and stop the writer thread"""
+        self.stopped.set()
+        self.thread.join(timeout=5)
+        # Records queued after the writer's last pass, such as the autosave on close
+        self.flush()
+    
+    def run(self):
+        """Writer thread: batch queued records and fsync once per batch"""
+        while not self.stopped.is_set():
+            self.stopped.wait(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Write all queued records to disk"""
+        batch = []
+        while True:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
         
-        self.load_image(image_path)
+        try:
+            for record in batch:
+                if record['op'] == 'clear':
+                    self.state = {}
+                else:
+                    self.state.update(record['set'])
+            
+            if any(record['op'] == 'clear' for record in batch) or \
+                    self.records_since_snapshot + len(batch) > self.compact_after:
+                self.compact()
+                return
+            
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in batch:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.records_since_snapshot += len(batch)
+        except Exception as e:
+            print(f"Error writing draft journal: {e}")
     
-    def load_image(self, image_path):
-        """Load and display image"""
-        if os.path.exists(image_path):
-            pixmap = QPixmap(image_path)
-            if not pixmap.isNull():
-                # Scale to fit screen while maintaining aspect ratio
-                screen_geometry = QApplication.primaryScreen().availableGeometry()
-                scaled_pixmap = pixmap.scaled(
-                    screen_geometry.width() - 100, 
-                    screen_geometry.height() - 150,
-                    Qt.KeepAspectRatio, 
-                    Qt.SmoothTransformation
-                )
-                self.image_label.setPixmap(scaled_pixmap)
-            else:
-                self.image_label.setText("Invalid image file")
-        else:
-            self.image_label.setText("Image file not found")
+    def compact(self):
+        """Rewrite the journal as a single snapshot record"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            if self.state:
+                f.write(json.dumps({'op': 'snapshot', 'state': self.state}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records_since_snapshot = 0
+
+def generate_synthetic_clinic(conn, images_dir, patients, prescriptions, drugs, images, seed=1):
+    """Fill an empty database with a made-up clinic; returns the drug catalog to save with it.
     
-    def keyPressEvent(self, event):
-        """Handle key press events"""
-        if event.key() == Qt.Key_Escape:
-            self.close()
-        super().keyPressEvent(event)
+    The same counts and seed always give the same clinic, so benchmark runs
+    of different versions are comparable. Images go to the first patients,
+    IMAGES_PER_PATIENT each, as 1600x1200 JPEGs like compressed uploads.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    
+    def random_date():
+        return (start + timedelta(seconds=rng.randrange(730 * 24 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+    
+    def random_word():
+        return "".join(rng.choice(SYNTHETIC_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+    
+    catalog = []
+    trade_names = set()
+    for _ in range(drugs):
+        trade_name = random_word()
+        while trade_name in trade_names:
+            trade_name += rng.choice(SYNTHETIC_SYLLABLES)
+        trade_names.add(trade_name)
+        form, prefix = rng.choice(SYNTHETIC_FORMS)
+        strength = f"{rng.choice((5, 10, 20, 40, 50, 100, 250, 500))}mg"
+        catalog.append({"trade_name": trade_name, "generic_name": rng.choice(SYNTHETIC_GENERICS),
+                        "strength": strength, "form": form, "formulation": f"{prefix} {trade_name} {strength}"})
+    
+    doctor_info = json.dumps({'name': "Dr. Benchmark", 'degrees': "MBBS, FCPS", 'designation': "Consultant",
+                              'institution': "Synthetic General Hospital", 'bmdc_reg_no': "A-00000",
+                              'phone': "01700000000", 'email': "doctor@example.com", 'address': "Dhaka"})
+    patient_rows = [(f"{random_word()} {random_word()}", rng.randint(1, 90), rng.choice(('Male', 'Female')),
+                     rng.randint(30, 95), f"01{rng.randint(300000000, 999999999)}",
+                     rng.choice(('Dhaka', 'Chattogram', 'Khulna', 'Rajshahi', 'Sylhet')), random_date())
+                    for _ in range(patients)]
+    prescription_rows = []
+    for _ in range(prescriptions if patients else 0):
+        drugs_data = [{'formulation': rng.choice(catalog)['formulation'] if catalog else "Tab. Napa 500mg",
+                       'dosage': rng.choice(('1+0+1', '1+1+1', '0+0+1', '1+0+0')),
+                       'duration': f"{rng.choice((3, 5, 7, 14, 30))} days",
+                       'instructions': rng.choice(('After meal', 'Before meal', ''))}
+                      for _ in range(rng.randint(1, 5))]
+        vitals = (f"• BP: {rng.randint(100, 160)}/{rng.randint(60, 100)} mmHg\n"
+                  f"• Pulse: {rng.randint(60, 110)}/min\n"
+                  f"• Temperature: {rng.choice((98, 98.6, 99, 100, 101.5, 102))}°F")
+        prescription_rows.append((rng.randint(1, patients), random_date(), rng.choice(SYNTHETIC_COMPLAINTS),
+                                  rng.choice(SYNTHETIC_DIAGNOSES), vitals, "Heart: S1+S2+0\nLungs: Clear",
+                                  "\n".join(rng.sample(SYNTHETIC_INVESTIGATIONS, rng.randint(0, 3))),
+                                  json.dumps(drugs_data), "\n".join(rng.sample(SYNTHETIC_ADVICE, 2)),
+                                  f"After {rng.choice((7, 14, 30))} days", doctor_info))
+    prescription_rows.sort(key=lambda row: row[1])
+    
+    os.makedirs(images_dir, exist_ok=True)
+    image_rows = []
+    for number in range(images if patients else 0):
+        image = QImage(1600, 1200, QImage.Format_RGB32)
+        image.fill(QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+        painter = QPainter(image)
+        for _ in range(40):
+            painter.setBrush(QColor(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+            painter.drawEllipse(rng.randrange(1600), rng.randrange(1200), rng.randint(20, 400), rng.randint(20, 400))
+        painter.end()
+        path = os.path.join(images_dir, f"synthetic_{number + 1}.jpg")
+        image.save(path, 'JPEG', 85)
+        image_rows.append((number // IMAGES_PER_PATIENT % patients + 1, path, f"Scan {number + 1}", random_date()))
+    
+    with conn:
+        conn.executemany('''
+            INSERT INTO patients (name, age, gender, weight, phone, address, created_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', patient_rows)
+        conn.executemany(f"INSERT INTO prescriptions ({', '.join(PRESCRIPTION_COLUMNS)}) "
+                         f"VALUES ({', '.join('?' for _ in PRESCRIPTION_COLUMNS)})", prescription_rows)
+        conn.executemany('''
+            INSERT INTO patient_images (patient_reg_no, image_path, description, date)
+            VALUES (?, ?, ?, ?)
+        ''', image_rows)
+    rebuild_analytics_rollups(conn)
+    backfill_vitals(conn)
+    return catalog
+
+def time_calls(function, repeat, setup=None):
+    """Call function repeat times, running setup(run) untimed before each call; returns timings in ms"""
+    times = []
+    for run in range(repeat):
+        if setup is not None:
+            setup(run)
+        QApplication.processEvents()  # finish deferred deletes from the previous call outside the timing
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return {'runs': repeat, 'first_ms': round(times[0], 3), 'min_ms': round(min(times), 3),
+            'median_ms': round(statistics.median(times), 3), 'mean_ms': round(statistics.mean(times), 3),
+            'max_ms': round(max(times), 3)}
+
+def run_benchmark(patients, prescriptions, drugs, images, repeat=5, seed=1):
+    """Time the main screens on a synthetic clinic in a temporary folder; returns JSON-ready results.
+    
+    Runs headless on the offscreen Qt platform unless QT_QPA_PLATFORM says
+    otherwise. The first_ms of each result is the cold call; the PDF runs
+    render a different prescription each time so the render cache is not
+    measured, except in generate_prescription_pdf_cached.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    previous_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='prescription_benchmark_')
+    os.chdir(work_dir)
+    try:
+        start = time.perf_counter()
+        conn = sqlite3.connect('medical_prescription.db')
+        initialize_database_schema(conn)
+        catalog = generate_synthetic_clinic(conn, 'patient_images', patients, prescriptions, drugs, images, seed)
+        busiest = conn.execute('''
+            SELECT patient_reg_no FROM prescriptions GROUP BY patient_reg_no ORDER BY COUNT(*) DESC, patient_reg_no LIMIT 1
+        ''').fetchone()
+        rows = conn.execute('''
+            SELECT p.*, pt.name, pt.age, pt.gender, pt.weight
+            FROM prescriptions p JOIN patients pt ON p.patient_reg_no = pt.reg_no
+            ORDER BY p.id DESC LIMIT ?
+        ''', (repeat + 1,)).fetchall()
+        conn.close()
+        with open('drug_database.json', 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, ensure_ascii=False)
+        generate_seconds = time.perf_counter() - start
+        
+        window = MedicalPrescriptionSystemPyQt()
+        try:
+            prescription_data = [{'patient_info': (row[1], row[12], row[13], row[14], row[15]),
+                                  'prescription': row[:12], 'doctor_info': json.loads(row[11])} for row in rows]
+            
+            def set_text(line_edit, text):
+                line_edit.blockSignals(True)
+                line_edit.setText(text)
+                line_edit.blockSignals(False)
+            
+            def select_patient(combo, reg_no):
+                combo.blockSignals(True)
+                combo.setCurrentIndex(max(combo.findData(reg_no), 0))
+                combo.blockSignals(False)
+            
+            results = {}
+            results['refresh_patient_list'] = time_calls(window.refresh_patient_list, repeat)
+            results['search_patient'] = time_calls(
+                window.search_patient, repeat, lambda run: set_text(window.search_entry, SYNTHETIC_SYLLABLES[0]))
+            results['filter_drugs'] = time_calls(
+                window.filter_drugs, repeat, lambda run: set_text(window.drug_search, "para"))
+            results['load_patient_history'] = time_calls(
+                window.load_patient_history, repeat,
+                lambda run: select_patient(window.history_patient_combo, busiest[0] if busiest else None))
+            results['load_patient_images'] = time_calls(
+                window.load_patient_images, repeat, lambda run: select_patient(window.images_patient_combo, 1))
+            if prescription_data:
+                results['create_prescription_html'] = time_calls(
+                    lambda: window.create_prescription_html(prescription_data[0]), repeat)
+                try:
+                    # Render one prescription untimed first: a failure here would open an error dialog below
+                    window.render_prescription_pdf_bytes(prescription_data[-1])
+                except Exception as e:
+                    results['generate_prescription_pdf'] = {'error': str(e)}
+                else:
+                    pdf_path = os.path.join(work_dir, 'benchmark.pdf')
+                    current = {}
+                    results['generate_prescription_pdf'] = time_calls(
+                        lambda: window.generate_prescription_pdf(current['data'], pdf_path), repeat,
+                        lambda run: current.update(data=prescription_data[run % max(len(prescription_data) - 1, 1)]))
+                    results['generate_prescription_pdf_cached'] = time_calls(
+                        lambda: window.generate_prescription_pdf(prescription_data[0], pdf_path), repeat)
+        finally:
+            window.close()
+            window.conn.close()
+    finally:
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    return {
+        'parameters': {'patients': patients, 'prescriptions': prescriptions, 'drugs': drugs,
+                       'images': images, 'repeat': repeat, 'seed': seed},
+        'environment': {'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                        'python': platform.python_version(), 'qt': QT_VERSION_STR,
+                        'sqlite': sqlite3.sqlite_version, 'platform': platform.platform(),
+                        'qt_platform': app.platformName()},
+        'generate_seconds': round(generate_seconds, 3),
+        'results': results,
+    }
+
+def compare_benchmarks(current, baseline):
+    """Lines comparing median times with an earlier run's results"""
+    lines = []
+    if current['parameters'] != baseline.get('parameters'):
+        lines.append("Note: the baseline was run with different parameters")
+    for name, result in current['results'].items():
+        before = baseline.get('results', {}).get(name)
+        if 'error' in result:
+            lines.append(f"{name}: failed ({result['error']})")
+            continue
+        if not before or 'error' in before:
+            lines.append(f"{name}: {result['median_ms']:.1f} ms (new)")
+            continue
+        change = (result['median_ms'] / before['median_ms'] - 1) * 100 if before['median_ms'] else 0
+        flag = "  SLOWER" if change > BENCHMARK_REGRESSION_PERCENT else ""
+        lines.append(f"{name}: {before['median_ms']:.1f} ms -> {result['median_ms']:.1f} ms ({change:+.0f}%){flag}")
+    return lines
 
 class MedicalPrescriptionSystemPyQt(QMainWindow):
-    def __init__(self):
+    def __init__(self, api=None):
         super().__init__()
+        self.api = api  # ClinicApiClient when running as a thin client of a LAN server
         self.setWindowTitle("Medical Prescription System - PyQt5")
         self.setGeometry(100, 50, 1400, 900)
         
@@ -89,12 +4339,21 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         self.load_drug_database()
         self.load_investigation_database()
         self.load_advice_database()
+        self.load_interaction_database()
+        self.load_dosing_rules()
+        self.load_maintenance_settings()
         
         # Current data
         self.current_patient = None
         self.current_prescription = None
         self.patient_images = []
         self.editing_patient_id = None  # Track which patient is being edited
+        self.blocked_generics_cache = {}  # str(reg_no) -> {ingredient: allergy}, cleared on patient updates
+        self.prescription_shell_cache = {}  # Rendered HTML shells keyed by doctor info
+        self.font_subset_cache = FontSubsetCache()
+        self.font_face_css_cache = {}  # @font-face rules keyed by used Bangla codepoints
+        self.pdf_render_cache = PdfRenderCache()
+        self.file_cleanup = ThreadPoolExecutor(max_workers=1)  # removes deleted patients' image files
         
         # Setup UI
         self.setup_ui()
@@ -102,77 +4361,47 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         # Load initial data after UI is created
         self.refresh_patient_list()
         
+        # Today's visit queue
+        self.setup_visit_queue()
+        
+        # Live updates from other workstations in client mode
+        self.setup_change_feed()
+        
+        # Background printing
+        self.setup_print_queue()
+        
+        # Scheduled backups
+        self.setup_backup_schedule()
+        
+        # Draft autosave
+        self.setup_draft_autosave()
+        
     def setup_databases(self):
         """Initialize SQLite databases"""
+        if self.api:
+            # A thin client keeps no database of its own; the server owns all clinic data
+            self.conn = self.cursor = None
+            return
         self.conn = sqlite3.connect('medical_prescription.db')
         self.cursor = self.conn.cursor()
-        
-        # Doctor information table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS doctors (
-                id INTEGER PRIMARY KEY,
-                name TEXT,
-                degrees TEXT,
-                designation TEXT,
-                institution TEXT,
-                bmdc_reg_no TEXT,
-                phone TEXT,
-                email TEXT,
-                address TEXT
-            )
-        ''')
-        
-        # Patients table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                reg_no INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT,
-                age INTEGER,
-                gender TEXT,
-                weight REAL,
-                phone TEXT,
-                address TEXT,
-                created_date TEXT
-            )
-        ''')
-        
-        # Prescriptions table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS prescriptions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_reg_no INTEGER,
-                date TEXT,
-                cc TEXT,
-                diagnosis TEXT,
-                vitals TEXT,
-                systemic_exam TEXT,
-                investigations TEXT,
-                drugs TEXT,
-                advice TEXT,
-                follow_up TEXT,
-                doctor_info TEXT,
-                FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
-            )
-        ''')
-        
-        # Patient images table
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS patient_images (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_reg_no INTEGER,
-                image_path TEXT,
-                description TEXT,
-                date TEXT,
-                FOREIGN KEY (patient_reg_no) REFERENCES patients (reg_no)
-            )
-        ''')
-        
-        self.conn.commit()
+        initialize_database_schema(self.conn)
         
     def load_doctor_info(self):
         """Load doctor information"""
-        self.cursor.execute("SELECT * FROM doctors LIMIT 1")
-        result = self.cursor.fetchone()
+        result = None
+        if self.api:
+            # Each workstation's doctor is kept beside the program, as there is no local database
+            try:
+                with open('doctor_info.json', 'r', encoding='utf-8') as f:
+                    self.doctor_info = json.load(f)
+                return
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error loading doctor info: {e}")
+        else:
+            self.cursor.execute("SELECT * FROM doctors LIMIT 1")
+            result = self.cursor.fetchone()
         
         if result:
             self.doctor_info = {
@@ -222,6 +4451,14 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.drugs_db = sample_drugs
         
+        if self.api:
+            catalog = self.api.get_catalog('drugs')
+            if catalog is None:
+                self.save_drug_database()
+            else:
+                self.drugs_db = catalog
+            return
+        
         # Try to load from file if exists
         try:
             with open('drug_database.json', 'r', encoding='utf-8') as f:
@@ -233,7 +4470,12 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     
     def save_drug_database(self):
         """Save drug database to file"""
+        self.interaction_checker = None
+        self.dosing_lookup = None
         try:
+            if self.api:
+                self.api.put_catalog('drugs', self.drugs_db)
+                return
             with open('drug_database.json', 'w', encoding='utf-8') as f:
                 json.dump(self.drugs_db, f, ensure_ascii=False, indent=2)
         except Exception as e:
@@ -256,6 +4498,14 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.investigations_db = sample_investigations
         
+        if self.api:
+            catalog = self.api.get_catalog('investigations')
+            if catalog is None:
+                self.save_investigation_database()
+            else:
+                self.investigations_db = catalog
+            return
+        
         try:
             with open('investigation_database.json', 'r', encoding='utf-8') as f:
                 self.investigations_db = json.load(f)
@@ -267,6 +4517,9 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     def save_investigation_database(self):
         """Save investigation database to file"""
         try:
+            if self.api:
+                self.api.put_catalog('investigations', self.investigations_db)
+                return
             with open('investigation_database.json', 'w', encoding='utf-8') as f:
                 json.dump(self.investigations_db, f, ensure_ascii=False, indent=2)
         except Exception as e:
@@ -301,6 +4554,14 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             "মাস্ক ব্যবহার করুন"
         ]
         
+        if self.api:
+            catalog = self.api.get_catalog('advice')
+            if catalog is None:
+                self.save_advice_database()
+            else:
+                self.advice_db = catalog
+            return
+        
         try:
             with open('advice_database.json', 'r', encoding='utf-8') as f:
                 self.advice_db = json.load(f)
@@ -312,10 +4573,169 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     def save_advice_database(self):
         """Save advice database to file"""
         try:
+            if self.api:
+                self.api.put_catalog('advice', self.advice_db)
+                return
             with open('advice_database.json', 'w', encoding='utf-8') as f:
                 json.dump(self.advice_db, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"Error saving advice database: {e}")
+    
+    def load_json_catalog(self, name, sample):
+        """Load a list catalog from the server or its JSON file, creating it from sample if missing"""
+        if self.api:
+            catalog = self.api.get_catalog(name)
+            if catalog is None:
+                self.api.put_catalog(name, sample)
+                return sample
+            return catalog
+        
+        try:
+            with open(CATALOG_FILES[name], 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            with open(CATALOG_FILES[name], 'w', encoding='utf-8') as f:
+                json.dump(sample, f, ensure_ascii=False, indent=2)
+            return sample
+        except Exception as e:
+            print(f"Error loading {CATALOG_FILES[name]}: {e}")
+            return sample
+    
+    def load_interaction_database(self):
+        """Load drug classes and known interactions for the prescribing checks"""
+        sample_classes = [
+            {"class": "NSAID", "generics": ["Diclofenac", "Ibuprofen", "Naproxen", "Aceclofenac", "Ketorolac",
+                                            "Etoricoxib", "Aspirin"]},
+            {"class": "PPI", "generics": ["Omeprazole", "Esomeprazole", "Pantoprazole", "Rabeprazole", "Lansoprazole"]},
+            {"class": "Macrolide", "generics": ["Azithromycin", "Clarithromycin", "Erythromycin"]},
+            {"class": "Penicillin", "generics": ["Amoxicillin", "Flucloxacillin", "Phenoxymethylpenicillin",
+                                                 "Ampicillin"]},
+            {"class": "Cephalosporin", "generics": ["Cefixime", "Cefuroxime", "Ceftriaxone", "Cephradine"]},
+            {"class": "Fluoroquinolone", "generics": ["Ciprofloxacin", "Levofloxacin", "Moxifloxacin"]},
+            {"class": "Sulfonamide", "generics": ["Sulfamethoxazole", "Sulfasalazine"]},
+            {"class": "Antihistamine", "generics": ["Fexofenadine", "Cetirizine", "Loratadine", "Desloratadine",
+                                                    "Chlorpheniramine"]},
+            {"class": "Statin", "generics": ["Atorvastatin", "Rosuvastatin", "Simvastatin"]}
+        ]
+        sample_interactions = [
+            {"a": "Warfarin", "b": "NSAID", "severity": "Major", "effect": "Higher bleeding risk"},
+            {"a": "Warfarin", "b": "Metronidazole", "severity": "Major", "effect": "Raises INR, bleeding risk"},
+            {"a": "Warfarin", "b": "Macrolide", "severity": "Moderate", "effect": "May raise INR"},
+            {"a": "Clopidogrel", "b": "Omeprazole", "severity": "Moderate", "effect": "Weaker antiplatelet effect"},
+            {"a": "Clopidogrel", "b": "Esomeprazole", "severity": "Moderate", "effect": "Weaker antiplatelet effect"},
+            {"a": "Simvastatin", "b": "Clarithromycin", "severity": "Major", "effect": "Myopathy / rhabdomyolysis"},
+            {"a": "Simvastatin", "b": "Amlodipine", "severity": "Moderate", "effect": "Keep simvastatin at 20 mg or less"},
+            {"a": "Domperidone", "b": "Macrolide", "severity": "Major", "effect": "QT prolongation"},
+            {"a": "Domperidone", "b": "Fluconazole", "severity": "Major", "effect": "QT prolongation"},
+            {"a": "Fluoroquinolone", "b": "Macrolide", "severity": "Moderate", "effect": "QT prolongation"},
+            {"a": "Ciprofloxacin", "b": "Theophylline", "severity": "Major", "effect": "Theophylline toxicity"},
+            {"a": "Allopurinol", "b": "Azathioprine", "severity": "Major", "effect": "Bone marrow suppression"},
+            {"a": "Methotrexate", "b": "NSAID", "severity": "Major", "effect": "Methotrexate toxicity"},
+            {"a": "Spironolactone", "b": "Enalapril", "severity": "Major", "effect": "Hyperkalaemia"},
+            {"a": "Spironolactone", "b": "Losartan", "severity": "Major", "effect": "Hyperkalaemia"}
+        ]
+        self.drug_classes_db = self.load_json_catalog('drug_classes', sample_classes)
+        self.interactions_db = self.load_json_catalog('interactions', sample_interactions)
+        self.interaction_checker = None
+    
+    def get_interaction_checker(self):
+        """Checker for the current catalogs, rebuilt after the drug database changes"""
+        if self.interaction_checker is None:
+            self.interaction_checker = InteractionChecker(self.drugs_db, self.drug_classes_db, self.interactions_db)
+        return self.interaction_checker
+    
+    def load_dosing_rules(self):
+        """Load the weight-based dosing rules used for children"""
+        sample_rules = [
+            {"generic": "Paracetamol", "mg_per_kg": 15, "max_dose_mg": 1000, "frequency": "1+1+1+1", "max_age": 12},
+            {"generic": "Ibuprofen", "mg_per_kg": 10, "max_dose_mg": 400, "frequency": "1+1+1", "max_age": 12},
+            {"generic": "Amoxicillin", "mg_per_kg": 15, "max_dose_mg": 500, "frequency": "1+1+1", "max_age": 12},
+            {"generic": "Azithromycin", "mg_per_kg": 10, "max_dose_mg": 500, "frequency": "1+0+0", "max_age": 12},
+            {"generic": "Cefixime", "mg_per_kg": 4, "max_dose_mg": 200, "frequency": "1+0+1", "max_age": 12},
+            {"generic": "Metronidazole", "mg_per_kg": 7.5, "max_dose_mg": 400, "frequency": "1+1+1", "max_age": 12},
+            {"generic": "Domperidone", "mg_per_kg": 0.25, "max_dose_mg": 10, "frequency": "1+1+1", "max_age": 12},
+            {"generic": "Ondansetron", "mg_per_kg": 0.15, "max_dose_mg": 4, "frequency": "1+0+1", "max_age": 12},
+            {"generic": "Salbutamol", "mg_per_kg": 0.1, "max_dose_mg": 4, "frequency": "1+1+1", "max_age": 12}
+        ]
+        self.dosing_rules_db = self.load_json_catalog('dosing_rules', sample_rules)
+        self.dosing_lookup = None
+    
+    def get_dosing_lookup(self):
+        """Formulation -> dosing rule lookup, rebuilt after the drug database changes"""
+        if self.dosing_lookup is None:
+            self.dosing_lookup = compile_dosing_lookup(self.drugs_db, self.dosing_rules_db)
+        return self.dosing_lookup
+    
+    def prefill_weight_based_dose(self, formulation):
+        """Fill the dose box for a child when the chosen drug has a weight-based rule"""
+        if not self.current_patient:
+            return
+        entry = self.get_dosing_lookup().get(formulation.strip().casefold())
+        if entry is None:
+            return
+        
+        age = re.match(r'\s*(\d+(?:\.\d+)?)', str(self.current_patient.get('age') or ''))
+        if not age or float(age.group(1)) >= entry[0].get('max_age', 12):
+            return
+        # Today's measured weight wins over the weight recorded at registration
+        weight = 0.0
+        for text in (self.weight_entry.text(), self.current_patient.get('weight')):
+            try:
+                weight = float(str(text).strip())
+            except ValueError:
+                continue
+            if weight > 0:
+                break
+        if weight <= 0:
+            return
+        
+        dose = weight_based_dose(entry, weight)
+        rule_text = (f"{weight:g} kg at {entry[0]['mg_per_kg']:g} mg/kg"
+                     + (f", max {entry[0]['max_dose_mg']:g} mg" if entry[0].get('max_dose_mg') else ""))
+        if dose:
+            self.dosage_combo.setCurrentText(dose)
+            self.status_bar.setText(f"Dose for {rule_text}")
+            return
+        
+        # This product cannot measure the dose: leave the box for a typed dose and point to a liquid that can
+        self.dosage_combo.setCurrentText("")
+        for drug in self.drugs_db:
+            liquid = self.get_dosing_lookup().get(drug.get('formulation', '').strip().casefold())
+            if liquid is not None and liquid[0] is entry[0] and liquid[2]:
+                liquid_dose = weight_based_dose(liquid, weight)
+                if liquid_dose:
+                    self.status_bar.setText(f"{formulation} cannot give the dose for {rule_text}; "
+                                            f"consider {drug['formulation']} {liquid_dose}")
+                    return
+        self.status_bar.setText(f"{formulation} cannot give the dose for {rule_text}; type the dose")
+    
+    def fetch_patient_allergies(self, reg_no):
+        """A patient's (allergen, reaction) pairs"""
+        if self.api:
+            return self.api.patient_allergies(reg_no)
+        return query_patient_allergies(self.cursor, reg_no)
+    
+    def patient_blocked_generics(self, reg_no):
+        """Ingredients the patient must not get, mapped to the allergy; cached until the patient is updated"""
+        blocked = self.blocked_generics_cache.get(str(reg_no))
+        if blocked is None:
+            blocked = self.get_interaction_checker().blocked_generics(self.fetch_patient_allergies(reg_no))
+            self.blocked_generics_cache[str(reg_no)] = blocked
+        return blocked
+    
+    def check_drug_safety(self, formulation):
+        """(allergy conflicts, duplicate and interaction warnings) for adding formulation to the prescription"""
+        checker = self.get_interaction_checker()
+        allergies = []
+        if self.current_patient:
+            blocked = self.patient_blocked_generics(self.current_patient['reg_no'])
+            for ingredient, allergy in checker.allergy_matches(formulation, blocked):
+                allergies.append(f"ALLERGY: {formulation} contains {checker.label(ingredient)} - "
+                                 f"patient is allergic to {allergy}")
+        
+        prescribed = [self.drugs_table.item(row, 0).text() for row in range(self.drugs_table.rowCount())
+                      if self.drugs_table.item(row, 0)]
+        return allergies, checker.check(formulation, prescribed)
 
     def setup_ui(self):
         """Setup the main user interface with proper scrollbars"""
@@ -359,6 +4779,8 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         self.create_history_tab()
         self.create_images_tab()
         self.create_drug_database_tab()  # New tab for drug database
+        self.create_maintenance_tab()
+        self.create_analytics_tab()
         
         # Status bar
         self.status_bar = QLabel("Ready")
@@ -512,8 +4934,13 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         delete_patient_btn.clicked.connect(self.delete_selected_patient)
         delete_patient_btn.setStyleSheet("QPushButton { background-color: #f44336; color: white; }")
         
+        queue_patient_btn = QPushButton("Add to Today's Queue")
+        queue_patient_btn.clicked.connect(self.enqueue_selected_patient)
+        queue_patient_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; }")
+        
         patient_actions_layout.addWidget(edit_patient_btn)
         patient_actions_layout.addWidget(delete_patient_btn)
+        patient_actions_layout.addWidget(queue_patient_btn)
         patient_actions_layout.addStretch()
         scroll_layout.addLayout(patient_actions_layout)
         
@@ -533,6 +4960,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         fields_right = [
             ("Weight (kg):", "weight", QDoubleSpinBox(), 0, 2),
             ("Phone:", "phone", QLineEdit(), 1, 2),
+            ("Allergies:", "allergies", QLineEdit(), 2, 2),
         ]
         
         # Left column fields
@@ -573,6 +5001,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         self.patient_address.setMaximumHeight(60)
         form_layout.addWidget(self.patient_address, 3, 1, 1, 3)
         self.patient_entries['address'] = self.patient_address
+        self.patient_entries['allergies'].setPlaceholderText("e.g. Penicillin (rash), NSAID")
         
         # Buttons
         button_layout = QHBoxLayout()
@@ -627,8 +5056,11 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     def load_patient_for_editing(self, reg_no):
         """Load patient data into form for editing"""
         try:
-            self.cursor.execute("SELECT * FROM patients WHERE reg_no=?", (reg_no,))
-            patient = self.cursor.fetchone()
+            if self.api:
+                patient = self.api.get_patient(reg_no)
+            else:
+                self.cursor.execute("SELECT * FROM patients WHERE reg_no=?", (reg_no,))
+                patient = self.cursor.fetchone()
             
             if patient:
                 # Store the patient ID being edited
@@ -646,6 +5078,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 self.patient_entries['weight'].setValue(patient[4])
                 self.patient_entries['phone'].setText(patient[5])
                 self.patient_entries['address'].setPlainText(patient[6])
+                self.patient_entries['allergies'].setText(format_allergies(self.fetch_patient_allergies(reg_no)))
                 
                 # Switch to edit mode
                 self.set_edit_mode(True)
@@ -699,18 +5132,24 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 return
             
             # Update patient in database
-            self.cursor.execute('''
-                UPDATE patients 
-                SET name=?, age=?, gender=?, weight=?, phone=?, address=?
-                WHERE reg_no=?
-            ''', (
-                patient_data['name'], patient_data['age'], patient_data['gender'],
-                patient_data['weight'], patient_data['phone'], patient_data['address'],
-                self.editing_patient_id
-            ))
-            
-            self.conn.commit()
-            self.refresh_patient_list()
+            if self.api:
+                self.api.update_patient(self.editing_patient_id, patient_data)
+            else:
+                self.cursor.execute('''
+                    UPDATE patients 
+                    SET name=?, age=?, gender=?, weight=?, phone=?, address=?
+                    WHERE reg_no=?
+                ''', (
+                    patient_data['name'], patient_data['age'], patient_data['gender'],
+                    patient_data['weight'], patient_data['phone'], patient_data['address'],
+                    self.editing_patient_id
+                ))
+                replace_patient_allergies(self.conn, self.editing_patient_id, patient_data['allergies'])
+                
+                self.conn.commit()
+            self.blocked_generics_cache.pop(str(self.editing_patient_id), None)
+            if self.change_feed is None:
+                self.refresh_patient_list()
             self.clear_patient_form()
             self.set_edit_mode(False)
             
@@ -739,21 +5178,30 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         # Confirm deletion
         reply = QMessageBox.question(
-            self, 
-            "Confirm Deletion", 
-            f"Are you sure you want to delete patient:\n\n{name} (Reg: {reg_no})?\n\nThis action cannot be undone!",
+            self,
+            "Confirm Deletion",
+            f"Are you sure you want to delete patient:\n\n{name} (Reg: {reg_no})?\n\n"
+            f"All of the patient's prescriptions, images, vitals and queue entries are deleted too.\n\n"
+            f"This action cannot be undone!",
             QMessageBox.Yes | QMessageBox.No,
             QMessageBox.No
         )
         
         if reply == QMessageBox.Yes:
             try:
-                # Delete patient from database
-                self.cursor.execute("DELETE FROM patients WHERE reg_no=?", (reg_no,))
-                self.conn.commit()
+                # Delete patient and everything that belongs to them
+                if self.api:
+                    self.api.delete_patient(reg_no)
+                else:
+                    image_paths = delete_patient_cascade(self.conn, reg_no) or []
+                    reclaim_free_pages(self.conn)
+                    self.file_cleanup.submit(remove_files, image_paths)
+                self.vitals_series_cache.pop(int(reg_no), None)
+                self.blocked_generics_cache.pop(str(reg_no), None)
                 
-                # Refresh patient list
-                self.refresh_patient_list()
+                # Refresh patient list (in client mode the change feed removes the row)
+                if self.change_feed is None:
+                    self.refresh_patient_list()
                 QMessageBox.information(self, "Success", "Patient deleted successfully!")
                 
             except Exception as e:
@@ -770,6 +5218,20 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         self.patient_info_display.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.patient_info_display)
         
+        # Today's queue
+        queue_layout = QHBoxLayout()
+        self.queue_list = QListWidget()
+        self.queue_list.setFlow(QListWidget.LeftToRight)
+        self.queue_list.setMaximumHeight(45)
+        self.queue_list.itemDoubleClicked.connect(self.open_queued_patient)
+        queue_layout.addWidget(self.queue_list)
+        next_patient_btn = QPushButton("Next Patient (F2)")
+        next_patient_btn.clicked.connect(self.open_next_patient)
+        next_patient_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; font-weight: bold; padding: 8px; }")
+        queue_layout.addWidget(next_patient_btn)
+        layout.addLayout(queue_layout)
+        QShortcut(QKeySequence(Qt.Key_F2), self, self.open_next_patient)
+        
         # Scroll area for prescription form
         scroll_area = QScrollArea()
         scroll_area.setWidgetResizable(True)
@@ -857,6 +5319,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.investigation_list = QListWidget()
         self.investigation_list.addItems(self.investigations_db)
+        self.investigation_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.investigation_list.setMaximumHeight(100)
         
         investigation_buttons_layout = QVBoxLayout()
@@ -931,6 +5394,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             "১+১+১+১", "০+০+০+১", "প্রয়োজনমত", "খাওয়ার পর"
         ])
         self.dosage_combo.setCurrentText("1+1+1")  # Default value
+        self.drug_combo.currentTextChanged.connect(self.prefill_weight_based_dose)
         dose_frequency_layout.addWidget(self.dosage_combo)
         
         drug_details_layout.addLayout(dose_frequency_layout, 0, 1)
@@ -1002,6 +5466,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.advice_list = QListWidget()
         self.advice_list.addItems(self.advice_db)
+        self.advice_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.advice_list.setMaximumHeight(100)
         
         advice_buttons_layout = QVBoxLayout()
@@ -1042,9 +5507,31 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         follow_up_layout.addStretch()
         right_column.addWidget(follow_up_group)
         
+        # Preview column
+        preview_column = QVBoxLayout()
+        
+        self.preview_group = QGroupBox("Live Preview")
+        preview_layout = QVBoxLayout(self.preview_group)
+        
+        self.preview_status = QLabel("Preview will appear when the form is filled in")
+        self.preview_status.setStyleSheet("color: #666666; font-style: italic;")
+        preview_layout.addWidget(self.preview_status)
+        
+        self.preview_scroll = QScrollArea()
+        self.preview_scroll.setWidgetResizable(True)
+        self.preview_scroll.setMinimumWidth(520)
+        self.preview_pages_widget = QWidget()
+        self.preview_pages_layout = QVBoxLayout(self.preview_pages_widget)
+        self.preview_pages_layout.addStretch()
+        self.preview_scroll.setWidget(self.preview_pages_widget)
+        preview_layout.addWidget(self.preview_scroll)
+        
+        preview_column.addWidget(self.preview_group)
+        
         # Add columns to main content
         main_content.addLayout(left_column)
         main_content.addLayout(right_column)
+        main_content.addLayout(preview_column)
         scroll_layout.addLayout(main_content)
         
         # Action buttons
@@ -1063,6 +5550,11 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         button_layout.addWidget(generate_pdf_btn)
         button_layout.addWidget(print_prescription_btn)
         button_layout.addWidget(clear_prescription_btn)
+        
+        self.live_preview_check = QCheckBox("Live Preview")
+        self.live_preview_check.setChecked(True)
+        self.live_preview_check.toggled.connect(self.toggle_live_preview)
+        button_layout.addWidget(self.live_preview_check)
         button_layout.addStretch()
         
         scroll_layout.addLayout(button_layout)
@@ -1071,6 +5563,8 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         layout.addWidget(scroll_area)
         
         self.tab_widget.addTab(prescription_tab, "Prescription")
+        
+        self.setup_live_preview()
     
     def create_drug_database_tab(self):
         """Create a tab for adding new drugs to the database"""
@@ -1143,6 +5637,225 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.tab_widget.addTab(drug_db_tab, "Drug Database")
     
+    def create_maintenance_tab(self):
+        """Create maintenance tab with backup controls"""
+        maintenance_tab = QWidget()
+        layout = QVBoxLayout(maintenance_tab)
+        
+        # Scroll area for maintenance tab
+        scroll_area = QScrollArea()
+        scroll_area.setWidgetResizable(True)
+        scroll_area.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        
+        scroll_widget = QWidget()
+        self.maintenance_layout = QVBoxLayout(scroll_widget)
+        
+        # Backup section
+        backup_group = QGroupBox("Backup")
+        backup_layout = QVBoxLayout(backup_group)
+        
+        backup_form = QFormLayout()
+        self.backup_dir_label = QLabel()
+        backup_form.addRow("Backup folder:", self.backup_dir_label)
+        
+        self.backup_hour_spin = QSpinBox()
+        self.backup_hour_spin.setRange(0, 23)
+        self.backup_hour_spin.setSuffix(":00")
+        backup_form.addRow("Nightly backup after:", self.backup_hour_spin)
+        
+        self.backup_keep_spin = QSpinBox()
+        self.backup_keep_spin.setRange(1, 365)
+        backup_form.addRow("Snapshots to keep:", self.backup_keep_spin)
+        
+        self.last_backup_label = QLabel()
+        backup_form.addRow("Last backup:", self.last_backup_label)
+        backup_layout.addLayout(backup_form)
+        
+        self.backup_progress = QProgressBar()
+        self.backup_progress.setRange(0, 100)
+        self.backup_progress.setValue(0)
+        backup_layout.addWidget(self.backup_progress)
+        
+        self.backup_status_label = QLabel("")
+        self.backup_status_label.setWordWrap(True)
+        backup_layout.addWidget(self.backup_status_label)
+        
+        backup_buttons_layout = QHBoxLayout()
+        change_backup_dir_btn = QPushButton("Change Folder")
+        change_backup_dir_btn.clicked.connect(self.change_backup_dir)
+        self.backup_now_btn = QPushButton("Backup Now")
+        self.backup_now_btn.clicked.connect(self.start_backup)
+        self.backup_now_btn.setStyleSheet("QPushButton { background-color: #4CAF50; color: white; font-weight: bold; padding: 10px; }")
+        backup_buttons_layout.addWidget(change_backup_dir_btn)
+        backup_buttons_layout.addWidget(self.backup_now_btn)
+        backup_buttons_layout.addStretch()
+        backup_layout.addLayout(backup_buttons_layout)
+        
+        self.maintenance_layout.addWidget(backup_group)
+        
+        # Archive section
+        archive_group = QGroupBox("Archive Old Prescriptions")
+        archive_layout = QVBoxLayout(archive_group)
+        
+        archive_form = QFormLayout()
+        self.archive_age_spin = QSpinBox()
+        self.archive_age_spin.setRange(30, 36500)
+        self.archive_age_spin.setSuffix(" days")
+        archive_form.addRow("Archive prescriptions older than:", self.archive_age_spin)
+        archive_layout.addLayout(archive_form)
+        
+        self.archive_progress = QProgressBar()
+        self.archive_progress.setRange(0, 100)
+        self.archive_progress.setValue(0)
+        archive_layout.addWidget(self.archive_progress)
+        
+        self.archive_status_label = QLabel("Archived prescriptions stay visible in patient history.")
+        self.archive_status_label.setWordWrap(True)
+        archive_layout.addWidget(self.archive_status_label)
+        
+        archive_buttons_layout = QHBoxLayout()
+        self.archive_now_btn = QPushButton("Archive Now")
+        self.archive_now_btn.clicked.connect(self.start_archive)
+        archive_buttons_layout.addWidget(self.archive_now_btn)
+        archive_buttons_layout.addStretch()
+        archive_layout.addLayout(archive_buttons_layout)
+        
+        self.maintenance_layout.addWidget(archive_group)
+        
+        # Orphan cleanup section
+        orphan_group = QGroupBox("Orphaned Data")
+        orphan_layout = QVBoxLayout(orphan_group)
+        self.orphan_status_label = QLabel("Finds prescriptions, images and other records left behind by deleted patients.")
+        self.orphan_status_label.setWordWrap(True)
+        orphan_layout.addWidget(self.orphan_status_label)
+        
+        orphan_buttons_layout = QHBoxLayout()
+        self.orphan_scan_btn = QPushButton("Scan and Clean Up")
+        self.orphan_scan_btn.clicked.connect(self.clean_up_orphans)
+        orphan_buttons_layout.addWidget(self.orphan_scan_btn)
+        orphan_buttons_layout.addStretch()
+        orphan_layout.addLayout(orphan_buttons_layout)
+        
+        self.maintenance_layout.addWidget(orphan_group)
+        
+        # Database health section
+        health_group = QGroupBox("DB Health")
+        health_layout = QVBoxLayout(health_group)
+        
+        health_form = QFormLayout()
+        self.maintenance_hour_spin = QSpinBox()
+        self.maintenance_hour_spin.setRange(0, 23)
+        self.maintenance_hour_spin.setSuffix(":00")
+        health_form.addRow("Nightly maintenance after:", self.maintenance_hour_spin)
+        self.last_maintenance_label = QLabel()
+        health_form.addRow("Last maintenance:", self.last_maintenance_label)
+        health_layout.addLayout(health_form)
+        
+        self.db_health_label = QLabel()
+        self.db_health_label.setWordWrap(True)
+        health_layout.addWidget(self.db_health_label)
+        
+        self.db_index_table = QTableWidget()
+        self.db_index_table.setColumnCount(5)
+        self.db_index_table.setHorizontalHeaderLabels(["Index", "Table", "Rows", "Rows per Key", "Used By"])
+        self.db_index_table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.db_index_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.db_index_table.setMinimumHeight(200)
+        health_layout.addWidget(self.db_index_table)
+        
+        self.db_scans_label = QLabel()
+        self.db_scans_label.setWordWrap(True)
+        health_layout.addWidget(self.db_scans_label)
+        
+        self.maintenance_progress = QProgressBar()
+        self.maintenance_progress.setRange(0, 100)
+        self.maintenance_progress.setValue(0)
+        health_layout.addWidget(self.maintenance_progress)
+        
+        self.maintenance_status_label = QLabel("Integrity check, ANALYZE, PRAGMA optimize and VACUUM run at night.")
+        self.maintenance_status_label.setWordWrap(True)
+        health_layout.addWidget(self.maintenance_status_label)
+        
+        health_buttons_layout = QHBoxLayout()
+        refresh_health_btn = QPushButton("Refresh")
+        refresh_health_btn.clicked.connect(self.refresh_db_health)
+        self.maintenance_now_btn = QPushButton("Run Maintenance Now")
+        self.maintenance_now_btn.clicked.connect(self.run_maintenance_now)
+        health_buttons_layout.addWidget(refresh_health_btn)
+        health_buttons_layout.addWidget(self.maintenance_now_btn)
+        health_buttons_layout.addStretch()
+        health_layout.addLayout(health_buttons_layout)
+        
+        self.maintenance_layout.addWidget(health_group)
+        self.maintenance_layout.addStretch()
+        
+        scroll_area.setWidget(scroll_widget)
+        layout.addWidget(scroll_area)
+        
+        self.tab_widget.addTab(maintenance_tab, "Maintenance")
+    
+    def create_analytics_tab(self):
+        """Create analytics tab with visit chart and top diagnoses/drugs"""
+        analytics_tab = QWidget()
+        layout = QVBoxLayout(analytics_tab)
+        
+        controls_layout = QHBoxLayout()
+        controls_layout.addWidget(QLabel("Period:"))
+        self.analytics_period_combo = QComboBox()
+        self.analytics_period_combo.addItems(list(ANALYTICS_PERIODS))
+        self.analytics_period_combo.currentIndexChanged.connect(self.run_analytics_report)
+        controls_layout.addWidget(self.analytics_period_combo)
+        
+        self.analytics_diagnosis_entry = QLineEdit()
+        self.analytics_diagnosis_entry.setPlaceholderText("Count a diagnosis (e.g. dengue)")
+        self.analytics_diagnosis_entry.returnPressed.connect(self.run_analytics_report)
+        controls_layout.addWidget(self.analytics_diagnosis_entry)
+        
+        run_report_btn = QPushButton("Run Report")
+        run_report_btn.clicked.connect(self.run_analytics_report)
+        export_csv_btn = QPushButton("Export CSV")
+        export_csv_btn.clicked.connect(self.export_analytics_csv)
+        rebuild_btn = QPushButton("Rebuild Statistics")
+        rebuild_btn.clicked.connect(self.rebuild_analytics)
+        mis_report_btn = QPushButton("MIS Report (CSV)")
+        mis_report_btn.clicked.connect(self.export_mis_report)
+        controls_layout.addWidget(run_report_btn)
+        controls_layout.addWidget(export_csv_btn)
+        controls_layout.addWidget(rebuild_btn)
+        controls_layout.addWidget(mis_report_btn)
+        layout.addLayout(controls_layout)
+        
+        self.analytics_summary_label = QLabel("Press Run Report to see clinic statistics.")
+        self.analytics_summary_label.setStyleSheet("font-weight: bold; padding: 5px;")
+        self.analytics_summary_label.setWordWrap(True)
+        layout.addWidget(self.analytics_summary_label)
+        
+        chart_group = QGroupBox("Prescriptions per Month")
+        chart_layout = QVBoxLayout(chart_group)
+        self.analytics_chart = BarChartWidget()
+        chart_layout.addWidget(self.analytics_chart)
+        layout.addWidget(chart_group)
+        
+        tables_layout = QHBoxLayout()
+        self.analytics_diagnosis_table = QTableWidget()
+        self.analytics_diagnosis_table.setColumnCount(2)
+        self.analytics_diagnosis_table.setHorizontalHeaderLabels(["Diagnosis", "Count"])
+        self.analytics_diagnosis_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.analytics_drug_table = QTableWidget()
+        self.analytics_drug_table.setColumnCount(2)
+        self.analytics_drug_table.setHorizontalHeaderLabels(["Drug", "Count"])
+        self.analytics_drug_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        for title, table in (("Top Diagnoses", self.analytics_diagnosis_table), ("Top Drugs", self.analytics_drug_table)):
+            group = QGroupBox(title)
+            group_layout = QVBoxLayout(group)
+            group_layout.addWidget(table)
+            tables_layout.addWidget(group)
+        layout.addLayout(tables_layout)
+        
+        self.analytics_report_data = None
+        self.tab_widget.addTab(analytics_tab, "Analytics")
+    
     def update_formulation_preview(self):
         """Update the formulation preview based on form inputs"""
         formulation = self.formulation_combo.currentText()
@@ -1236,6 +5949,11 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         scroll_layout.addLayout(patient_select_layout)
         
+        # Vitals trend chart
+        self.vitals_series_cache = OrderedDict()  # reg_no -> VitalsSeries, least recently used first
+        self.vitals_trend_chart = VitalsTrendWidget()
+        scroll_layout.addWidget(self.vitals_trend_chart)
+        
         # History display
         self.history_display = QTextBrowser()
         self.history_display.setMinimumHeight(400)
@@ -1270,22 +5988,74 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         scroll_layout.addLayout(patient_select_layout)
         
-        # Image upload section
-        upload_group = QGroupBox("Upload New Image")
+        # Image upload section (images and folders can also be dropped on it)
+        upload_group = ImageDropBox("Upload New Images (or drop images and folders here)")
+        upload_group.files_dropped.connect(self.upload_images)
         upload_layout = QVBoxLayout(upload_group)
         
         upload_controls_layout = QHBoxLayout()
-        self.upload_image_btn = QPushButton("Select Image")
+        self.upload_image_btn = QPushButton("Select Images")
         self.upload_image_btn.clicked.connect(self.select_image)
+        self.upload_folder_btn = QPushButton("Upload Folder")
+        self.upload_folder_btn.clicked.connect(self.select_image_folder)
         
         self.image_description = QLineEdit()
         self.image_description.setPlaceholderText("Image description...")
         
         upload_controls_layout.addWidget(self.upload_image_btn)
+        upload_controls_layout.addWidget(self.upload_folder_btn)
         upload_controls_layout.addWidget(self.image_description)
         upload_controls_layout.addStretch()
         
         upload_layout.addLayout(upload_controls_layout)
+        
+        # How uploads are stored
+        upload_options_layout = QHBoxLayout()
+        upload_options_layout.addWidget(QLabel("Save as:"))
+        self.image_format_combo = QComboBox()
+        writable = {bytes(name).decode('ascii') for name in QImageWriter.supportedImageFormats()}
+        for key, label, extension in IMAGE_UPLOAD_FORMATS:
+            if extension is None or key in writable:
+                self.image_format_combo.addItem(label, key)
+        upload_options_layout.addWidget(self.image_format_combo)
+        
+        upload_options_layout.addWidget(QLabel("Quality:"))
+        self.image_quality_spin = QSpinBox()
+        self.image_quality_spin.setRange(30, 100)
+        upload_options_layout.addWidget(self.image_quality_spin)
+        
+        upload_options_layout.addWidget(QLabel("Max size:"))
+        self.image_max_side_spin = QSpinBox()
+        self.image_max_side_spin.setRange(800, 20000)
+        self.image_max_side_spin.setSingleStep(200)
+        self.image_max_side_spin.setSuffix(" px")
+        upload_options_layout.addWidget(self.image_max_side_spin)
+        
+        self.keep_original_check = QCheckBox("Keep original")
+        upload_options_layout.addWidget(self.keep_original_check)
+        upload_options_layout.addStretch()
+        upload_layout.addLayout(upload_options_layout)
+        
+        self.image_upload_progress = QProgressBar()
+        self.image_upload_progress.setRange(0, 100)
+        self.image_upload_progress.setVisible(False)
+        upload_layout.addWidget(self.image_upload_progress)
+        
+        self.image_upload_status = QLabel("")
+        self.image_upload_status.setWordWrap(True)
+        upload_layout.addWidget(self.image_upload_status)
+        
+        format_index = self.image_format_combo.findData(self.maintenance_settings['image_format'])
+        self.image_format_combo.setCurrentIndex(max(format_index, 0))
+        self.image_quality_spin.setValue(self.maintenance_settings['image_quality'])
+        self.image_max_side_spin.setValue(self.maintenance_settings['image_max_side'])
+        self.keep_original_check.setChecked(self.maintenance_settings['keep_original_images'])
+        self.image_format_combo.currentIndexChanged.connect(self.on_image_upload_settings_changed)
+        self.image_quality_spin.valueChanged.connect(self.on_image_upload_settings_changed)
+        self.image_max_side_spin.valueChanged.connect(self.on_image_upload_settings_changed)
+        self.keep_original_check.toggled.connect(self.on_image_upload_settings_changed)
+        self.image_import_worker = None
+        
         scroll_layout.addWidget(upload_group)
         
         # Images display section
@@ -1319,13 +6089,16 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 self.images_layout.addWidget(no_patient_label)
                 return
             
-            self.cursor.execute('''
-                SELECT * FROM patient_images 
-                WHERE patient_reg_no = ? 
-                ORDER BY date DESC
-            ''', (patient_id,))
-            
-            images = self.cursor.fetchall()
+            if self.api:
+                images = self.api.list_images(patient_id)
+            else:
+                self.cursor.execute('''
+                    SELECT * FROM patient_images 
+                    WHERE patient_reg_no = ? 
+                    ORDER BY date DESC
+                ''', (patient_id,))
+                
+                images = self.cursor.fetchall()
             
             if not images:
                 no_images_label = QLabel("No images found for this patient.")
@@ -1340,9 +6113,12 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             
             images_widget = QWidget()
             images_grid = QVBoxLayout(images_widget)
+            gallery_paths = []  # shown images in order, for previous/next in the viewer
             
             for image in images:
                 image_id, patient_reg_no, image_path, description, date = image
+                if self.api:
+                    image_path = self.api.image_file(image_id, image_path)
                 
                 # Create image group with border
                 image_group = QGroupBox(f"Image - {datetime.strptime(date, '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %I:%M %p')}")
@@ -1354,15 +6130,17 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 image_display_layout = QHBoxLayout(image_display_widget)
                 
                 if os.path.exists(image_path):
-                    pixmap = QPixmap(image_path)
-                    if not pixmap.isNull():
+                    # Decode straight at thumbnail size rather than the full scan
+                    thumbnail = read_scaled_image(image_path, 400, 300)
+                    if not thumbnail.isNull():
                         # Scale image for display
-                        scaled_pixmap = pixmap.scaled(400, 300, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                        scaled_pixmap = QPixmap.fromImage(thumbnail).scaled(400, 300, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                        gallery_paths.append(image_path)
                         image_label = QLabel()
                         image_label.setPixmap(scaled_pixmap)
                         image_label.setStyleSheet("border: 1px solid #aaaaaa; padding: 5px;")
                         image_label.setCursor(Qt.PointingHandCursor)
-                        image_label.mousePressEvent = lambda event, path=image_path: self.view_image_fullscreen(path)
+                        image_label.mousePressEvent = lambda event, path=image_path: self.view_image_fullscreen(path, gallery_paths)
                         
                         # Add click message
                         click_label = QLabel("📸 Click image to view full screen")
@@ -1418,11 +6196,11 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load patient images: {str(e)}")
 
-    def view_image_fullscreen(self, image_path):
-        """Open image in full screen dialog"""
+    def view_image_fullscreen(self, image_path, image_paths=None):
+        """Open image in full screen dialog, stepping through image_paths with previous/next"""
         try:
             if os.path.exists(image_path):
-                fullscreen_dialog = FullScreenImageDialog(image_path, self)
+                fullscreen_dialog = FullScreenImageDialog(image_path, self, image_paths)
                 fullscreen_dialog.exec_()
             else:
                 QMessageBox.warning(self, "Warning", "Image file not found!")
@@ -1467,13 +6245,16 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     def save_image_description(self, image_id, new_description, dialog):
         """Save updated image description to database"""
         try:
-            self.cursor.execute('''
-                UPDATE patient_images 
-                SET description = ? 
-                WHERE id = ?
-            ''', (new_description.strip(), image_id))
-            
-            self.conn.commit()
+            if self.api:
+                self.api.update_image(image_id, new_description)
+            else:
+                self.cursor.execute('''
+                    UPDATE patient_images 
+                    SET description = ? 
+                    WHERE id = ?
+                ''', (new_description.strip(), image_id))
+                
+                self.conn.commit()
             dialog.accept()
             
             # Reload images to show updated description
@@ -1497,16 +6278,15 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             )
             
             if reply == QMessageBox.Yes:
-                # Delete from database
-                self.cursor.execute("DELETE FROM patient_images WHERE id = ?", (image_id,))
-                self.conn.commit()
+                # Delete from database (the server removes its own file)
+                if self.api:
+                    self.api.delete_image(image_id)
+                else:
+                    self.cursor.execute("DELETE FROM patient_images WHERE id = ?", (image_id,))
+                    self.conn.commit()
                 
-                # Delete physical file if it exists
-                try:
-                    if os.path.exists(image_path):
-                        os.remove(image_path)
-                except Exception as file_error:
-                    print(f"Warning: Could not delete image file: {file_error}")
+                # Delete physical file (and any kept original) if it exists
+                remove_files(with_original_images([image_path]))
                 
                 # Reload images
                 self.load_patient_images()
@@ -1528,6 +6308,13 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 else:
                     doctor_data[key] = entry.text().strip()
             
+            if self.api:
+                with open('doctor_info.json', 'w', encoding='utf-8') as f:
+                    json.dump(doctor_data, f, ensure_ascii=False, indent=2)
+                self.load_doctor_info()
+                QMessageBox.information(self, "Success", "Doctor information saved successfully!")
+                return
+            
             # Check if doctor record exists
             self.cursor.execute("SELECT COUNT(*) FROM doctors")
             count = self.cursor.fetchone()[0]
@@ -1566,8 +6353,11 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
     def refresh_patient_list(self):
         """Refresh patient list in tables and comboboxes"""
         try:
-            self.cursor.execute("SELECT reg_no, name, age, gender, phone, address FROM patients ORDER BY reg_no DESC")
-            patients = self.cursor.fetchall()
+            if self.api:
+                patients = self.api.list_patients()
+            else:
+                self.cursor.execute("SELECT reg_no, name, age, gender, phone, address FROM patients ORDER BY reg_no DESC")
+                patients = self.cursor.fetchall()
             
             # Update patient table
             self.patient_table.setRowCount(len(patients))
@@ -1598,14 +6388,17 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             return
         
         try:
-            self.cursor.execute('''
-                SELECT reg_no, name, age, gender, phone, address 
-                FROM patients 
-                WHERE name LIKE ? OR phone LIKE ? OR reg_no = ?
-                ORDER BY reg_no DESC
-            ''', (f'%{search_term}%', f'%{search_term}%', search_term))
-            
-            patients = self.cursor.fetchall()
+            if self.api:
+                patients = self.api.list_patients(search_term)
+            else:
+                self.cursor.execute('''
+                    SELECT reg_no, name, age, gender, phone, address 
+                    FROM patients 
+                    WHERE name LIKE ? OR phone LIKE ? OR reg_no = ?
+                    ORDER BY reg_no DESC
+                ''', (f'%{search_term}%', f'%{search_term}%', search_term))
+                
+                patients = self.cursor.fetchall()
             self.patient_table.setRowCount(len(patients))
             
             for row, patient in enumerate(patients):
@@ -1627,11 +6420,23 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         name = self.patient_table.item(row, 1).text()
         age = self.patient_table.item(row, 2).text()
         gender = self.patient_table.item(row, 3).text()
+        self.open_patient_for_prescription(reg_no, name, age, gender)
+    
+    def open_patient_for_prescription(self, reg_no, name, age, gender):
+        """Make a patient current and switch to the prescription tab"""
+        # Only a visit this window called is finished by saving or F2, never another doctor's
+        self.current_queue_id = self.called_visits.get(str(reg_no))
+        if not self.current_patient or str(self.current_patient.get('reg_no')) != str(reg_no):
+            self.start_prescription_draft()
         
         # FIXED: Get weight from database for the selected patient
         try:
-            self.cursor.execute("SELECT weight FROM patients WHERE reg_no=?", (reg_no,))
-            result = self.cursor.fetchone()
+            if self.api:
+                patient = self.api.get_patient(reg_no)
+                result = (patient[4],) if patient else None
+            else:
+                self.cursor.execute("SELECT weight FROM patients WHERE reg_no=?", (reg_no,))
+                result = self.cursor.fetchone()
             weight = str(result[0]) if result and result[0] else "0"
         except:
             weight = "0"
@@ -1645,10 +6450,18 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         }
         
         # Update patient info display - FIXED: Show actual weight
-        self.patient_info_display.setText(f"Patient: {name} (Reg: {reg_no}) | Age: {age} | Gender: {gender} | Weight: {weight}kg")
+        patient_text = f"Patient: {name} (Reg: {reg_no}) | Age: {age} | Gender: {gender} | Weight: {weight}kg"
+        try:
+            allergies = set(self.patient_blocked_generics(reg_no).values())
+            if allergies:
+                patient_text += f" | Allergies: {', '.join(sorted(allergies))}"
+        except Exception as e:
+            print(f"Error loading allergies: {e}")
+        self.patient_info_display.setText(patient_text)
         
         # Switch to prescription tab
         self.tab_widget.setCurrentIndex(2)
+        self.schedule_preview_render()
     
     def save_patient(self):
         """Save new patient to database"""
@@ -1671,17 +6484,23 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 return
             
             # Insert patient
-            self.cursor.execute('''
-                INSERT INTO patients (name, age, gender, weight, phone, address, created_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                patient_data['name'], patient_data['age'], patient_data['gender'],
-                patient_data['weight'], patient_data['phone'], patient_data['address'],
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            ))
-            
-            self.conn.commit()
-            self.refresh_patient_list()
+            created_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if self.api:
+                self.api.create_patient(dict(patient_data, created_date=created_date))
+            else:
+                self.cursor.execute('''
+                    INSERT INTO patients (name, age, gender, weight, phone, address, created_date)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    patient_data['name'], patient_data['age'], patient_data['gender'],
+                    patient_data['weight'], patient_data['phone'], patient_data['address'],
+                    created_date
+                ))
+                replace_patient_allergies(self.conn, self.cursor.lastrowid, patient_data['allergies'])
+                
+                self.conn.commit()
+            if self.change_feed is None:
+                self.refresh_patient_list()
             self.clear_patient_form()
             QMessageBox.information(self, "Success", "Patient saved successfully!")
             
@@ -1718,41 +6537,57 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         
         self.drug_combo.addItems(filtered_drugs)
     
+    def append_lines_to_text_edit(self, text_edit, lines):
+        """Append new lines to a text edit in one document edit, skipping duplicates"""
+        existing = set(line.strip() for line in text_edit.toPlainText().split('\n') if line.strip())
+        
+        new_lines = []
+        for line in lines:
+            line = line.strip()
+            if line and line not in existing:
+                existing.add(line)
+                new_lines.append(line)
+        
+        if not new_lines:
+            return 0
+        
+        text_edit.setUpdatesEnabled(False)
+        text_edit.blockSignals(True)
+        try:
+            cursor = text_edit.textCursor()
+            cursor.movePosition(QTextCursor.End)
+            block = '\n'.join(new_lines)
+            if not text_edit.document().isEmpty():
+                block = '\n' + block
+            cursor.insertText(block)
+        finally:
+            text_edit.blockSignals(False)
+            text_edit.setUpdatesEnabled(True)
+        
+        # Signals were blocked during the edit, so notify listeners once
+        text_edit.textChanged.emit()
+        return len(new_lines)
+    
     def add_selected_investigation(self):
-        """Add selected investigation from list"""
-        selected_items = self.investigation_list.selectedItems()
-        for item in selected_items:
-            investigation = item.text()
-            current_text = self.selected_investigations.toPlainText()
-            if current_text:
-                new_text = current_text + "\n" + investigation
-            else:
-                new_text = investigation
-            self.selected_investigations.setPlainText(new_text)
+        """Add all selected investigations from list"""
+        investigations = [item.text() for item in self.investigation_list.selectedItems()]
+        added = self.append_lines_to_text_edit(self.selected_investigations, investigations)
+        self.investigation_list.clearSelection()
+        self.status_bar.setText(f"Added {added} investigation(s)")
     
     def add_selected_advice(self):
-        """Add selected advice from list"""
-        selected_items = self.advice_list.selectedItems()
-        for item in selected_items:
-            advice = item.text()
-            current_text = self.advice_entry.toPlainText()
-            if current_text:
-                new_text = current_text + "\n" + advice
-            else:
-                new_text = advice
-            self.advice_entry.setPlainText(new_text)
+        """Add all selected advice from list"""
+        advice_items = [item.text() for item in self.advice_list.selectedItems()]
+        added = self.append_lines_to_text_edit(self.advice_entry, advice_items)
+        self.advice_list.clearSelection()
+        self.status_bar.setText(f"Added {added} advice item(s)")
     
     def add_custom_investigation(self):
         """Add custom investigation to database"""
         investigation = self.investigation_search.text().strip()
         if investigation:
             # Add to current text
-            current_text = self.selected_investigations.toPlainText()
-            if current_text:
-                new_text = current_text + "\n" + investigation
-            else:
-                new_text = investigation
-            self.selected_investigations.setPlainText(new_text)
+            self.append_lines_to_text_edit(self.selected_investigations, [investigation])
             
             # Add to database if not exists
             if investigation not in self.investigations_db:
@@ -1815,12 +6650,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         advice = self.advice_search.text().strip()
         if advice:
             # Add to current text
-            current_text = self.advice_entry.toPlainText()
-            if current_text:
-                new_text = current_text + "\n" + advice
-            else:
-                new_text = advice
-            self.advice_entry.setPlainText(new_text)
+            self.append_lines_to_text_edit(self.advice_entry, [advice])
             
             # Add to database if not exists
             if advice not in self.advice_db:
@@ -1849,14 +6679,33 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 QMessageBox.warning(self, "Warning", "Please enter dosage/frequency!")
                 return
             
+            allergies, warnings = self.check_drug_safety(drug_text)
+            if allergies:
+                # Not overridable here: a wrong allergy record must be corrected on the patient first
+                QMessageBox.critical(self, "Allergy",
+                                     "\n".join(allergies) + "\n\nThis drug cannot be added for this patient. "
+                                     "If the allergy record is wrong, correct it in the patient's details first.")
+                return
+            if warnings:
+                reply = QMessageBox.warning(
+                    self, "Prescription Check",
+                    "\n".join(warnings) + "\n\nAdd this drug anyway?",
+                    QMessageBox.Yes | QMessageBox.No,
+                    QMessageBox.No
+                )
+                if reply != QMessageBox.Yes:
+                    return
+            
             # Add to table
-            row = self.drugs_table.rowCount()
-            self.drugs_table.insertRow(row)
+            added = self.add_drugs_to_prescription([{
+                'formulation': drug_text,
+                'dosage': dosage,
+                'duration': duration,
+                'instructions': instructions
+            }])
             
-            self.drugs_table.setItem(row, 0, QTableWidgetItem(drug_text))
-            self.drugs_table.setItem(row, 1, QTableWidgetItem(dosage))
-            self.drugs_table.setItem(row, 2, QTableWidgetItem(duration))
-            self.drugs_table.setItem(row, 3, QTableWidgetItem(instructions))
+            if not added:
+                self.status_bar.setText(f"{drug_text} is already in the prescription")
             
             # Clear drug form (keep default values in combos)
             # The combos will keep their current selections for next drug
@@ -1864,6 +6713,41 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to add drug: {str(e)}")
     
+    def add_drugs_to_prescription(self, drugs):
+        """Insert several drugs into the prescription table in one batch, skipping duplicates"""
+        existing = set()
+        for row in range(self.drugs_table.rowCount()):
+            item = self.drugs_table.item(row, 0)
+            if item:
+                existing.add(item.text().strip().lower())
+        
+        new_drugs = []
+        for drug in drugs:
+            key = drug.get('formulation', '').strip().lower()
+            if key and key not in existing:
+                existing.add(key)
+                new_drugs.append(drug)
+        
+        if not new_drugs:
+            return 0
+        
+        self.drugs_table.setUpdatesEnabled(False)
+        self.drugs_table.blockSignals(True)
+        try:
+            first_row = self.drugs_table.rowCount()
+            self.drugs_table.setRowCount(first_row + len(new_drugs))
+            for offset, drug in enumerate(new_drugs):
+                row = first_row + offset
+                self.drugs_table.setItem(row, 0, QTableWidgetItem(drug.get('formulation', '')))
+                self.drugs_table.setItem(row, 1, QTableWidgetItem(drug.get('dosage', '')))
+                self.drugs_table.setItem(row, 2, QTableWidgetItem(drug.get('duration', '')))
+                self.drugs_table.setItem(row, 3, QTableWidgetItem(drug.get('instructions', '')))
+        finally:
+            self.drugs_table.blockSignals(False)
+            self.drugs_table.setUpdatesEnabled(True)
+        
+        return len(new_drugs)
+    
     def save_prescription(self):
         """Save prescription to database"""
         if not self.current_patient:
@@ -1901,11 +6785,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 drugs_data.append(drug)
             
             # Save to database
-            self.cursor.execute('''
-                INSERT INTO prescriptions 
-                (patient_reg_no, date, cc, diagnosis, vitals, systemic_exam, investigations, drugs, advice, follow_up, doctor_info)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            values = (
                 self.current_patient['reg_no'],
                 datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 self.cc_entry.toPlainText(),
@@ -1917,114 +6797,1096 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
                 self.advice_entry.toPlainText(),
                 self.follow_up_entry.text(),
                 json.dumps(self.doctor_info)
-            ))
-            
-            self.conn.commit()
+            )
+            if self.api:
+                self.api.create_prescription(dict(zip(PRESCRIPTION_COLUMNS, values)))
+            else:
+                insert_prescription(self.conn, dict(zip(PRESCRIPTION_COLUMNS, values)))
+                self.conn.commit()
+            self.append_cached_vitals(values[0], values[1], vitals_text)
+            self.finish_current_visit()
+            self.mark_prescription_draft_saved()
             QMessageBox.information(self, "Success", "Prescription saved successfully!")
             
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to save prescription: {str(e)}")
+            QMessageBox.critical(self, "Error", f"Failed to save prescription: {str(e)}")
+    
+    def generate_pdf(self):
+        """Generate PDF with file location prompt and option to open"""
+        if not self.current_patient:
+            QMessageBox.warning(self, "Warning", "Please select a patient first!")
+            return
+        
+        try:
+            # Ask for save location
+            file_path, _ = QFileDialog.getSaveFileName(
+                self, "Save PDF As", 
+                f"prescription_{self.current_patient['reg_no']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
+                "PDF Files (*.pdf)"
+            )
+            
+            if file_path:
+                # Get current prescription data from form
+                prescription_data = self.get_current_prescription_data()
+                
+                # Generate PDF
+                pdf_path = self.generate_prescription_pdf(prescription_data, file_path)
+                
+                if pdf_path and os.path.exists(pdf_path):
+                    cache_stats = self.pdf_render_cache.stats()
+                    self.status_bar.setText(f"PDF saved to {pdf_path} (render cache: {cache_stats['hits']} hits, "
+                                            f"{cache_stats['misses']} misses)")
+                    
+                    # Ask if user wants to open the PDF
+                    reply = QMessageBox.question(
+                        self, 
+                        "PDF Generated Successfully", 
+                        f"PDF generated successfully!\n\nSaved at: {pdf_path}\n\nDo you want to open the PDF now?",
+                        QMessageBox.Yes | QMessageBox.No,
+                        QMessageBox.Yes
+                    )
+                    
+                    if reply == QMessageBox.Yes:
+                        # Open PDF with default system viewer
+                        try:
+                            if sys.platform == "win32":
+                                os.startfile(pdf_path)
+                            elif sys.platform == "darwin":
+                                subprocess.run(["open", pdf_path])
+                            else:
+                                subprocess.run(["xdg-open", pdf_path])
+                        except Exception as open_error:
+                            QMessageBox.warning(self, "Open Error", 
+                                              f"Failed to open PDF: {str(open_error)}\n\n"
+                                              f"You can manually open the file:\n{pdf_path}")
+                else:
+                    QMessageBox.critical(self, "Error", "Failed to generate PDF")
+                
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to generate PDF: {str(e)}")
+    
+    def print_prescription(self):
+        """Print current prescription with system print dialog"""
+        if not self.current_patient:
+            QMessageBox.warning(self, "Warning", "Please select a patient first!")
+            return
+        
+        try:
+            # Get current prescription data from form
+            prescription_data = self.get_current_prescription_data()
+            
+            # Set some default printer options before the dialog so the user can override them
+            printer = QPrinter(QPrinter.HighResolution)
+            printer.setPageSize(QPrinter.A4)
+            printer.setOrientation(QPrinter.Portrait)
+            printer.setFullPage(True)
+            
+            print_dialog = QPrintDialog(printer, self)
+            print_dialog.setWindowTitle("Print Prescription")
+            
+            if print_dialog.exec_() != QPrintDialog.Accepted:
+                return
+            
+            # Reuse an identical earlier render, or the live preview's PDF when the content is unchanged
+            cache_key = self.render_cache_key(prescription_data)
+            pdf_bytes = self.pdf_render_cache.get(cache_key)
+            if pdf_bytes is None and self.preview_cache and \
+                    self.preview_cache[0] == self.prescription_content_hash(prescription_data):
+                pdf_bytes = self.preview_cache[1]
+                self.pdf_render_cache.put(cache_key, pdf_bytes)
+            
+            # A miss is rendered by the print queue, which stores the PDF for the next reprint
+            self.print_queue.submit(
+                f"Prescription for {self.current_patient['name']}",
+                printer,
+                html_content=None if pdf_bytes else self.create_prescription_html(prescription_data),
+                pdf_bytes=pdf_bytes,
+                cache_key=cache_key
+            )
+            self.status_bar.setText("Prescription queued for printing...")
+            
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to print prescription: {str(e)}")
+    
+    def setup_print_queue(self):
+        """Start the background print queue"""
+        self.print_queue = PrescriptionPrintQueue(self, render_cache=self.pdf_render_cache)
+        self.print_queue.job_done.connect(self.status_bar.setText)
+        self.print_queue.job_failed.connect(self.on_print_job_failed)
+    
+    def on_print_job_failed(self, message):
+        """Report a print job that failed after all retries"""
+        self.status_bar.setText("Printing failed")
+        QMessageBox.warning(self, "Print Error", f"Failed to send to printer:\n\n{message}")
+    
+    # ==================== LIVE PREVIEW METHODS ====================
+    
+    def setup_live_preview(self):
+        """Debounce form edits into background preview renders"""
+        self.preview_worker = None
+        self.preview_pending = False
+        self.preview_wanted = None  # content_hash of the newest render started; older results are dropped
+        self.preview_cache = None  # (content_hash, pdf_bytes, images) of the last render
+        
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(800)
+        self.preview_timer.timeout.connect(self.render_live_preview)
+        
+        for widget in (self.cc_entry, self.diagnosis_entry, self.systemic_entry,
+                       self.selected_investigations, self.advice_entry):
+            widget.textChanged.connect(self.schedule_preview_render)
+        for widget in (self.bp_entry, self.pulse_entry, self.temp_entry, self.resp_entry,
+                       self.spo2_entry, self.weight_entry, self.follow_up_entry):
+            widget.textChanged.connect(self.schedule_preview_render)
+        
+        drugs_model = self.drugs_table.model()
+        drugs_model.rowsInserted.connect(self.schedule_preview_render)
+        drugs_model.rowsRemoved.connect(self.schedule_preview_render)
+        drugs_model.dataChanged.connect(self.schedule_preview_render)
+    
+    def toggle_live_preview(self, enabled):
+        """Show or hide the live preview column"""
+        self.preview_group.setVisible(enabled)
+        if enabled:
+            self.schedule_preview_render()
+        else:
+            self.preview_timer.stop()
+    
+    def schedule_preview_render(self, *args):
+        """Restart the debounce timer; the preview renders once the form goes quiet"""
+        if self.live_preview_check.isChecked() and self.current_patient:
+            self.preview_timer.start()
+    
+    def prescription_content_hash(self, prescription_data):
+        """Hash the printable content of a prescription, ignoring its timestamp"""
+        payload = json.dumps([
+            prescription_data['patient_info'],
+            prescription_data['prescription'][3:],
+            prescription_data['doctor_info']
+        ], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    
+    def render_live_preview(self):
+        """Start a background render unless the content is unchanged"""
+        prescription_data = self.get_current_prescription_data()
+        if not prescription_data:
+            return
+        
+        if self.preview_worker is not None:
+            if self.preview_worker.isRunning():
+                # Render the latest state as soon as the current one finishes
+                self.preview_pending = True
+                return
+            # Done, though its finished signal is still queued; that handler deletes it
+            self.preview_worker.wait()
+            self.preview_worker = None
+        
+        content_hash = self.prescription_content_hash(prescription_data)
+        if self.preview_cache and self.preview_cache[0] == content_hash:
+            return
+        
+        self.preview_status.setText("Rendering preview...")
+        self.preview_wanted = content_hash
+        self.preview_worker = PrescriptionPreviewWorker(
+            content_hash, self.create_prescription_html(prescription_data), self)
+        self.preview_worker.rendered.connect(self.show_live_preview)
+        self.preview_worker.failed.connect(self.show_live_preview_error)
+        self.preview_worker.finished.connect(self.on_preview_worker_finished)
+        self.preview_worker.start()
+    
+    def on_preview_worker_finished(self):
+        """Release the finished worker and pick up edits that arrived while it rendered"""
+        worker = self.sender()
+        worker.deleteLater()
+        if worker is not self.preview_worker:
+            return  # superseded by a newer render
+        self.preview_worker = None
+        if self.preview_pending:
+            self.preview_pending = False
+            self.render_live_preview()
+    
+    def show_live_preview(self, content_hash, pdf_bytes, images):
+        """Display rendered preview pages"""
+        if content_hash != self.preview_wanted:
+            return  # an older render finishing late must not replace a newer one
+        self.preview_cache = (content_hash, pdf_bytes, images)
+        
+        for i in reversed(range(self.preview_pages_layout.count())):
+            widget = self.preview_pages_layout.itemAt(i).widget()
+            if widget:
+                widget.setParent(None)
+        
+        for index, image in enumerate(images):
+            page_label = QLabel()
+            page_label.setPixmap(QPixmap.fromImage(image))
+            page_label.setStyleSheet("border: 1px solid #aaaaaa; background-color: white;")
+            page_label.setAlignment(Qt.AlignCenter)
+            self.preview_pages_layout.insertWidget(index, page_label)
+        
+        self.preview_status.setText(f"Preview updated at {datetime.now().strftime('%I:%M:%S %p')} "
+                                    f"({len(images)} page{'s' if len(images) != 1 else ''})")
+    
+    def show_live_preview_error(self, content_hash, message):
+        """Report a failed preview render without interrupting the doctor"""
+        if content_hash != self.preview_wanted:
+            return
+        self.preview_status.setText(f"Preview unavailable: {message}")
+    
+    # ==================== BACKUP METHODS ====================
+    
+    def load_maintenance_settings(self):
+        """Load backup, archival and image upload settings"""
+        self.maintenance_settings = {
+            'backup_dir': 'backups',
+            'nightly_hour': 2,
+            'keep': 14,
+            'last_backup': '',
+            'last_backup_failure': '',
+            'archive_age_days': 730,
+            'maintenance_hour': 3,
+            'last_maintenance': '',
+            'last_maintenance_failure': '',
+            'last_integrity_check': '',
+            'last_vacuum': '',
+            'image_format': 'jpeg',
+            'image_quality': 85,
+            'image_max_side': 3000,
+            'keep_original_images': False
+        }
+        
+        try:
+            with open('maintenance_settings.json', 'r', encoding='utf-8') as f:
+                self.maintenance_settings.update(json.load(f))
+        except:
+            # If file doesn't exist, create it with default settings
+            self.save_maintenance_settings()
+    
+    def save_maintenance_settings(self):
+        """Save backup and archival settings to file"""
+        try:
+            with open('maintenance_settings.json', 'w', encoding='utf-8') as f:
+                json.dump(self.maintenance_settings, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"Error saving backup settings: {e}")
+    
+    def setup_backup_schedule(self):
+        """Show backup settings and check for a due nightly backup every few minutes"""
+        self.backup_worker = None
+        
+        self.backup_dir_label.setText(os.path.abspath(self.maintenance_settings['backup_dir']))
+        self.backup_hour_spin.setValue(self.maintenance_settings['nightly_hour'])
+        self.backup_keep_spin.setValue(self.maintenance_settings['keep'])
+        self.last_backup_label.setText(self.maintenance_settings['last_backup'] or "Never")
+        
+        self.archive_worker = None
+        self.archive_age_spin.setValue(self.maintenance_settings['archive_age_days'])
+        
+        # Missed nightly jobs wait until the program has not been used for a while
+        self.last_user_input = time.monotonic()
+        QApplication.instance().installEventFilter(self)
+        
+        self.maintenance_worker = None
+        self.maintenance_hour_spin.setValue(self.maintenance_settings['maintenance_hour'])
+        self.last_maintenance_label.setText(self.maintenance_settings['last_maintenance'] or "Never")
+        self.refresh_db_health()
+        
+        # Connect after loading so initial values are not written back
+        self.backup_hour_spin.valueChanged.connect(self.on_backup_hour_changed)
+        self.backup_keep_spin.valueChanged.connect(self.on_backup_keep_changed)
+        self.archive_age_spin.valueChanged.connect(self.on_archive_age_changed)
+        self.maintenance_hour_spin.valueChanged.connect(self.on_maintenance_hour_changed)
+        
+        self.backup_timer = QTimer(self)
+        self.backup_timer.timeout.connect(self.check_scheduled_backup)
+        self.backup_timer.timeout.connect(self.check_scheduled_maintenance)
+        self.backup_timer.start(5 * 60 * 1000)
+    
+    def check_scheduled_backup(self):
+        """Start the nightly backup in its window, or catch up on a missed night while the program is idle"""
+        if self.api:
+            return
+        now = datetime.now()
+        due, in_window = nightly_job_due(self.maintenance_settings['last_backup'], now,
+                                         self.maintenance_settings['nightly_hour'])
+        if not due or (not in_window and not self.user_idle()):
+            return
+        # A lasting problem such as a full disk should not leave a database copy every few minutes
+        retry_after = (now - timedelta(minutes=BACKUP_RETRY_MINUTES)).strftime("%Y-%m-%d %H:%M:%S")
+        if self.maintenance_settings['last_backup_failure'] > retry_after:
+            return
+        self.start_backup()
+    
+    def on_backup_hour_changed(self, hour):
+        """Store the nightly backup hour"""
+        self.maintenance_settings['nightly_hour'] = hour
+        self.save_maintenance_settings()
+    
+    def on_backup_keep_changed(self, keep):
+        """Store the number of snapshots to keep"""
+        self.maintenance_settings['keep'] = keep
+        self.save_maintenance_settings()
+    
+    def change_backup_dir(self):
+        """Choose the folder backups are written to"""
+        backup_dir = QFileDialog.getExistingDirectory(self, "Select Backup Folder", self.maintenance_settings['backup_dir'])
+        if backup_dir:
+            self.maintenance_settings['backup_dir'] = backup_dir
+            self.save_maintenance_settings()
+            self.backup_dir_label.setText(os.path.abspath(backup_dir))
+    
+    def start_backup(self):
+        """Start a hot backup in the background"""
+        if self.api:
+            QMessageBox.information(self, "Server Mode", "Backups run on the clinic server in server mode.")
+            return
+        
+        if self.backup_worker is not None and self.backup_worker.isRunning():
+            return
+        
+        try:
+            backup_dir = self.maintenance_settings['backup_dir']
+            os.makedirs(backup_dir, exist_ok=True)
+            
+            self.backup_worker = BackupWorker(
+                ['medical_prescription.db', 'medical_prescription_archive.db'],
+                backup_dir,
+                list(CATALOG_FILES.values()),
+                'patient_images',
+                keep=self.maintenance_settings['keep'],
+                parent=self
+            )
+            self.backup_worker.progress.connect(self.on_backup_progress)
+            self.backup_worker.completed.connect(self.on_backup_completed)
+            self.backup_worker.failed.connect(self.on_backup_failed)
+            
+            self.backup_now_btn.setEnabled(False)
+            self.backup_progress.setValue(0)
+            self.backup_status_label.setText("Backup started...")
+            self.backup_worker.start()
+            
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to start backup: {str(e)}")
+    
+    def on_backup_progress(self, percent, message):
+        """Show backup progress"""
+        self.backup_progress.setValue(percent)
+        self.backup_status_label.setText(message)
+    
+    def on_backup_completed(self, snapshot_dir, summary):
+        """Record a finished backup"""
+        self.maintenance_settings['last_backup'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.save_maintenance_settings()
+        self.last_backup_label.setText(f"{self.maintenance_settings['last_backup']} ({snapshot_dir})")
+        self.backup_status_label.setText(summary)
+        self.backup_now_btn.setEnabled(True)
+        self.status_bar.setText(summary)
+    
+    def on_backup_failed(self, message):
+        """Report a failed backup without interrupting work"""
+        self.maintenance_settings['last_backup_failure'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.save_maintenance_settings()
+        self.backup_status_label.setText(f"Backup failed: {message}")
+        self.backup_now_btn.setEnabled(True)
+        self.status_bar.setText(f"Backup failed: {message}")
+    
+    # ==================== ARCHIVE METHODS ====================
+    
+    def on_archive_age_changed(self, days):
+        """Store the archival age"""
+        self.maintenance_settings['archive_age_days'] = days
+        self.save_maintenance_settings()
+    
+    def start_archive(self):
+        """Move prescriptions older than the configured age into the archive tier"""
+        if self.api:
+            QMessageBox.information(self, "Server Mode", "Archiving runs on the clinic server in server mode.")
+            return
+        
+        if self.archive_worker is not None and self.archive_worker.isRunning():
+            return
+        
+        days = self.maintenance_settings['archive_age_days']
+        cutoff_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        
+        reply = QMessageBox.question(
+            self,
+            "Confirm Archive",
+            f"Move prescriptions older than {days} days (before {cutoff_date[:10]}) to the archive?\n\n"
+            f"They will remain visible in patient history.",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+        
+        # Make sure nothing of ours is uncommitted before the worker's connection writes
+        self.conn.commit()
+        
+        self.archive_worker = ArchiveWorker('medical_prescription.db', 'medical_prescription_archive.db',
+                                            cutoff_date, parent=self)
+        self.archive_worker.progress.connect(self.on_archive_progress)
+        self.archive_worker.completed.connect(self.on_archive_completed)
+        self.archive_worker.failed.connect(self.on_archive_failed)
+        
+        self.archive_now_btn.setEnabled(False)
+        self.archive_progress.setValue(0)
+        self.archive_status_label.setText("Archiving...")
+        self.archive_worker.start()
+    
+    def on_archive_progress(self, percent, message):
+        """Show archive progress"""
+        self.archive_progress.setValue(percent)
+        self.archive_status_label.setText(message)
+    
+    def on_archive_completed(self, summary):
+        """Report a finished archive run"""
+        self.archive_progress.setValue(100)
+        self.archive_status_label.setText(summary)
+        self.archive_now_btn.setEnabled(True)
+        self.status_bar.setText(summary)
+        self.load_patient_history()
+    
+    def on_archive_failed(self, message):
+        """Report a failed archive run"""
+        self.archive_status_label.setText(f"Archive failed: {message}")
+        self.archive_now_btn.setEnabled(True)
+        QMessageBox.critical(self, "Error", f"Failed to archive prescriptions: {message}")
+    
+    # ==================== DATABASE MAINTENANCE METHODS ====================
+    
+    def on_maintenance_hour_changed(self, hour):
+        """Store the nightly maintenance hour"""
+        self.maintenance_settings['maintenance_hour'] = hour
+        self.save_maintenance_settings()
+    
+    def due_maintenance_tasks(self, now):
+        """Tasks for tonight: optimize daily, integrity check and ANALYZE weekly, VACUUM monthly"""
+        def older_than(key, days):
+            last = self.maintenance_settings[key]
+            return not last or last[:10] <= (now - timedelta(days=days)).strftime("%Y-%m-%d")
+        
+        tasks = ['optimize']
+        if older_than('last_integrity_check', 7):
+            tasks += ['integrity_check', 'analyze']
+        if older_than('last_vacuum', 30):
+            tasks.append('vacuum')
+        return tasks
+    
+    def eventFilter(self, watched, event):
+        """Note the time of the latest keyboard or mouse input anywhere in the program"""
+        if event.type() in USER_INPUT_EVENTS:
+            self.last_user_input = time.monotonic()
+        return super().eventFilter(watched, event)
+    
+    def user_idle(self):
+        """True once nobody has used the program for IDLE_CATCH_UP_MINUTES"""
+        return time.monotonic() - self.last_user_input >= IDLE_CATCH_UP_MINUTES * 60
+    
+    def check_scheduled_maintenance(self):
+        """Start the nightly maintenance in its window, or catch up on a missed night while the program is idle"""
+        if self.api:
+            return
+        now = datetime.now()
+        due, in_window = nightly_job_due(self.maintenance_settings['last_maintenance'], now,
+                                         self.maintenance_settings['maintenance_hour'])
+        if not due or (not in_window and not self.user_idle()):
+            return
+        # A locked database or full disk should not restart the whole task list every few minutes
+        retry_after = (now - timedelta(minutes=MAINTENANCE_RETRY_MINUTES)).strftime("%Y-%m-%d %H:%M:%S")
+        if self.maintenance_settings['last_maintenance_failure'] > retry_after:
+            return
+        # Try again on the next tick rather than competing with a backup or archive run for the files
+        for worker in (self.backup_worker, self.archive_worker):
+            if worker is not None and worker.isRunning():
+                return
+        tasks = self.due_maintenance_tasks(now)
+        if not in_window:
+            # VACUUM locks the database for its whole run, so it waits for a night the computer is on
+            tasks = [task for task in tasks if task != 'vacuum']
+        self.start_maintenance(tasks)
+    
+    def run_maintenance_now(self):
+        """Run every maintenance task right away"""
+        if self.api:
+            QMessageBox.information(self, "Server Mode", "Database maintenance runs on the clinic server in server mode.")
+            return
+        self.start_maintenance([task for task, _ in DB_MAINTENANCE_TASKS])
+    
+    def start_maintenance(self, tasks):
+        """Run maintenance tasks in the background"""
+        if self.maintenance_worker is not None and self.maintenance_worker.isRunning():
+            return
+        
+        # VACUUM needs the database to itself, so nothing of ours may be left uncommitted
+        self.conn.commit()
+        
+        self.maintenance_worker = DatabaseMaintenanceWorker('medical_prescription.db', 'medical_prescription_archive.db',
+                                                            tasks, parent=self)
+        self.maintenance_worker.progress.connect(self.on_maintenance_progress)
+        self.maintenance_worker.completed.connect(self.on_maintenance_completed)
+        self.maintenance_worker.failed.connect(self.on_maintenance_failed)
+        
+        self.maintenance_now_btn.setEnabled(False)
+        self.maintenance_progress.setValue(0)
+        self.maintenance_status_label.setText("Maintenance started...")
+        self.maintenance_worker.start()
+    
+    def on_maintenance_progress(self, percent, message):
+        """Show maintenance progress"""
+        self.maintenance_progress.setValue(percent)
+        self.maintenance_status_label.setText(message)
+    
+    def on_maintenance_completed(self, summary):
+        """Record which tasks ran and show the new database health"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        tasks = self.maintenance_worker.tasks
+        self.maintenance_settings['last_maintenance'] = now
+        if 'integrity_check' in tasks:
+            self.maintenance_settings['last_integrity_check'] = now
+        if 'vacuum' in tasks:
+            self.maintenance_settings['last_vacuum'] = now
+        self.save_maintenance_settings()
+        
+        self.last_maintenance_label.setText(now)
+        self.maintenance_status_label.setText(summary)
+        self.maintenance_now_btn.setEnabled(True)
+        self.status_bar.setText(summary)
+        self.refresh_db_health()
+    
+    def on_maintenance_failed(self, message, integrity_problem):
+        """Report a failed run; a damaged database gets a message box since it needs a restore"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.maintenance_settings['last_maintenance_failure'] = now
+        if integrity_problem:
+            # Running again will not repair the database, so the night counts as done
+            self.maintenance_settings['last_maintenance'] = now
+        self.save_maintenance_settings()
+        self.maintenance_status_label.setText(f"Maintenance failed: {message}")
+        self.maintenance_now_btn.setEnabled(True)
+        self.status_bar.setText(f"Maintenance failed: {message}")
+        if integrity_problem:
+            QMessageBox.critical(self, "Database Problem",
+                                 f"The integrity check found problems in the database:\n\n{message}\n\n"
+                                 f"Keep working carefully and restore the latest backup as soon as possible.")
+    
+    def refresh_db_health(self):
+        """Show page counts, free pages and index usage of the databases"""
+        if self.api:
+            self.db_health_label.setText("Database health is shown on the clinic server.")
+            return
+        
+        try:
+            health = database_health(self.conn)
+        except Exception as e:
+            self.db_health_label.setText(f"Could not read database health: {e}")
+            return
+        
+        lines = []
+        for database in health['databases']:
+            free = database['freelist_count']
+            lines.append(
+                f"{'Main' if database['schema'] == 'main' else 'Archive'} database: "
+                f"{database['page_count']:,} pages of {database['page_size'] // 1024} KB "
+                f"({database['size'] / (1024 * 1024):.1f} MB), {free:,} free "
+                f"({free * 100 / max(database['page_count'], 1):.1f}%), "
+                f"auto-vacuum {('off', 'full', 'incremental')[database['auto_vacuum']]}")
+        self.db_health_label.setText("\n".join(lines))
+        
+        self.db_index_table.setRowCount(len(health['indexes']))
+        for row, index in enumerate(health['indexes']):
+            values = [index['name'], index['table'],
+                      "" if index['rows'] is None else f"{index['rows']:,}",
+                      "" if index['rows_per_key'] is None else str(index['rows_per_key']),
+                      ", ".join(index['used_by']) or "Not used by the checked queries"]
+            for col, value in enumerate(values):
+                self.db_index_table.setItem(row, col, QTableWidgetItem(value))
+        self.db_index_table.resizeColumnsToContents()
+        
+        if health['scans']:
+            self.db_scans_label.setText("Full table scans:\n" + "\n".join(health['scans']))
+        else:
+            self.db_scans_label.setText("All checked queries use an index." +
+                                        ("" if any(index['rows'] is not None for index in health['indexes'])
+                                         else " Row counts appear after the first ANALYZE."))
+    
+    def clean_up_orphans(self):
+        """Find rows and image files left behind by deleted patients and remove them after confirmation"""
+        if self.api:
+            QMessageBox.information(self, "Server Mode", "Clean-up runs on the clinic server in server mode.")
+            return
+        
+        try:
+            counts, files = find_orphans(self.conn)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to scan for orphaned data: {str(e)}")
+            return
+        
+        found = [f"{count} {table.split('.')[-1].replace('_', ' ')} rows" for table, count in counts.items() if count]
+        if files:
+            found.append(f"{len(files)} image files")
+        if not found:
+            self.orphan_status_label.setText("No orphaned data found.")
+            return
+        
+        reply = QMessageBox.question(
+            self,
+            "Confirm Clean-up",
+            "Found data of patients that no longer exist:\n\n" + "\n".join(found) +
+            "\n\nDelete it and compact the database?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.No
+        )
+        if reply != QMessageBox.Yes:
+            return
+        
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            removed = remove_orphans(self.conn)
+            reclaimed = reclaim_free_pages(self.conn, full=True)
+            self.file_cleanup.submit(remove_files, files)
+            summary = (f"Removed {sum(removed.values())} orphaned rows and {len(files)} image files; "
+                       f"{reclaimed / (1024 * 1024):.1f} MB reclaimed")
+            self.orphan_status_label.setText(summary)
+            self.status_bar.setText(summary)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to clean up orphaned data: {str(e)}")
+        finally:
+            QApplication.restoreOverrideCursor()
+    
+    # ==================== ANALYTICS METHODS ====================
+    
+    def run_analytics_report(self):
+        """Query the rollups for the chosen period and show the results"""
+        try:
+            start = time.perf_counter()
+            start_day, end_day = analytics_period_range(ANALYTICS_PERIODS[self.analytics_period_combo.currentText()])
+            diagnosis = self.analytics_diagnosis_entry.text().strip() or None
+            if self.api:
+                report = self.api.analytics_report(start_day, end_day, diagnosis=diagnosis)
+            else:
+                report = analytics_report(self.cursor, start_day, end_day, diagnosis=diagnosis)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to run report: {str(e)}")
+            return
+        
+        self.analytics_report_data = report
+        summary = (f"{report['prescriptions']} prescriptions, {report['patient_visits']} patient visits "
+                   f"({report['start'] if report['start'] != '0000-00-00' else 'all time'} to {report['end']})")
+        if 'diagnosis_matches' in report:
+            matched = sum(count for _, count in report['diagnosis_matches'])
+            summary += f" | Diagnosis '{report['diagnosis_filter']}': {matched}"
+        self.analytics_summary_label.setText(summary)
+        
+        self.analytics_chart.set_data([month for month, _, _ in report['by_month']],
+                                      [prescriptions for _, prescriptions, _ in report['by_month']])
+        for table, rows in ((self.analytics_diagnosis_table, report.get('diagnosis_matches') or report['top_diagnoses']),
+                            (self.analytics_drug_table, report['top_drugs'])):
+            table.setRowCount(len(rows))
+            for row, (label, count) in enumerate(rows):
+                table.setItem(row, 0, QTableWidgetItem(str(label)))
+                table.setItem(row, 1, QTableWidgetItem(str(count)))
+        self.status_bar.setText(f"Report ready in {elapsed_ms:.0f} ms")
+    
+    def export_analytics_csv(self):
+        """Save the report currently shown as CSV"""
+        if not self.analytics_report_data:
+            self.run_analytics_report()
+        if not self.analytics_report_data:
+            return
+        
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Export Report", f"clinic_report_{datetime.now().strftime('%Y%m%d')}.csv", "CSV Files (*.csv)"
+        )
+        if file_path:
+            try:
+                write_analytics_csv(self.analytics_report_data, file_path)
+                QMessageBox.information(self, "Success", f"Report exported to:\n{file_path}")
+            except Exception as e:
+                QMessageBox.critical(self, "Error", f"Failed to export report: {str(e)}")
+    
+    def rebuild_analytics(self):
+        """Recompute the statistics tables from every stored prescription"""
+        try:
+            if self.api:
+                count = self.api.rebuild_analytics()
+            else:
+                count = rebuild_analytics_rollups(self.conn)
+            self.status_bar.setText(f"Statistics rebuilt from {count} prescriptions")
+            self.run_analytics_report()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to rebuild statistics: {str(e)}")
     
-    def generate_pdf(self):
-        """Generate PDF with file location prompt and option to open"""
-        if not self.current_patient:
-            QMessageBox.warning(self, "Warning", "Please select a patient first!")
+    def export_mis_report(self):
+        """Export age, gender, weight and vitals distributions by diagnosis for the chosen period"""
+        start_day, end_day = analytics_period_range(ANALYTICS_PERIODS[self.analytics_period_combo.currentText()])
+        file_path, _ = QFileDialog.getSaveFileName(
+            self, "Export MIS Report", f"mis_report_{datetime.now().strftime('%Y%m%d')}.csv", "CSV Files (*.csv)"
+        )
+        if not file_path:
             return
         
+        QApplication.setOverrideCursor(Qt.WaitCursor)
         try:
-            # Ask for save location
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, "Save PDF As", 
-                f"prescription_{self.current_patient['reg_no']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                "PDF Files (*.pdf)"
-            )
-            
-            if file_path:
-                # Get current prescription data from form
-                prescription_data = self.get_current_prescription_data()
-                
-                # Generate PDF
-                pdf_path = self.generate_prescription_pdf(prescription_data, file_path)
-                
-                if pdf_path and os.path.exists(pdf_path):
-                    # Ask if user wants to open the PDF
-                    reply = QMessageBox.question(
-                        self, 
-                        "PDF Generated Successfully", 
-                        f"PDF generated successfully!\n\nSaved at: {pdf_path}\n\nDo you want to open the PDF now?",
-                        QMessageBox.Yes | QMessageBox.No,
-                        QMessageBox.Yes
-                    )
-                    
-                    if reply == QMessageBox.Yes:
-                        # Open PDF with default system viewer
-                        try:
-                            if sys.platform == "win32":
-                                os.startfile(pdf_path)
-                            elif sys.platform == "darwin":
-                                subprocess.run(["open", pdf_path])
-                            else:
-                                subprocess.run(["xdg-open", pdf_path])
-                        except Exception as open_error:
-                            QMessageBox.warning(self, "Open Error", 
-                                              f"Failed to open PDF: {str(open_error)}\n\n"
-                                              f"You can manually open the file:\n{pdf_path}")
-                else:
-                    QMessageBox.critical(self, "Error", "Failed to generate PDF")
-                
+            start = time.perf_counter()
+            if self.api:
+                rows = self.api.mis_report(start_day, end_day)
+            else:
+                rows = mis_report(VisitSnapshot.open(self.conn), start_day, end_day)
+            write_mis_csv(rows, file_path)
+            self.status_bar.setText(f"MIS report with {len(rows)} diagnoses written in {time.perf_counter() - start:.1f}s")
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to generate PDF: {str(e)}")
+            QMessageBox.critical(self, "Error", f"Failed to create MIS report: {str(e)}")
+        finally:
+            QApplication.restoreOverrideCursor()
     
-    def print_prescription(self):
-        """Print current prescription with system print dialog"""
-        if not self.current_patient:
-            QMessageBox.warning(self, "Warning", "Please select a patient first!")
+    # ==================== VISIT QUEUE METHODS ====================
+    
+    def setup_visit_queue(self):
+        """Load today's queue"""
+        self.queue_date = None
+        self.queue_waiting = deque()  # (queue id, reg no, name, age, gender) in token order
+        self.called_visits = {}  # reg no -> queue id of visits this window put in consult
+        self.current_queue_id = None
+        self.load_today_queue()
+    
+    def load_today_queue(self):
+        """Re-read today's queue through the (visit_date, token) index"""
+        try:
+            self.queue_date = datetime.now().strftime("%Y-%m-%d")
+            if self.api:
+                visits = self.api.visit_queue(self.queue_date)
+            else:
+                visits = query_visit_queue(self.cursor, self.queue_date)
+        except Exception as e:
+            print(f"Error loading visit queue: {e}")
+            return
+        
+        self.queue_waiting = deque((queue_id, reg_no, name, age, gender)
+                                   for queue_id, token, reg_no, name, age, gender, status in visits
+                                   if status == 'waiting')
+        # Forget our visits that were finished or sent back elsewhere; others' consults are never ours
+        in_consult = {queue_id for queue_id, token, reg_no, name, age, gender, status in visits
+                      if status == 'in_consult'}
+        self.called_visits = {reg_no: queue_id for reg_no, queue_id in self.called_visits.items()
+                              if queue_id in in_consult}
+        
+        self.queue_list.clear()
+        for queue_id, token, reg_no, name, age, gender, status in visits:
+            item = QListWidgetItem(f"#{token} {name} - {QUEUE_STATUS_LABELS.get(status, status)}")
+            item.setData(Qt.UserRole, (queue_id, reg_no, name, age, gender, status))
+            if status == 'done':
+                item.setForeground(QColor('#999999'))
+            elif status == 'in_consult':
+                item.setBackground(QColor('#d4edda'))
+            self.queue_list.addItem(item)
+    
+    def change_visit_status(self, queue_id, status):
+        """Apply a status transition locally or on the server"""
+        if self.api:
+            self.api.set_visit_status(queue_id, status)
+        else:
+            set_visit_status(self.conn, queue_id, status)
+            self.conn.commit()
+    
+    def enqueue_selected_patient(self):
+        """Give the selected patient the next token in today's queue"""
+        selected_items = self.patient_table.selectedItems()
+        if not selected_items:
+            QMessageBox.warning(self, "Warning", "Please select a patient to add to the queue!")
             return
         
+        row = selected_items[0].row()
+        reg_no = int(self.patient_table.item(row, 0).text())
+        name = self.patient_table.item(row, 1).text()
         try:
-            # Get current prescription data from form
-            prescription_data = self.get_current_prescription_data()
-            
-            # Generate PDF to temporary file
-            pdf_path = self.generate_prescription_pdf(prescription_data)
-            
-            if pdf_path and os.path.exists(pdf_path):
-                # Use system print dialog instead of direct printing
-                printer = QPrinter(QPrinter.HighResolution)
-                print_dialog = QPrintDialog(printer, self)
-                print_dialog.setWindowTitle("Print Prescription")
-                
-                # Set some default printer options
-                printer.setPageSize(QPrinter.A4)
-                printer.setOrientation(QPrinter.Portrait)
-                printer.setFullPage(True)
-                
-                if print_dialog.exec_() == QPrintDialog.Accepted:
-                    # Print the PDF
-                    try:
-                        # For PDF printing, we'll use the system's PDF viewer
-                        if sys.platform == "win32":
-                            os.startfile(pdf_path, "print")
-                        elif sys.platform == "darwin":
-                            subprocess.run(["lp", pdf_path])
-                        else:
-                            subprocess.run(["lp", pdf_path])
-                        
-                        QMessageBox.information(self, "Print", "Prescription sent to printer!")
-                        
-                    except Exception as print_error:
-                        QMessageBox.warning(self, "Print Error", 
-                                          f"Failed to send to printer: {str(print_error)}\n\n"
-                                          f"You can manually print the PDF file:\n{pdf_path}")
-                
-                # Clean up temporary file after a delay
-                QTimer.singleShot(3000, lambda: os.unlink(pdf_path) if os.path.exists(pdf_path) else None)
-                
+            visit_date = datetime.now().strftime("%Y-%m-%d")
+            if self.api:
+                queue_id, token = self.api.enqueue_visit(reg_no, visit_date)
             else:
-                QMessageBox.critical(self, "Error", "Failed to generate PDF for printing")
-                
+                queue_id, token = enqueue_visit(self.conn, reg_no, visit_date)
+                self.conn.commit()
+            self.load_today_queue()
+            self.status_bar.setText(f"{name} added to today's queue with token #{token}")
         except Exception as e:
-            QMessageBox.critical(self, "Error", f"Failed to print prescription: {str(e)}")
+            QMessageBox.warning(self, "Queue", f"Could not add patient to the queue: {str(e)}")
+    
+    def finish_current_visit(self):
+        """Mark the visit being consulted as done"""
+        if self.current_queue_id is None:
+            return
+        try:
+            self.change_visit_status(self.current_queue_id, 'done')
+        except Exception as e:
+            print(f"Error finishing visit: {e}")
+        self.current_queue_id = None
+        self.load_today_queue()
+    
+    def call_visit(self, visit):
+        """Put a waiting visit in consult and open its patient"""
+        queue_id, reg_no, name, age, gender = visit
+        self.change_visit_status(queue_id, 'in_consult')
+        self.called_visits[str(reg_no)] = queue_id
+        self.open_patient_for_prescription(str(reg_no), name, str(age), gender)
+        self.load_today_queue()
+    
+    def open_next_patient(self):
+        """Finish the current visit and call the next waiting patient (F2)"""
+        if self.queue_date != datetime.now().strftime("%Y-%m-%d"):
+            self.load_today_queue()
+        self.finish_current_visit()
+        
+        while self.queue_waiting:
+            visit = self.queue_waiting.popleft()
+            try:
+                self.call_visit(visit)
+                return
+            except Exception as e:
+                # Another workstation called this patient first; try the next one
+                print(f"Skipping queue entry {visit[0]}: {e}")
+        
+        self.status_bar.setText("No patients waiting in today's queue")
+    
+    def open_queued_patient(self, item):
+        """Call a specific patient from the queue list out of turn"""
+        queue_id, reg_no, name, age, gender, status = item.data(Qt.UserRole)
+        try:
+            if status == 'waiting':
+                self.finish_current_visit()
+                self.call_visit((queue_id, reg_no, name, age, gender))
+            elif status == 'in_consult':
+                self.open_patient_for_prescription(str(reg_no), name, str(age), gender)
+        except Exception as e:
+            self.load_today_queue()
+            QMessageBox.warning(self, "Queue", f"Could not call patient: {str(e)}")
+    
+    # ==================== CHANGE FEED METHODS ====================
+    
+    def setup_change_feed(self):
+        """Follow the server's change feed when running as a thin client"""
+        self.change_feed = None
+        if not self.api:
+            return
+        self.change_feed = ChangeFeedWorker(self.api.base_url, self.api.token, self)
+        self.change_feed.changes.connect(self.apply_remote_changes)
+        self.change_feed.start()
+    
+    def apply_remote_changes(self, result):
+        """Apply a batch of server-side changes to the patient list and the open history"""
+        self.api.clear_cache()
+        if result.get('reset'):
+            self.refresh_patient_list()
+            self.load_today_queue()
+            return
+        
+        patients = {row[0]: row for row in result.get('patients', [])}
+        history_patient = self.history_patient_combo.currentData()
+        changed_patients = []
+        history_stale = False
+        queue_stale = False
+        for change in result['changes']:
+            if change['entity'] == 'patient':
+                self.blocked_generics_cache.pop(str(change['id']), None)
+                if change['id'] not in changed_patients:
+                    changed_patients.append(change['id'])
+            elif change['entity'] == 'queue':
+                queue_stale = True
+            else:
+                self.vitals_series_cache.pop(change['patient_reg_no'], None)
+                if change['patient_reg_no'] == history_patient:
+                    history_stale = True
+        
+        for reg_no in changed_patients:
+            self.apply_patient_delta(reg_no, patients.get(reg_no))
+        if history_stale:
+            self.load_patient_history()
+        if queue_stale or changed_patients:
+            self.load_today_queue()
+        if changed_patients:
+            self.status_bar.setText(f"Patient list updated from server ({len(changed_patients)} changed)")
+    
+    def find_patient_table_row(self, reg_no):
+        """Row of a patient in the patient table, or None"""
+        for row in range(self.patient_table.rowCount()):
+            item = self.patient_table.item(row, 0)
+            if item is not None and item.text() == str(reg_no):
+                return row
+        return None
+    
+    def apply_patient_delta(self, reg_no, patient):
+        """Insert, update or remove one patient (None = deleted) in the table and combos"""
+        table_row = self.find_patient_table_row(reg_no)
+        if patient is None:
+            if table_row is not None:
+                self.patient_table.removeRow(table_row)
+        elif table_row is not None or not self.search_entry.text().strip():
+            if table_row is None:
+                # Rows are ordered by registration number, newest first
+                table_row = next((row for row in range(self.patient_table.rowCount())
+                                  if int(self.patient_table.item(row, 0).text()) < reg_no),
+                                 self.patient_table.rowCount())
+                self.patient_table.insertRow(table_row)
+            for col, value in enumerate(patient):
+                self.patient_table.setItem(table_row, col, QTableWidgetItem(str(value)))
+        
+        for combo in (self.history_patient_combo, self.images_patient_combo):
+            index = combo.findData(reg_no)
+            if patient is None:
+                if index > 0:
+                    combo.removeItem(index)
+            elif index > 0:
+                combo.setItemText(index, f"{patient[0]} - {patient[1]}")
+            else:
+                position = next((i for i in range(1, combo.count()) if combo.itemData(i) < reg_no), combo.count())
+                combo.insertItem(position, f"{patient[0]} - {patient[1]}", patient[0])
+    
+    # ==================== DRAFT AUTOSAVE METHODS ====================
+    
+    def setup_draft_autosave(self):
+        """Start the draft journal, offer to restore a crashed draft and begin autosaving"""
+        self.draft_journal = PrescriptionDraftJournal()
+        self.draft_last_state = {}
+        self.draft_saved = False
+        self.draft_capture_times = []
+        
+        self.restore_prescription_draft()
+        
+        self.draft_timer = QTimer(self)
+        self.draft_timer.timeout.connect(self.autosave_prescription_draft)
+        self.draft_timer.start(3000)
+    
+    def capture_prescription_form_state(self):
+        """Capture the prescription form as a flat dict of field values"""
+        drugs = []
+        for row in range(self.drugs_table.rowCount()):
+            drugs.append([
+                self.drugs_table.item(row, col).text() if self.drugs_table.item(row, col) else ''
+                for col in range(4)
+            ])
+        
+        return {
+            'patient': self.current_patient,
+            'cc': self.cc_entry.toPlainText(),
+            'diagnosis': self.diagnosis_entry.toPlainText(),
+            'bp': self.bp_entry.text(),
+            'pulse': self.pulse_entry.text(),
+            'temp': self.temp_entry.text(),
+            'resp': self.resp_entry.text(),
+            'spo2': self.spo2_entry.text(),
+            'weight': self.weight_entry.text(),
+            'systemic': self.systemic_entry.toPlainText(),
+            'investigations': self.selected_investigations.toPlainText(),
+            'drugs': drugs,
+            'advice': self.advice_entry.toPlainText(),
+            'follow_up': self.follow_up_entry.text()
+        }
+    
+    def autosave_prescription_draft(self):
+        """Queue the fields that changed since the last autosave"""
+        start = time.perf_counter()
+        state = self.capture_prescription_form_state()
+        diff = {key: value for key, value in state.items() if self.draft_last_state.get(key) != value}
+        if diff:
+            # Name the patient in every record so edits after a reset still restore on their own
+            diff['patient'] = state['patient']
+            if self.draft_saved:
+                diff['saved'] = False
+                self.draft_saved = False
+            self.draft_journal.record(diff)
+            self.draft_last_state = state
+        
+        # Keep a rolling sample of GUI-thread cost for diagnostics
+        self.draft_capture_times.append((time.perf_counter() - start) * 1000)
+        del self.draft_capture_times[:-100]
+    
+    def restore_prescription_draft(self):
+        """Offer to restore a draft left behind by a crash or power cut"""
+        state = self.draft_journal.state
+        has_content = any(value for key, value in state.items() if key not in ('patient', 'saved'))
+        if not state.get('patient') or not has_content or state.get('saved'):
+            return
+        
+        patient = state['patient']
+        reply = QMessageBox.question(
+            self,
+            "Restore Draft",
+            f"An unsaved prescription for {patient.get('name', '')} (Reg: {patient.get('reg_no', '')}) was found.\n\n"
+            f"Do you want to restore it?",
+            QMessageBox.Yes | QMessageBox.No,
+            QMessageBox.Yes
+        )
+        
+        if reply != QMessageBox.Yes:
+            self.draft_journal.clear()
+            return
+        
+        self.current_patient = patient
+        self.patient_info_display.setText(
+            f"Patient: {patient.get('name', '')} (Reg: {patient.get('reg_no', '')}) | Age: {patient.get('age', '')} | "
+            f"Gender: {patient.get('gender', '')} | Weight: {patient.get('weight', '0')}kg"
+        )
+        self.cc_entry.setPlainText(state.get('cc', ''))
+        self.diagnosis_entry.setPlainText(state.get('diagnosis', ''))
+        self.bp_entry.setText(state.get('bp', ''))
+        self.pulse_entry.setText(state.get('pulse', ''))
+        self.temp_entry.setText(state.get('temp', ''))
+        self.resp_entry.setText(state.get('resp', ''))
+        self.spo2_entry.setText(state.get('spo2', ''))
+        self.weight_entry.setText(state.get('weight', ''))
+        self.systemic_entry.setPlainText(state.get('systemic', ''))
+        self.selected_investigations.setPlainText(state.get('investigations', ''))
+        self.drugs_table.setRowCount(0)
+        self.add_drugs_to_prescription([
+            {'formulation': row[0], 'dosage': row[1], 'duration': row[2], 'instructions': row[3]}
+            for row in state.get('drugs', []) if len(row) == 4
+        ])
+        self.advice_entry.setPlainText(state.get('advice', ''))
+        self.follow_up_entry.setText(state.get('follow_up', ''))
+        
+        self.draft_last_state = self.capture_prescription_form_state()
+        self.tab_widget.setCurrentIndex(2)
+        self.status_bar.setText("Unsaved prescription draft restored")
+    
+    def mark_prescription_draft_saved(self):
+        """Keep journalling the form after a save, but only offer it back once it is edited again"""
+        self.autosave_prescription_draft()
+        self.draft_journal.record({'saved': True})
+        self.draft_saved = True
+    
+    def discard_prescription_draft(self):
+        """Drop the journalled draft once the form is cleared"""
+        self.draft_journal.clear()
+        self.draft_saved = False
+        self.draft_last_state = self.capture_prescription_form_state()
+    
+    def start_prescription_draft(self):
+        """Start a new draft for another patient; the whole form goes into its first record"""
+        self.draft_journal.clear()
+        self.draft_saved = False
+        self.draft_last_state = {}
+    
+    def closeEvent(self, event):
+        """Flush the draft journal and stop background workers before the window closes"""
+        self.autosave_prescription_draft()
+        self.draft_journal.close()
+        self.preview_timer.stop()
+        if self.preview_worker is not None:
+            self.preview_worker.wait()
+        self.print_queue.stop()
+        if self.change_feed is not None:
+            self.change_feed.stop()
+            self.change_feed.wait(2000)
+        if self.backup_worker is not None and self.backup_worker.isRunning():
+            self.status_bar.setText("Waiting for backup to finish...")
+            self.backup_worker.wait()
+        if self.maintenance_worker is not None and self.maintenance_worker.isRunning():
+            self.status_bar.setText("Waiting for database maintenance to finish...")
+            self.maintenance_worker.wait()
+        if self.image_import_worker is not None and self.image_import_worker.isRunning():
+            self.image_import_worker.wait()
+        self.file_cleanup.shutdown(wait=True)
+        super().closeEvent(event)
     
     def clear_prescription_form(self):
         """Clear prescription form"""
@@ -2041,6 +7903,7 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
         self.drugs_table.setRowCount(0)
         self.advice_entry.clear()
         self.follow_up_entry.clear()
+        self.discard_prescription_draft()
     
     def get_current_prescription_data(self):
         """Get current prescription data from form"""
@@ -2107,23 +7970,49 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             'doctor_info': self.doctor_info
         }
     
+    def fetch_patient_prescriptions(self, patient_id):
+        """Return a patient's prescriptions from both the hot and archive tiers, newest first"""
+        if self.api:
+            return self.api.patient_prescriptions(patient_id)
+        return query_patient_prescriptions(self.cursor, patient_id)
+    
+    def patient_vitals_series(self, patient_id):
+        """A patient's VitalsSeries, loaded once and then served from memory"""
+        patient_id = int(patient_id)
+        series = self.vitals_series_cache.get(patient_id)
+        if series is None:
+            if self.api:
+                rows = self.api.patient_vitals(patient_id)
+            else:
+                rows = query_patient_vitals(self.cursor, patient_id)
+            series = VitalsSeries(rows)
+            self.vitals_series_cache[patient_id] = series
+            while len(self.vitals_series_cache) > VITALS_SERIES_CACHE_SIZE:
+                self.vitals_series_cache.popitem(last=False)
+        self.vitals_series_cache.move_to_end(patient_id)
+        return series
+    
+    def append_cached_vitals(self, patient_id, date, vitals_text):
+        """Add a just-saved prescription's vitals to the patient's cached series, if loaded"""
+        patient_id = int(patient_id)  # current_patient holds the reg no as table text; the cache is keyed by int
+        series = self.vitals_series_cache.get(patient_id)
+        if series is None:
+            return
+        series.append(date, parse_vitals_text(vitals_text))
+        if self.history_patient_combo.currentData() == patient_id:
+            self.vitals_trend_chart.set_series(series)
+    
     def load_patient_history(self):
         """Load patient prescription history"""
         try:
             patient_id = self.history_patient_combo.currentData()
             if not patient_id:
                 self.history_display.clear()
+                self.vitals_trend_chart.set_series(None)
                 return
             
-            self.cursor.execute('''
-                SELECT p.*, pt.name, pt.age, pt.gender 
-                FROM prescriptions p 
-                JOIN patients pt ON p.patient_reg_no = pt.reg_no 
-                WHERE p.patient_reg_no = ? 
-                ORDER BY p.date DESC
-            ''', (patient_id,))
-            
-            prescriptions = self.cursor.fetchall()
+            self.vitals_trend_chart.set_series(self.patient_vitals_series(patient_id))
+            prescriptions = self.fetch_patient_prescriptions(patient_id)
             
             if not prescriptions:
                 self.history_display.setPlainText("No prescription history found for this patient.")
@@ -2170,368 +8059,464 @@ class MedicalPrescriptionSystemPyQt(QMainWindow):
             QMessageBox.critical(self, "Error", f"Failed to load patient history: {str(e)}")
     
     def select_image(self):
-        """Select image file for upload"""
-        file_path, _ = QFileDialog.getOpenFileName(
-            self, "Select Image", "", 
-            "Image Files (*.png *.jpg *.jpeg *.bmp *.gif)"
+        """Select one or more image files for upload"""
+        file_paths, _ = QFileDialog.getOpenFileNames(
+            self, "Select Images", "",
+            f"Image Files ({' '.join('*' + extension for extension in IMAGE_FILE_EXTENSIONS)})"
         )
         
-        if file_path:
-            self.upload_image(file_path)
+        if file_paths:
+            self.upload_images(file_paths)
+    
+    def select_image_folder(self):
+        """Upload every image in a folder and its subfolders"""
+        folder = QFileDialog.getExistingDirectory(self, "Select Image Folder")
+        if folder:
+            self.upload_images([folder])
+    
+    def on_image_upload_settings_changed(self, *args):
+        """Store how uploaded images are saved"""
+        self.maintenance_settings['image_format'] = self.image_format_combo.currentData()
+        self.maintenance_settings['image_quality'] = self.image_quality_spin.value()
+        self.maintenance_settings['image_max_side'] = self.image_max_side_spin.value()
+        self.maintenance_settings['keep_original_images'] = self.keep_original_check.isChecked()
+        self.save_maintenance_settings()
     
     def upload_image(self, file_path):
-        """Upload patient image"""
+        """Upload one patient image"""
+        self.upload_images([file_path])
+    
+    def upload_images(self, paths):
+        """Upload image files and folders for the selected patient, compressing them in the background first"""
         try:
             patient_id = self.images_patient_combo.currentData()
             if not patient_id:
                 QMessageBox.warning(self, "Warning", "Please select a patient first!")
                 return
+            if self.image_import_worker is not None and self.image_import_worker.isRunning():
+                QMessageBox.information(self, "Please Wait", "The previous upload is still being processed.")
+                return
+            file_paths = collect_image_files(paths)
+            if not file_paths:
+                QMessageBox.warning(self, "Warning", "No image files found!")
+                return
             
-            # Copy image to images directory
-            images_dir = "patient_images"
-            os.makedirs(images_dir, exist_ok=True)
+            options = {
+                'image_format': self.maintenance_settings['image_format'],
+                'quality': self.maintenance_settings['image_quality'],
+                'max_side': self.maintenance_settings['image_max_side'],
+                'keep_original': self.maintenance_settings['keep_original_images'],
+            }
+            if self.api:
+                # Compress into a temporary folder and send the results; the server names the files
+                staging_dir = tempfile.mkdtemp(prefix='image_upload_')
+                options['keep_original'] = False
+                stems = new_image_stems(staging_dir, file_paths)
+            else:
+                staging_dir = None
+                stems = new_image_stems("patient_images", file_paths,
+                                        f"{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_")
+            jobs = list(zip(file_paths, stems))
+            description = self.image_description.text().strip()
+            upload = None
+            if self.api:
+                api = self.api
+                
+                def upload(stored_path):
+                    api.upload_image(patient_id, stored_path, description)
             
-            file_name = os.path.basename(file_path)
-            new_path = os.path.join(images_dir, f"{patient_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file_name}")
+            self.image_import_context = (patient_id, description, staging_dir)
+            self.image_import_worker = ImageImportWorker(jobs, options, upload=upload, parent=self)
+            self.image_import_worker.progress.connect(self.on_image_import_progress)
+            self.image_import_worker.completed.connect(self.on_image_import_completed)
+            self.image_import_worker.failed.connect(self.on_image_import_failed)
             
-            # Copy file
-            import shutil
-            shutil.copy2(file_path, new_path)
+            self.set_image_upload_busy(True)
+            self.image_upload_status.setText(f"Processing {len(jobs)} image{'s' if len(jobs) != 1 else ''}...")
+            self.image_import_worker.start()
+        
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to upload image: {str(e)}")
+    
+    def set_image_upload_busy(self, busy):
+        """Show the progress bar and disable the upload buttons while images are processed"""
+        self.upload_image_btn.setEnabled(not busy)
+        self.upload_folder_btn.setEnabled(not busy)
+        self.image_upload_progress.setValue(0)
+        self.image_upload_progress.setVisible(busy)
+    
+    def on_image_import_progress(self, percent, message):
+        """Show image processing progress"""
+        self.image_upload_progress.setValue(percent)
+        self.image_upload_status.setText(message)
+    
+    def on_image_import_completed(self, results, errors, summary):
+        """Record all processed images in one transaction, refresh the gallery once and show the bytes saved"""
+        patient_id, description, staging_dir = self.image_import_context
+        self.set_image_upload_busy(False)
+        try:
+            if errors and not results:
+                raise RuntimeError("\n".join(errors))
             
-            # Save to database
-            description = self.image_description.text().strip()
-            self.cursor.execute('''
-                INSERT INTO patient_images (patient_reg_no, image_path, description, date)
-                VALUES (?, ?, ?, ?)
-            ''', (patient_id, new_path, description, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            if not self.api:
+                # In client mode the worker has already sent the files to the server
+                with self.conn:
+                    self.conn.executemany('''
+                        INSERT INTO patient_images (patient_reg_no, image_path, description, date)
+                        VALUES (?, ?, ?, ?)
+                    ''', [(patient_id, result[1], description, date) for result in results])
             
-            self.conn.commit()
             self.image_description.clear()
-            self.load_patient_images()
-            QMessageBox.information(self, "Success", "Image uploaded successfully!")
-            
+            self.image_upload_status.setText(f"Uploaded {summary}")
+            self.status_bar.setText(f"Uploaded {summary}")
+            if self.images_patient_combo.currentData() == patient_id:
+                self.load_patient_images()
+            if errors:
+                QMessageBox.warning(self, "Warning", "Some images could not be uploaded:\n\n" + "\n".join(errors))
+        
         except Exception as e:
+            self.image_upload_status.setText("")
             QMessageBox.critical(self, "Error", f"Failed to upload image: {str(e)}")
+        finally:
+            if staging_dir:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def on_image_import_failed(self, message):
+        """Report an image upload that could not be processed"""
+        patient_id, description, staging_dir = self.image_import_context
+        if staging_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        self.set_image_upload_busy(False)
+        self.image_upload_status.setText("")
+        QMessageBox.critical(self, "Error", f"Failed to upload image: {message}")
+    
+    def render_cache_key(self, prescription_data):
+        """Hash the prescription payload, doctor profile and template version for the render cache"""
+        prescription = list(prescription_data['prescription'])
+        # An unsaved form is stamped with the current time; keying on the day lets reprints reuse
+        # the first render (and its time) while a new day still gets a freshly dated printout
+        prescription[2] = str(prescription[2])[:10]
+        payload = json.dumps([
+            PRESCRIPTION_TEMPLATE_VERSION,
+            PRESCRIPTION_BANGLA_FONT,
+            prescription_data['patient_info'],
+            prescription[1:],
+            prescription_data['doctor_info']
+        ], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def render_prescription_pdf_bytes(self, prescription_data):
+        """Render a prescription to PDF bytes, serving unchanged prescriptions from the render cache"""
+        cache_key = self.render_cache_key(prescription_data)
+        pdf_bytes = self.pdf_render_cache.get(cache_key)
+        if pdf_bytes is None:
+            html_content = self.create_prescription_html(prescription_data)
+            pdf_bytes = HTML(string=html_content).write_pdf(font_config=FontConfiguration())
+            self.pdf_render_cache.put(cache_key, pdf_bytes)
+        return pdf_bytes
     
     def generate_prescription_pdf(self, prescription_data, output_path=None):
         """Generate professional PDF prescription using WeasyPrint"""
         try:
-            # Create HTML content with professional layout
-            html_content = self.create_prescription_html(prescription_data)
-            
-            # Generate PDF
-            font_config = FontConfiguration()
-            html = HTML(string=html_content)
+            # Render (or fetch from cache) the professional layout
+            pdf_bytes = self.render_prescription_pdf_bytes(prescription_data)
             
             if output_path:
-                html.write_pdf(output_path, font_config=font_config)
+                with open(output_path, 'wb') as f:
+                    f.write(pdf_bytes)
                 return output_path
             else:
                 # Create temporary file
                 with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-                    html.write_pdf(tmp_file.name, font_config=font_config)
+                    tmp_file.write(pdf_bytes)
                     return tmp_file.name
                     
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to generate PDF: {str(e)}")
             return None
     
+    def get_prescription_shell(self, doctor_info):
+        """Return the cached (head, header, tail) HTML shell for a doctor, building it on first use"""
+        key = json.dumps(doctor_info, sort_keys=True, ensure_ascii=False)
+        shell = self.prescription_shell_cache.get(key)
+        if shell is not None:
+            return shell
+        
+        doctor = {k: html.escape(str(doctor_info.get(k) or '')) for k in
+                  ('name', 'degrees', 'designation', 'institution', 'bmdc_reg_no', 'phone', 'address')}
+        
+        head = "".join([
+            '<!DOCTYPE html>\n<html>\n<head>\n<meta charset="UTF-8">\n',
+            '<title>Medical Prescription</title>\n<style>', PRESCRIPTION_CSS, '</style>\n',
+        ])
+        
+        header = "".join([
+            '</head>\n<body>\n',
+            '<div class="prescription-container">\n',
+            '<div class="header">\n',
+            '<div class="doctor-name">Dr. ', doctor['name'], '</div>\n',
+            '<div class="doctor-qualifications">', doctor['degrees'], ' | ', doctor['designation'], '</div>\n',
+            '<div class="doctor-details">', doctor['institution'], '</div>\n',
+            '<div class="doctor-details">BMDC: ', doctor['bmdc_reg_no'], ' | Phone: ', doctor['phone'], '</div>\n',
+            '<div class="doctor-details">', doctor['address'], '</div>\n',
+            '</div>\n',
+            '<div class="prescription-title">MEDICAL PRESCRIPTION</div>\n',
+        ])
+        
+        tail = "".join([
+            '<div class="footer">\n',
+            '<div>Signature: _________________________</div>\n',
+            '<div><strong>Dr. ', doctor['name'], '</strong></div>\n',
+            '<div>', doctor['degrees'], '</div>\n',
+            '<div>', doctor['designation'], '</div>\n',
+            '</div>\n</div>\n</body>\n</html>\n',
+        ])
+        
+        # Saved prescriptions carry their own doctor_info, so keep a few shells around
+        if len(self.prescription_shell_cache) >= 8:
+            self.prescription_shell_cache.clear()
+        self.prescription_shell_cache[key] = (head, header, tail)
+        return head, header, tail
+    
+    def font_face_css(self, text):
+        """Return @font-face rules embedding a subset of the Bangla font for the characters in text"""
+        codepoints = frozenset(map(ord, text)) & BANGLA_CODEPOINTS
+        if not codepoints:
+            return ''
+        
+        css = self.font_face_css_cache.get(codepoints)
+        if css is not None:
+            return css
+        
+        try:
+            font_file = os.path.join(FONTS_DIR, BUNDLED_FONTS[PRESCRIPTION_BANGLA_FONT])
+            font_path = self.font_subset_cache.subset_path(font_file, codepoints)
+            css = "".join([
+                "<style>@font-face { font-family: 'Prescription Bangla'; ",
+                "src: url('", Path(os.path.abspath(font_path)).as_uri(), "'); ",
+                "unicode-range: ", BANGLA_UNICODE_RANGE, "; }</style>\n"
+            ])
+        except Exception as e:
+            # Fall back to whatever Bangla font fontconfig finds
+            print(f"Error preparing Bangla font: {e}")
+            css = ''
+        
+        if len(self.font_face_css_cache) >= 64:
+            self.font_face_css_cache.clear()
+        self.font_face_css_cache[codepoints] = css
+        return css
+    
+    def escape_multiline(self, text, separator='<br>', prefix=''):
+        """HTML-escape text and join its non-empty lines with the given separator"""
+        lines = [prefix + html.escape(line.strip()) for line in (text or '').split('\n') if line.strip()]
+        return separator.join(lines)
+    
+    def render_section(self, title, content):
+        """Render a titled prescription section fragment"""
+        return "".join([
+            '<div class="section">\n<div class="section-title">', title, '</div>\n',
+            '<div class="section-content">', content, '</div>\n</div>\n'
+        ])
+    
+    def render_drugs_fragment(self, drugs_list):
+        """Render the medications fragment"""
+        if not drugs_list:
+            return "<p>No drugs prescribed</p>"
+        
+        parts = []
+        for drug in drugs_list:
+            parts.extend([
+                '<div class="drug-item">\n<div class="drug-formulation">',
+                html.escape(str(drug.get('formulation', ''))), '</div>\n',
+                '<div class="drug-details">', html.escape(str(drug.get('dosage', ''))), '</div>\n',
+                '<div class="drug-details">', html.escape(str(drug.get('duration', ''))), '</div>\n',
+                '<div class="drug-details">', html.escape(str(drug.get('instructions', ''))), '</div>\n',
+                '</div>\n<br>\n'
+            ])
+        return "".join(parts)
+    
     def create_prescription_html(self, prescription_data):
         """Create professional HTML content for prescription with two-column layout"""
         patient_info = prescription_data['patient_info']
         prescription = prescription_data['prescription']
         doctor_info = prescription_data['doctor_info']
         
+        head, header, tail = self.get_prescription_shell(doctor_info)
+        
         # Parse drugs data
         drugs_list = json.loads(prescription[8]) if prescription[8] else []
         
-        # Create drugs HTML
-        drugs_html = ""
-        if drugs_list:
-            for drug in drugs_list:
-                formulation = drug.get('formulation', '')
-                dosage = drug.get('dosage', '')
-                duration = drug.get('duration', '')
-                instructions = drug.get('instructions', '')
-                
-                drugs_html += f"""
-                <div class="drug-item">
-                    <div class="drug-formulation">{formulation}</div>
-                    <div class="drug-details">{dosage}</div>
-                    <div class="drug-details">{duration}</div>
-                    <div class="drug-details">{instructions}</div>
-                </div>
-                <br>
-                """
-        else:
-            drugs_html = "<p>No drugs prescribed</p>"
-        
-        # Format date and time nicely
-        current_datetime = datetime.now()
+        # Format date and time nicely, using the prescription's own date when it has one
+        try:
+            current_datetime = datetime.strptime(prescription[2], "%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            current_datetime = datetime.now()
         prescription_date = current_datetime.strftime("%d/%m/%Y")
         prescription_time = current_datetime.strftime("%I:%M %p")
         
-        # FIXED: Format advice with proper bullets for all lines
-        advice_text = prescription[9] or 'Not specified'
-        if advice_text != 'Not specified':
-            # Add bullet to first line and ensure all lines have bullets
-            advice_lines = advice_text.split('\n')
-            formatted_advice = []
-            for i, line in enumerate(advice_lines):
-                if line.strip():  # Only process non-empty lines
-                    formatted_advice.append(f"- {line.strip()}")
-            advice_display = '<br>'.join(formatted_advice)
-        else:
-            advice_display = 'Not specified'
-        
-        # Create HTML template with two-column layout
-        html_template = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>Medical Prescription</title>
-            <style>
-                @page {{
-                    size: A4;
-                    margin: 0.5in 0.5in 0.5in 0.5in; /* 0.5 inch margins on all sides */
-                }}
-                
-                body {{
-                    font-family: 'Times New Roman', Times, serif;
-                    line-height: 1.3;
-                    color: #000;
-                    margin: 0;
-                    padding: 0;
-                    font-size: 12pt;
-                }}
-                
-                .top-spacer {{
-                    height: 0.8in; /* ADDED: Space at the top to prevent cutting */
-                    width: 100%;
-                }}
-                
-                .prescription-container {{
-                    width: 100%;
-                    height: 100%;
-                    position: relative;
-                }}
-                
-                .header {{
-                    text-align: left;
-                    margin-bottom: 15px;
-                    padding-bottom: 8px;
-                    border-bottom: 1px solid #000;
-                }}
-                
-                .doctor-name {{
-                    font-size: 18pt;  /* Increased from 14pt to 18pt (4pt more) */
-                    font-weight: bold;
-                    margin-bottom: 3px;
-                }}
-                
-                .doctor-qualifications {{
-                    font-size: 15pt;  /* Increased from 11pt to 15pt (4pt more) */
-                    margin-bottom: 2px;
-                }}
-                
-                .doctor-details {{
-                    font-size: 14pt;  /* Increased from 10pt to 14pt (4pt more) */
-                    margin-bottom: 1px;
-                }}
-                
-                .prescription-title {{
-                    text-align: center;
-                    font-size: 14pt;
-                    font-weight: bold;
-                    margin: 10px 0;
-                    text-decoration: underline;
-                }}
-                
-                .patient-info {{
-                    margin: 10px 0;
-                    font-size: 13pt;  /* Increased from 11pt to 13pt (2pt more) */
-                }}
-                
-                .content-wrapper {{
-                    display: flex;
-                    margin-top: 10px;
-                    width: 100%;
-                }}
-                
-                .vertical-line {{
-                    border-left: 2px solid #000;
-                    margin: 0 15px;
-                    height: auto;
-                }}
-                
-                .left-section {{
-                    width: 30%;
-                    padding-right: 10px;
-                }}
-                
-                .right-section {{
-                    width: 70%;
-                    padding-left: 10px;
-                }}
-                
-                .section {{
-                    margin: 8px 0;
-                    page-break-inside: avoid;
-                }}
-                
-                .section-title {{
-                    font-weight: bold;
-                    margin-bottom: 3px;
-                    font-size: 11pt;
-                }}
-                
-                .section-content {{
-                    margin-left: 5px;
-                    font-size: 11pt;
-                    word-wrap: break-word;
-                }}
-                
-                .drug-item {{
-                    margin: 5px 0;
-                }}
-                
-                .drug-formulation {{
-                    font-weight: bold;
-                }}
-                
-                .drug-details {{
-                    margin-left: 20px;
-                }}
-                
-                .footer {{
-                    margin-top: 20px;
-                    text-align: right;
-                    padding-top: 10px;
-                    font-size: 11pt;
-                }}
-                
-                .bangla-text {{
-                    font-family: 'Times New Roman', Times, serif;
-                    font-size: 11pt;
-                }}
-                
-                .date-time {{
-                    text-align: right;
-                    margin-bottom: 5px;
-                    font-size: 11pt;
-                }}
-                
-                .vitals-list {{
-                    margin-left: 20px;
-                }}
-                
-                .investigations-list {{
-                    margin-left: 20px;
-                }}
-                
-                .advice-list {{
-                    margin-left: 20px;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="prescription-container">
-                <div class="header">
-                    <div class="doctor-name">Dr. {doctor_info['name']}</div>
-                    <div class="doctor-qualifications">{doctor_info['degrees']} | {doctor_info['designation']}</div>
-                    <div class="doctor-details">{doctor_info['institution']}</div>
-                    <div class="doctor-details">BMDC: {doctor_info['bmdc_reg_no']} | Phone: {doctor_info['phone']}</div>
-                    <div class="doctor-details">{doctor_info['address']}</div>
-                </div>
-                
-                <div class="prescription-title">MEDICAL PRESCRIPTION</div>
-                
-                <div class="patient-info">
-                    <strong>Name:</strong> {patient_info[1]} &nbsp;&nbsp;&nbsp;
-                    <strong>Age:</strong> {patient_info[2]} &nbsp;&nbsp;&nbsp;
-                    <strong>Gender:</strong> {patient_info[3]} &nbsp;&nbsp;&nbsp;
-                    <strong>Weight:</strong> {patient_info[4]}kg &nbsp;&nbsp;&nbsp;
-                    <strong>Reg No:</strong> {patient_info[0]} &nbsp;&nbsp;&nbsp;<br>
-                    <strong>Date:</strong> {prescription_date} &nbsp;&nbsp;&nbsp;
-                    <strong>Time:</strong> {prescription_time}
-                </div>
-                
-                <div class="content-wrapper">
-                    <!-- Left Section (Patient Details) - 30% width -->
-                    <div class="left-section">
-                        <div class="section">
-                            <div class="section-title">Chief Complaint:</div>
-                            <div class="section-content">{prescription[3] or 'Not specified'}</div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Vitals:</div>
-                            <div class="section-content">
-                                <div class="vitals-list">{prescription[5].replace('\n', '<br>') or 'Not specified'}</div>
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Systemic Examination:</div>
-                            <div class="section-content">{prescription[6] or 'Not significant'}</div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Diagnosis:</div>
-                            <div class="section-content">{prescription[4] or 'Not specified'}</div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Investigations:</div>
-                            <div class="section-content">
-                                <div class="investigations-list">• {prescription[7].replace('\n', '<br>• ') or 'Not specified'}</div>
-                            </div>
-                        </div>
-                    </div>
-                    
-                    <!-- Vertical Line -->
-                    <div class="vertical-line"></div>
-                    
-                    <!-- Right Section (Medications and Advice) - 70% width -->
-                    <div class="right-section">
-                        <div class="section">
-                            <div class="section-title">Medications:</div>
-                            <div class="section-content">
-                                {drugs_html}
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Advice:</div>
-                            <div class="section-content">
-                                <div class="advice-list">{advice_display}</div>
-                            </div>
-                        </div>
-                        
-                        <div class="section">
-                            <div class="section-title">Follow Up:</div>
-                            <div class="section-content">{prescription[10] or 'Not specified'}</div>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="footer">
-                    <div>Signature: _________________________</div>
-                    <div><strong>Dr. {doctor_info['name']}</strong></div>
-                    <div>{doctor_info['degrees']}</div>
-                    <div>{doctor_info['designation']}</div>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+        name, age, gender, weight, reg_no = (html.escape(str(patient_info[i])) for i in (1, 2, 3, 4, 0))
+        patient_html = "".join([
+            '<div class="patient-info">\n',
+            '<strong>Name:</strong> ', name, ' &nbsp;&nbsp;&nbsp;\n',
+            '<strong>Age:</strong> ', age, ' &nbsp;&nbsp;&nbsp;\n',
+            '<strong>Gender:</strong> ', gender, ' &nbsp;&nbsp;&nbsp;\n',
+            '<strong>Weight:</strong> ', weight, 'kg &nbsp;&nbsp;&nbsp;\n',
+            '<strong>Reg No:</strong> ', reg_no, ' &nbsp;&nbsp;&nbsp;<br>\n',
+            '<strong>Date:</strong> ', prescription_date, ' &nbsp;&nbsp;&nbsp;\n',
+            '<strong>Time:</strong> ', prescription_time, '\n',
+            '</div>\n'
+        ])
+        
+        # Left Section (Patient Details) - 30% width
+        vitals_html = self.escape_multiline(prescription[5]) or 'Not specified'
+        investigations_html = self.escape_multiline(prescription[7], '<br>', '• ') or '• Not specified'
+        left_html = "".join([
+            '<div class="left-section">\n',
+            self.render_section('Chief Complaint:', self.escape_multiline(prescription[3]) or 'Not specified'),
+            self.render_section('Vitals:', '<div class="vitals-list">' + vitals_html + '</div>'),
+            self.render_section('Systemic Examination:', self.escape_multiline(prescription[6]) or 'Not significant'),
+            self.render_section('Diagnosis:', self.escape_multiline(prescription[4]) or 'Not specified'),
+            self.render_section('Investigations:', '<div class="investigations-list">' + investigations_html + '</div>'),
+            '</div>\n'
+        ])
         
-        return html_template
+        # Right Section (Medications and Advice) - 70% width
+        advice_html = self.escape_multiline(prescription[9], '<br>', '- ') or 'Not specified'
+        right_html = "".join([
+            '<div class="right-section">\n',
+            self.render_section('Medications:', self.render_drugs_fragment(drugs_list)),
+            self.render_section('Advice:', '<div class="advice-list">' + advice_html + '</div>'),
+            self.render_section('Follow Up:', html.escape(prescription[10] or '') or 'Not specified'),
+            '</div>\n'
+        ])
+        
+        body_html = "".join([
+            header,
+            patient_html,
+            '<div class="content-wrapper">\n',
+            left_html,
+            '<div class="vertical-line"></div>\n',
+            right_html,
+            '</div>\n',
+            tail
+        ])
+        
+        return head + self.font_face_css(body_html) + body_html
+
 
 def main():
-    app = QApplication(sys.argv)
-    window = MedicalPrescriptionSystemPyQt()
+    parser = argparse.ArgumentParser(description="Medical Prescription System")
+    parser.add_argument('--server', action='store_true',
+                        help="run headless as the clinic database server for other workstations")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address the server listens on (0.0.0.0 to serve the other computers on the network)")
+    parser.add_argument('--port', type=int, default=DEFAULT_SERVER_PORT, help="port the server listens on")
+    parser.add_argument('--connect', metavar='URL',
+                        help="use the clinic server at URL (e.g. http://192.168.0.10:8765) instead of a local database")
+    parser.add_argument('--token', help="the clinic server's token shown by --server; remembered after the first --connect")
+    parser.add_argument('--report', action='store_true', help="print clinic statistics and exit")
+    parser.add_argument('--from', dest='report_from', metavar='YYYY-MM-DD', default='0000-00-00',
+                        help="first day of the report")
+    parser.add_argument('--to', dest='report_to', metavar='YYYY-MM-DD', default=datetime.now().strftime("%Y-%m-%d"),
+                        help="last day of the report")
+    parser.add_argument('--top', type=int, default=20, help="number of diagnoses and drugs to list")
+    parser.add_argument('--diagnosis', help="also count prescriptions whose diagnosis contains this text")
+    parser.add_argument('--csv', metavar='FILE', help="also write the report to a CSV file")
+    parser.add_argument('--rebuild-analytics', action='store_true',
+                        help="recompute the statistics and vitals tables from all prescriptions before reporting")
+    parser.add_argument('--mis-report', metavar='FILE',
+                        help="write age, gender, weight and vitals distributions by diagnosis to a CSV file")
+    parser.add_argument('--maintenance', action='store_true',
+                        help="run the integrity check, ANALYZE, PRAGMA optimize and VACUUM on the database and exit")
+    parser.add_argument('--benchmark', action='store_true',
+                        help="time the main screens on a synthetic clinic in a temporary folder and print JSON results")
+    parser.add_argument('--patients', type=int, default=2000, help="synthetic patients for --benchmark")
+    parser.add_argument('--prescriptions', type=int, default=20000, help="synthetic prescriptions for --benchmark")
+    parser.add_argument('--drugs', type=int, default=5000, help="synthetic drug catalog size for --benchmark")
+    parser.add_argument('--images', type=int, default=100, help="synthetic patient images for --benchmark")
+    parser.add_argument('--repeat', type=int, default=5, help="timed runs of each benchmark")
+    parser.add_argument('--seed', type=int, default=1, help="random seed of the synthetic clinic")
+    parser.add_argument('--output', metavar='FILE', help="write the --benchmark JSON to FILE instead of printing it")
+    parser.add_argument('--baseline', metavar='FILE', help="compare --benchmark results with an earlier JSON file")
+    args, qt_args = parser.parse_known_args()
+    
+    if args.server:
+        ClinicApiServer(args.host, args.port).serve_forever()
+        return
+    
+    if args.benchmark:
+        results = run_benchmark(args.patients, args.prescriptions, args.drugs, args.images,
+                                max(args.repeat, 1), args.seed)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"Benchmark results written to {args.output}")
+        else:
+            print(json.dumps(results, indent=2))
+        if args.baseline:
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                comparison = compare_benchmarks(results, json.load(f))
+            print("\n".join(comparison), file=sys.stderr if not args.output else sys.stdout)
+        return
+    
+    if args.maintenance:
+        conn = sqlite3.connect('medical_prescription.db')
+        initialize_database_schema(conn)
+        conn.close()
+        try:
+            run_database_maintenance('medical_prescription.db', 'medical_prescription_archive.db',
+                                     [task for task, _ in DB_MAINTENANCE_TASKS],
+                                     lambda percent, message: print(message))
+        except DatabaseIntegrityError as e:
+            print(f"Integrity check found problems: {e}")
+            sys.exit(1)
+        print(f"Details in {DB_MAINTENANCE_LOG}")
+        return
+    
+    if args.mis_report:
+        conn = sqlite3.connect('medical_prescription.db')
+        initialize_database_schema(conn)
+        start = time.perf_counter()
+        rows = mis_report(VisitSnapshot.open(conn), args.report_from, args.report_to)
+        write_mis_csv(rows, args.mis_report)
+        print(f"MIS report with {len(rows)} diagnoses written to {args.mis_report} "
+              f"in {time.perf_counter() - start:.1f}s")
+        conn.close()
+        return
+    
+    if args.report or args.rebuild_analytics:
+        conn = sqlite3.connect('medical_prescription.db')
+        initialize_database_schema(conn)
+        if args.rebuild_analytics:
+            print(f"Rebuilt statistics from {rebuild_analytics_rollups(conn)} prescriptions")
+            print(f"Rebuilt vitals for {backfill_vitals(conn)} prescriptions")
+        if args.report:
+            report = analytics_report(conn.cursor(), args.report_from, args.report_to, args.top, args.diagnosis)
+            print(format_analytics_report(report))
+            if args.csv:
+                write_analytics_csv(report, args.csv)
+                print(f"\nCSV written to {args.csv}")
+        conn.close()
+        return
+    
+    api = None
+    if args.connect:
+        if args.token:
+            save_server_token(args.token)
+        token = args.token or load_server_token()
+        if not token:
+            print(f"Give the token printed by the clinic server once: --connect {args.connect} --token TOKEN")
+            sys.exit(1)
+        api = ClinicApiClient(args.connect, token)
+        try:
+            api.prefetch_catalogs()
+        except Exception as e:
+            print(f"Could not reach clinic server at {args.connect}: {e}")
+            sys.exit(1)
+    
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MedicalPrescriptionSystemPyQt(api)
     window.show()
     sys.exit(app.exec_())
 
@@ -0,0 +1,45 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import InteractionChecker
+
+DRUGS = [
+    {"generic_name": "Amoxicillin", "formulation": "Cap. Moxacil 500mg"},
+    {"generic_name": "Paracetamol", "formulation": "Tab. Napa 500mg"},
+]
+CLASSES = [{"class": "Penicillin", "generics": ["Amoxicillin", "Flucloxacillin"]}]
+
+
+class AllergyMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.checker = InteractionChecker(DRUGS, CLASSES)
+        self.blocked = self.checker.blocked_generics([("Penicillin", "rash")])
+
+    def test_catalog_drug_matched_by_generic(self):
+        self.assertEqual(self.checker.allergy_matches("Cap. Moxacil 500mg", self.blocked),
+                         [("amoxicillin", "Penicillin (rash)")])
+        self.assertEqual(self.checker.allergy_matches("Tab. Napa 500mg", self.blocked), [])
+
+    def test_typed_drug_matched_by_generic_or_allergen(self):
+        self.assertEqual(self.checker.allergy_matches("Cap. Flucloxacillin 250mg", self.blocked),
+                         [("flucloxacillin", "Penicillin (rash)")])
+        self.assertEqual(self.checker.allergy_matches("Inj. Benzyl PENICILLIN", self.blocked),
+                         [("penicillin", "Penicillin (rash)")])
+
+    def test_custom_catalog_entry_matched_by_text(self):
+        # add_custom_drug stores the typed name as the generic
+        checker = InteractionChecker(DRUGS + [{"generic_name": "Amoxicillin 250mg", "formulation": "Syr. Amoxicillin 250mg"}],
+                                     CLASSES)
+        blocked = checker.blocked_generics([("Penicillin", "")])
+        self.assertEqual(checker.allergy_matches("Syr. Amoxicillin 250mg", blocked), [("amoxicillin", "Penicillin")])
+
+    def test_typed_drug_needs_whole_word(self):
+        self.assertEqual(self.checker.allergy_matches("Tab. Unrelated 10mg", self.blocked), [])
+        self.assertEqual(self.checker.allergy_matches("Syp. Flucloxacillins", self.blocked), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import ApiError, ClinicApiClient, ClinicApiServer
+
+
+class ClinicApiRoundTripTest(unittest.TestCase):
+    """Runs a real server on an ephemeral localhost port with its database in a temporary folder"""
+
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='clinic_api_test_')
+        os.chdir(self.work_dir)
+        self.server = ClinicApiServer(port=0, token='test-token')
+        port = self.server.start_in_thread()
+        self.client = ClinicApiClient(f"http://127.0.0.1:{port}", 'test-token', cache_ttl=0)
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_patient_round_trip(self):
+        reg_no = self.client.create_patient({'name': "Rahim Uddin", 'age': 40, 'gender': 'Male',
+                                             'weight': 70, 'phone': '01711111111', 'address': 'Dhaka'})
+        self.assertEqual(self.client.list_patients(), [[reg_no, "Rahim Uddin", 40, 'Male', '01711111111', 'Dhaka']])
+
+        self.client.update_patient(reg_no, {'name': "Rahim Uddin Khan", 'age': 41, 'gender': 'Male',
+                                            'weight': 72, 'phone': '01711111111', 'address': 'Khulna'})
+        patient = self.client.get_patient(reg_no)
+        self.assertEqual(patient[1:7], ["Rahim Uddin Khan", 41, 'Male', 72, '01711111111', 'Khulna'])
+        self.assertEqual([row[0] for row in self.client.list_patients("Khan")], [reg_no])
+
+        self.client.delete_patient(reg_no)
+        self.assertEqual(self.client.list_patients(), [])
+        self.assertIsNone(self.client.get_patient(reg_no))
+
+    def test_pruned_change_log_forces_reload(self):
+        since = self.client.poll_changes(-1, timeout=0)['last_seq']
+        for number in range(3):
+            self.client.create_patient({'name': f"Patient {number}", 'age': 30, 'gender': 'Female',
+                                        'weight': 50, 'phone': '', 'address': ''})
+        self.assertEqual(len(self.client.poll_changes(since, timeout=0)['changes']), 3)
+
+        self.server.prune_change_log(keep=1)
+        self.assertTrue(self.client.poll_changes(since, timeout=0).get('reset'))
+        recent = self.client.poll_changes(since + 2, timeout=0)
+        self.assertFalse(recent.get('reset'))
+        self.assertEqual(len(recent['changes']), 1)
+
+    def test_wrong_token_is_rejected(self):
+        intruder = ClinicApiClient(self.base_url, 'wrong-token')
+        try:
+            with self.assertRaises(ApiError) as raised:
+                intruder.list_patients()
+            self.assertEqual(raised.exception.status, 401)
+        finally:
+            intruder.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
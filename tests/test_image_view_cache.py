@@ -0,0 +1,59 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtGui import QColor, QImage
+
+from main import (IMAGE_VIEW_PREVIEW_SIDE, ImageTileView, image_level_cached, image_tile_file, image_view_cache_dir,
+                  read_image_preview, save_image_pyramid)
+
+
+class ImageViewCacheTest(unittest.TestCase):
+    """A PNG is decoded whole once; later opens read the cached JPEG preview and tiles"""
+
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='image_view_cache_test_')
+        os.chdir(self.work_dir)
+        self.image = QImage(4500, 1200, QImage.Format_ARGB32)
+        self.image.fill(QColor(0, 0, 0, 0))  # transparent, which JPEG shows as white
+        self.image.save('scan.png')
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_pyramid_is_saved_and_reused(self):
+        preview, size, clip_reads, full = read_image_preview('scan.png', 1000, 1000)
+        self.assertFalse(clip_reads)
+        self.assertEqual((size.width(), size.height()), (4500, 1200))
+        self.assertEqual((full.width(), full.height()), (4500, 1200))
+        self.assertEqual(preview.width(), 1000)
+
+        cache_dir = image_view_cache_dir('scan.png')
+        save_image_pyramid(full, cache_dir, ImageTileView.TILE_SIZE)
+        for level in (1, 0.5, 0.25):
+            self.assertTrue(image_level_cached(cache_dir, level))
+        self.assertFalse(image_level_cached(cache_dir, 0.125))  # 1125 px wide fits the preview
+        self.assertLessEqual(QImage(os.path.join(cache_dir, 'preview.jpg')).width(), IMAGE_VIEW_PREVIEW_SIDE)
+
+        last_tile = QImage(image_tile_file(cache_dir, 1, 8, 2))
+        self.assertEqual((last_tile.width(), last_tile.height()), (4500 - 8 * 512, 1200 - 2 * 512))
+        self.assertGreater(QColor(last_tile.pixel(0, 0)).lightness(), 245)
+
+        preview, size, clip_reads, full = read_image_preview('scan.png', 1000, 1000)
+        self.assertIsNone(full)
+        self.assertEqual(preview.width(), 1000)
+
+    def test_changed_file_gets_new_cache(self):
+        before = image_view_cache_dir('scan.png')
+        QImage(100, 100, QImage.Format_RGB32).save('scan.png')
+        self.assertNotEqual(image_view_cache_dir('scan.png'), before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PyQt5.QtWidgets import QApplication, QMessageBox
+
+from main import MedicalPrescriptionSystemPyQt, PrescriptionDraftJournal
+
+app = QApplication.instance() or QApplication([])
+
+
+class PrescriptionDraftRestoreTest(unittest.TestCase):
+    """Runs the main window against a database and draft journal in a temporary folder"""
+
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.work_dir = tempfile.mkdtemp(prefix='prescription_draft_test_')
+        os.chdir(self.work_dir)
+        self.patches = {name: getattr(QMessageBox, name) for name in ('information', 'question')}
+        QMessageBox.information = staticmethod(lambda *args, **kwargs: QMessageBox.Ok)
+        QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.Yes)
+        self.window = MedicalPrescriptionSystemPyQt(None)
+        self.window.cursor.execute("INSERT INTO patients (name, age, gender, weight) VALUES ('Karim', '30', 'Male', 60)")
+        self.window.conn.commit()
+
+    def tearDown(self):
+        for name, function in self.patches.items():
+            setattr(QMessageBox, name, function)
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def crash(self):
+        """Write what the journal thread has queued and drop the window without its closeEvent autosave"""
+        self.window.draft_journal.close()
+        self.window.hide()
+        return PrescriptionDraftJournal().state
+
+    def test_save_edit_again_crash_restore(self):
+        window = self.window
+        window.open_patient_for_prescription('1', 'Karim', '30', 'Male')
+        window.cc_entry.setPlainText("Fever for 3 days")
+        window.save_prescription()
+        window.diagnosis_entry.setPlainText("Viral fever")
+        window.autosave_prescription_draft()
+
+        state = self.crash()
+        self.assertFalse(state.get('saved'))
+        restored = MedicalPrescriptionSystemPyQt(None)
+        self.addCleanup(restored.close)
+        self.assertEqual(restored.current_patient['reg_no'], '1')
+        self.assertEqual(restored.cc_entry.toPlainText(), "Fever for 3 days")
+        self.assertEqual(restored.diagnosis_entry.toPlainText(), "Viral fever")
+
+    def test_saved_form_is_not_offered_back(self):
+        window = self.window
+        window.open_patient_for_prescription('1', 'Karim', '30', 'Male')
+        window.cc_entry.setPlainText("Cough")
+        window.save_prescription()
+
+        self.assertTrue(self.crash().get('saved'))
+        QMessageBox.question = staticmethod(lambda *args, **kwargs: self.fail("saved prescription offered back"))
+        restored = MedicalPrescriptionSystemPyQt(None)
+        self.addCleanup(restored.close)
+        self.assertIsNone(restored.current_patient)
+
+    def test_clearing_the_form_drops_the_draft(self):
+        window = self.window
+        window.open_patient_for_prescription('1', 'Karim', '30', 'Male')
+        window.cc_entry.setPlainText("Headache")
+        window.autosave_prescription_draft()
+        window.clear_prescription_form()
+
+        self.assertEqual(self.crash(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import re
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import weight_based_dose
+
+PARACETAMOL = {"generic": "Paracetamol", "mg_per_kg": 15, "max_dose_mg": 1000, "frequency": "1+1+1+1", "max_age": 12}
+TABLET_500 = (PARACETAMOL, 500.0, None)
+SYRUP_120_PER_5ML = (PARACETAMOL, 120.0, 5.0)
+
+
+def dose_mg(text):
+    return float(re.search(r'\(([\d.]+) mg\)', text).group(1))
+
+
+class WeightBasedDoseTest(unittest.TestCase):
+    def test_tablet_too_strong_for_small_child(self):
+        # 8.5 kg needs 127.5 mg: half a 500 mg tablet would be twice that
+        self.assertIsNone(weight_based_dose(TABLET_500, 8.5))
+
+    def test_half_tablet_too_far_below_target(self):
+        # 20 kg needs 300 mg: 250 mg is 17% short, 500 mg would be an overdose
+        self.assertIsNone(weight_based_dose(TABLET_500, 20))
+
+    def test_tablet_rounds_down_within_tolerance(self):
+        self.assertEqual(weight_based_dose(TABLET_500, 34), "1 tab (500 mg) 1+1+1+1")
+
+    def test_max_dose_caps_target(self):
+        self.assertEqual(weight_based_dose(TABLET_500, 100), "2 tab (1000 mg) 1+1+1+1")
+
+    def test_syrup_rounds_down_to_half_ml(self):
+        self.assertEqual(weight_based_dose(SYRUP_120_PER_5ML, 8.5), "5 ml (120 mg) 1+1+1+1")
+        self.assertEqual(weight_based_dose(SYRUP_120_PER_5ML, 12), "7.5 ml (180 mg) 1+1+1+1")
+
+    def test_under_half_a_unit(self):
+        self.assertIsNone(weight_based_dose(SYRUP_120_PER_5ML, 0.3))
+
+    def test_never_above_target_or_far_below(self):
+        for entry in (TABLET_500, SYRUP_120_PER_5ML):
+            for tenth_kg in range(20, 1000, 5):
+                weight = tenth_kg / 10
+                target = min(15 * weight, 1000)
+                text = weight_based_dose(entry, weight)
+                if text is not None:
+                    self.assertLessEqual(dose_mg(text), target + 1e-6, (entry, weight))
+                    self.assertGreaterEqual(dose_mg(text), target * 0.9 - 1e-6, (entry, weight))
+
+
+if __name__ == '__main__':
+    unittest.main()